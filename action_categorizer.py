@@ -9,6 +9,9 @@ class ActionCategorizer:
         self.action_vector_length = action_vector_length
         self.binary_powers = 2 ** np.arange(action_vector_length)
         self.num_categories = 2 ** action_vector_length
+
+        # Lookup table from category number to action vector, row c is the action of category c
+        self.category_actions = (np.arange(self.num_categories)[:, None] & self.binary_powers) > 0
         
     def to_category(self, action:np.ndarray[Any, np.dtype[np.bool_]]):
         """Convert action vector to category number"""
@@ -21,4 +24,16 @@ class ActionCategorizer:
         # For example:
         #   category=5 (binary 101) & binary_powers=[1,2,4] (binary [001,010,100])
         #   = [1,0,4] which becomes [True,False,True] after comparing >0
-        return (category & self.binary_powers) > 0
\ No newline at end of file
+        return (category & self.binary_powers) > 0
+
+    def to_categories(self, actions:np.ndarray) -> np.ndarray:
+        """Convert a (..., action_vector_length) array of action vectors to an int64 array of category numbers"""
+        return np.asarray(actions, dtype=np.int64) @ self.binary_powers
+
+    def to_actions(self, categories:np.ndarray, out:np.ndarray | None = None) -> np.ndarray:
+        """Convert an array of category numbers to a (..., action_vector_length) bool array of action vectors"""
+        categories = np.asarray(categories)
+        if categories.size > 0 and (categories.min() < 0 or categories.max() >= self.num_categories):
+            raise IndexError(f"Categories must be in [0, {self.num_categories}), got {categories.min()} to {categories.max()}")
+        # The range is checked above, so mode="clip" never clips, it lets np.take write straight into out
+        return np.take(self.category_actions, categories, axis=0, out=out, mode="clip")
@@ -22,3 +22,28 @@ def test_action_categorizer_roundtrip(action_length):
         # Verify action vector has correct shape and type
         assert action_vector.shape == (action_length,)
         
+
+
+@pytest.mark.parametrize("action_length", [3, 4, 5])
+def test_batched_conversion_matches_single(action_length):
+    categorizer = ActionCategorizer(action_length)
+    rng = np.random.default_rng(0)
+    categories = rng.integers(0, categorizer.num_categories, size=(7, 5))
+
+    actions = categorizer.to_actions(categories)
+    assert actions.shape == (7, 5, action_length)
+    assert actions.dtype == bool
+    for category, action in zip(categories.ravel(), actions.reshape(-1, action_length)):
+        assert np.array_equal(action, categorizer.to_action(category))
+
+    assert np.array_equal(categorizer.to_categories(actions), categories)
+
+    out = np.zeros((7, 5, action_length), dtype=bool)
+    assert categorizer.to_actions(categories, out=out) is out
+    assert np.array_equal(out, actions)
+
+    with pytest.raises(IndexError):
+        categorizer.to_actions(np.array([0, categorizer.num_categories]))
+    with pytest.raises(IndexError):
+        categorizer.to_actions(np.array([-1, 0]))
+
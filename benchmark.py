@@ -0,0 +1,363 @@
+import dataclasses
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+import cv2
+import numpy as np
+import torch
+import config
+from action_categorizer import ActionCategorizer
+from environment import Environment, Car
+from frame_preprocessing import preprocess_frames
+from history_digest import HistoryDigest, HistoryDigestBank
+from model import Model
+from recorded_dataset import RecordedDataset
+from recorder import PngRecordingWriter
+from shard_recording import ShardRecordingWriter
+from vector_environment import VectorEnvironment
+
+@dataclasses.dataclass
+class BenchmarkSweep:
+    """The parameter values every benchmark is run with"""
+    num_cars: list[int]
+    map_sizes: list[int] # square maps of this many pixels per side
+    batch_sizes: list[int]
+    recording_formats: list[str]
+    num_recorded_frames: int
+    num_envs: list[int] # worker processes of the vector environment
+    startup_commands: list[str] # keys of STARTUP_COMMANDS
+    training_profiles: list[str] # keys of TRAINING_PROFILES
+
+FULL_SWEEP = BenchmarkSweep(
+    num_cars=[1, 10, 100, 1000],
+    map_sizes=[512, 2048],
+    batch_sizes=[1, 32, 128],
+    recording_formats=["png", "shards"],
+    num_recorded_frames=512,
+    num_envs=[1, 2, 4],
+    startup_commands=["cli_help", "drive_by_hand", "train"],
+    training_profiles=["fp32", "bf16", "channels_last", "bf16_channels_last", "compiled", "accumulate_4", "threads_1"],
+)
+
+QUICK_SWEEP = BenchmarkSweep(
+    num_cars=[1, 10],
+    map_sizes=[256],
+    batch_sizes=[1, 8],
+    recording_formats=["png", "shards"],
+    num_recorded_frames=64,
+    num_envs=[1, 2],
+    startup_commands=["cli_help", "drive_by_hand", "train"],
+    training_profiles=["fp32", "bf16_channels_last"],
+)
+
+# Training settings compared by bench_training, each overrides the defaults of lit_module.TRAINING_PROFILE_DEFAULTS
+TRAINING_PROFILES = {
+    "fp32": {},
+    "bf16": {"precision": "bf16-mixed"},
+    "channels_last": {"channels_last": True},
+    "bf16_channels_last": {"precision": "bf16-mixed", "channels_last": True},
+    "compiled": {"compile": True},
+    "accumulate_4": {"accumulate_grad_batches": 4},
+    "threads_1": {"num_threads": 1},
+}
+
+@dataclasses.dataclass
+class BenchmarkResult:
+    name: str
+    params: dict
+    seconds_per_call: float # median over the timed rounds
+    num_calls: int
+
+    @property
+    def key(self) -> str:
+        """Identifies the measurement across runs, so a result can be matched with its baseline"""
+        params_str = ",".join(f"{name}={value}" for name, value in sorted(self.params.items()))
+        return f"{self.name}[{params_str}]"
+
+def time_call(function:Callable[[], object], min_time:float, num_rounds:int = 5) -> tuple[float, int]:
+    """
+    Time function, returning the median seconds per call and the number of timed calls.
+    The calls are split into rounds of equal size that together take about min_time,
+    the median round is reported so a single stall does not skew the result.
+    """
+    # The first call warms up caches and lazily created buffers
+    start_time = time.perf_counter()
+    function()
+    first_call_time = time.perf_counter() - start_time
+
+    calls_per_round = max(1, int(min_time / num_rounds / max(first_call_time, 1e-9)))
+    round_times = []
+    for _ in range(num_rounds):
+        start_time = time.perf_counter()
+        for _ in range(calls_per_round):
+            function()
+        round_times.append((time.perf_counter() - start_time) / calls_per_round)
+
+    return statistics.median(round_times), calls_per_round * num_rounds
+
+def create_synthetic_map(map_path:Path, map_size:int):
+    """A grey map with a grid of white roads, so views contain edges like the real map"""
+    map_image = np.full((map_size, map_size, 3), 90, dtype=np.uint8)
+    for position in range(0, map_size, 64):
+        map_image[position:position + 12, :] = 230
+        map_image[:, position:position + 12] = 230
+    cv2.imwrite(str(map_path), map_image)
+
+def create_environment(map_path:Path, num_cars:int) -> Environment:
+    # The road maps of the synthetic maps are cached next to them, in the work directory
+    env = Environment(map_path, headless=True, road_map_cache_dir=map_path.parent / "map_cache")
+    rng = np.random.default_rng(0)
+    for _ in range(num_cars):
+        env.add_car(Car(
+            env=env,
+            x=rng.uniform(0, env.map_width),
+            y=rng.uniform(0, env.map_height),
+            angle_deg=rng.uniform(0, 360),
+            speed=rng.uniform(10, 40),
+        ))
+    return env
+
+def create_synthetic_recording(recording_dir:Path, recording_format:str, num_frames:int):
+    rng = np.random.default_rng(0)
+    writer = ShardRecordingWriter(recording_dir) if recording_format == "shards" else PngRecordingWriter(recording_dir)
+    for frame_index in range(num_frames):
+        view = rng.integers(0, 256, size=(config.view_height, config.view_width, 3), dtype=np.uint8)
+        writer.write(frame_index, view, rng.integers(0, 2, size=4).astype(bool))
+    writer.close()
+
+def bench_environment(work_dir:Path, sweep:BenchmarkSweep, min_time:float) -> list[BenchmarkResult]:
+    results = []
+    for map_size in sweep.map_sizes:
+        map_path = work_dir / f"map_{map_size}.png"
+        create_synthetic_map(map_path, map_size)
+        for num_cars in sweep.num_cars:
+            env = create_environment(map_path, num_cars)
+            params = {"num_cars": num_cars, "map_size": map_size}
+            actions = np.random.default_rng(0).integers(0, 2, size=(num_cars, 4)).astype(bool)
+            dt = 1 / config.fps
+
+            seconds, num_calls = time_call(lambda: env.update(actions, dt), min_time)
+            results.append(BenchmarkResult("environment_update", params, seconds, num_calls))
+
+            seconds, num_calls = time_call(env.get_observations, min_time)
+            results.append(BenchmarkResult("environment_get_observations", params, seconds, num_calls))
+    return results
+
+def bench_vector_environment(work_dir:Path, sweep:BenchmarkSweep, min_time:float) -> list[BenchmarkResult]:
+    """Time a step of the vector environment, which steps and renders every car of every environment"""
+    results = []
+    map_size = sweep.map_sizes[-1]
+    map_path = work_dir / f"map_{map_size}.png"
+    create_synthetic_map(map_path, map_size)
+    for num_envs in sweep.num_envs:
+        for num_cars in sweep.num_cars:
+            with VectorEnvironment(num_envs, num_cars=num_cars, map_paths=map_path, road_map_cache_dir=map_path.parent / "map_cache") as vector_env:
+                actions = np.random.default_rng(0).integers(0, 2, size=(len(vector_env), 4)).astype(bool)
+                params = {"num_envs": num_envs, "num_cars": num_cars, "map_size": map_size}
+                seconds, num_calls = time_call(lambda: vector_env.step(actions), min_time)
+                results.append(BenchmarkResult("vector_environment_step", params, seconds, num_calls))
+    return results
+
+def bench_history_digest(sweep:BenchmarkSweep, min_time:float) -> list[BenchmarkResult]:
+    results = []
+    window_sizes = HistoryDigest.from_window_growth_rate(num_windows=10, growth_rate=1.5).window_sizes
+    action = np.array([True, False, True, False])
+
+    history_digest = HistoryDigest(window_sizes)
+    history_digest.fill(np.zeros(4))
+    seconds, num_calls = time_call(lambda: history_digest.push(action), min_time)
+    results.append(BenchmarkResult("history_digest_push", {}, seconds, num_calls))
+    seconds, num_calls = time_call(history_digest.get_window_averages_numpy, min_time)
+    results.append(BenchmarkResult("history_digest_get_window_averages_numpy", {}, seconds, num_calls))
+
+    for num_cars in sweep.num_cars:
+        history_digest_bank = HistoryDigestBank(window_sizes, num_sequences=num_cars, value_shape=(4,))
+        history_digest_bank.fill(np.zeros(4))
+        actions = np.tile(action, (num_cars, 1))
+        params = {"num_cars": num_cars}
+        seconds, num_calls = time_call(lambda: history_digest_bank.push(actions), min_time)
+        results.append(BenchmarkResult("history_digest_bank_push", params, seconds, num_calls))
+        seconds, num_calls = time_call(history_digest_bank.get_window_averages_numpy, min_time)
+        results.append(BenchmarkResult("history_digest_bank_get_window_averages_numpy", params, seconds, num_calls))
+    return results
+
+def bench_recorded_dataset(work_dir:Path, sweep:BenchmarkSweep, min_time:float) -> list[BenchmarkResult]:
+    results = []
+    for recording_format in sweep.recording_formats:
+        data_dir = work_dir / f"data_{recording_format}"
+        create_synthetic_recording(data_dir / "recording_0", recording_format, sweep.num_recorded_frames)
+        dataset = RecordedDataset(
+            data_dir=data_dir,
+            history_digest=HistoryDigest.from_window_growth_rate(num_windows=10, growth_rate=1.5),
+            action_categorizer=ActionCategorizer(4),
+        )
+        for batch_size in sweep.batch_sizes:
+            # Read the items of one batch, cycling through the recording so no frame is cached
+            indices = np.arange(batch_size)
+            def get_batch():
+                for index in indices:
+                    dataset[index]
+                indices[:] = (indices + batch_size) % len(dataset)
+
+            params = {"recording_format": recording_format, "batch_size": batch_size}
+            seconds, num_calls = time_call(get_batch, min_time)
+            results.append(BenchmarkResult("recorded_dataset_getitem", params, seconds / batch_size, num_calls * batch_size))
+    return results
+
+def bench_model(sweep:BenchmarkSweep, min_time:float, image_size:int = 64) -> list[BenchmarkResult]:
+    results = []
+    model = Model(num_action_classes=16, action_history_shape=(10, 4)).eval()
+    for batch_size in sweep.batch_sizes:
+        frames = torch.rand((batch_size, 3, image_size, image_size))
+        action_histories = torch.rand((batch_size, 10, 4))
+        def forward():
+            with torch.inference_mode():
+                model(frames, action_histories)
+
+        params = {"batch_size": batch_size, "image_size": image_size}
+        seconds, num_calls = time_call(forward, min_time)
+        results.append(BenchmarkResult("model_forward", params, seconds, num_calls))
+    return results
+
+def bench_preprocess_frames(sweep:BenchmarkSweep, min_time:float, image_size:int = 64) -> list[BenchmarkResult]:
+    results = []
+    rng = np.random.default_rng(0)
+    for batch_size in sweep.batch_sizes:
+        views = torch.from_numpy(rng.integers(0, 256, size=(batch_size, config.view_height, config.view_width, 3), dtype=np.uint8))
+        out = torch.empty((batch_size, 3, image_size, image_size))
+
+        params = {"batch_size": batch_size, "image_size": image_size}
+        seconds, num_calls = time_call(lambda: preprocess_frames(views, image_size, out=out), min_time)
+        results.append(BenchmarkResult("preprocess_frames", params, seconds, num_calls))
+    return results
+
+def bench_training(sweep:BenchmarkSweep, min_time:float) -> list[BenchmarkResult]:
+    """
+    Time training steps of the model on random batches with each training profile, as the trainer runs them.
+    Results are seconds per sample, so samples per second is their inverse.
+    """
+    # Imported here so the other benchmarks run without lightning
+    import yaml
+    from lit_module import LitModule
+
+    with open(config.project_root / "config.yaml", "r") as f:
+        model_config = yaml.load(f, Loader=yaml.SafeLoader)
+    batch_size = max(sweep.batch_sizes)
+    image_size = model_config["image_size"]
+    num_windows = model_config["history_digest"]["num_windows"]
+    action_vector_length = model_config["action_vector_length"]
+    generator = torch.Generator().manual_seed(0)
+    batch = {
+        "frame": torch.rand((batch_size, 3, image_size, image_size), generator=generator),
+        "action_category": torch.randint(0, 2**action_vector_length, (batch_size,), generator=generator),
+        "action_history": torch.rand((batch_size, num_windows, action_vector_length), generator=generator),
+    }
+
+    results = []
+    default_num_threads = torch.get_num_threads()
+    for profile_name in sweep.training_profiles:
+        module = LitModule({**model_config, "training": TRAINING_PROFILES[profile_name]})
+        profile = module.get_training_profile()
+        module.configure_model()
+        module.train()
+        optimizer = module.configure_optimizers()
+        if profile["num_threads"] is not None:
+            torch.set_num_threads(profile["num_threads"])
+
+        step_index = 0
+        def training_step():
+            nonlocal step_index
+            with torch.autocast("cpu", dtype=torch.bfloat16, enabled=profile["precision"] == "bf16-mixed"):
+                loss = module.compute_loss(batch)
+            (loss / profile["accumulate_grad_batches"]).backward()
+            step_index += 1
+            if step_index % profile["accumulate_grad_batches"] == 0:
+                optimizer.step()
+                optimizer.zero_grad()
+
+        params = {"profile": profile_name, "batch_size": batch_size, "image_size": image_size}
+        try:
+            seconds, num_calls = time_call(training_step, min_time)
+        finally:
+            torch.set_num_threads(default_num_threads)
+        results.append(BenchmarkResult("training_step", params, seconds / batch_size, num_calls * batch_size))
+    return results
+
+# Python snippets timed from a fresh interpreter, the startup cost of each way the CLI is used
+STARTUP_COMMANDS = {
+    "cli_help": "import sys; sys.argv = ['main.py', '--help']; import main; main.cli(standalone_mode=False)",
+    "drive_by_hand": "import game",
+    "train": "import lightning, lit_module",
+}
+
+def bench_startup(sweep:BenchmarkSweep, min_time:float) -> list[BenchmarkResult]:
+    results = []
+    for command_name in sweep.startup_commands:
+        code = STARTUP_COMMANDS[command_name]
+        def start():
+            subprocess.run([sys.executable, "-c", code], cwd=config.project_root, check=True, stdout=subprocess.DEVNULL)
+        seconds, num_calls = time_call(start, min_time)
+        results.append(BenchmarkResult("startup", {"command": command_name}, seconds, num_calls))
+    return results
+
+def run_benchmarks(sweep:BenchmarkSweep = FULL_SWEEP, min_time:float = 1.0) -> list[BenchmarkResult]:
+    """Run every benchmark of the sweep, each measurement is timed for about min_time seconds"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        return [
+            *bench_environment(work_dir, sweep, min_time),
+            *bench_vector_environment(work_dir, sweep, min_time),
+            *bench_history_digest(sweep, min_time),
+            *bench_recorded_dataset(work_dir, sweep, min_time),
+            *bench_preprocess_frames(sweep, min_time),
+            *bench_model(sweep, min_time),
+            *bench_training(sweep, min_time),
+            *bench_startup(sweep, min_time),
+        ]
+
+def save_results(results:list[BenchmarkResult], path:Path):
+    report = {
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+        },
+        "results": [dataclasses.asdict(result) for result in results],
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+def load_results(path:Path) -> list[BenchmarkResult]:
+    with open(path, "r") as f:
+        report = json.load(f)
+    return [BenchmarkResult(**result) for result in report["results"]]
+
+def find_regressions(results:list[BenchmarkResult], baseline:list[BenchmarkResult], tolerance:float) -> list[tuple[BenchmarkResult, BenchmarkResult]]:
+    """The (result, baseline result) pairs where the result is more than tolerance slower than its baseline"""
+    baseline_by_key = {result.key: result for result in baseline}
+    regressions = []
+    for result in results:
+        baseline_result = baseline_by_key.get(result.key)
+        if baseline_result is not None and result.seconds_per_call > baseline_result.seconds_per_call * (1 + tolerance):
+            regressions.append((result, baseline_result))
+    return regressions
+
+def format_results(results:list[BenchmarkResult], baseline:list[BenchmarkResult] | None = None) -> str:
+    baseline_by_key = {result.key: result for result in baseline or []}
+    lines = []
+    for result in results:
+        line = f"{result.key:<70} {result.seconds_per_call * 1e6:12.1f} us"
+        baseline_result = baseline_by_key.get(result.key)
+        if baseline_result is not None:
+            line += f"  {result.seconds_per_call / baseline_result.seconds_per_call:6.2f}x baseline"
+        lines.append(line)
+    return "\n".join(lines)
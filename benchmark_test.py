@@ -0,0 +1,38 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pytest
+import benchmark
+from benchmark import BenchmarkResult, BenchmarkSweep
+
+
+def test_benchmarks_run_and_roundtrip(tmp_path):
+    sweep = BenchmarkSweep(num_cars=[2], map_sizes=[128], batch_sizes=[2], recording_formats=["png", "shards"], num_recorded_frames=4, num_envs=[1], startup_commands=["cli_help"], training_profiles=["fp32", "bf16_channels_last", "accumulate_4"])
+    results = benchmark.run_benchmarks(sweep, min_time=0.001)
+
+    names = {result.name for result in results}
+    assert {"environment_update", "environment_get_observations", "vector_environment_step", "history_digest_push", "recorded_dataset_getitem", "model_forward", "training_step", "startup"} <= names
+    assert all(result.seconds_per_call > 0 for result in results)
+    assert len({result.key for result in results}) == len(results)
+
+    benchmark.save_results(results, tmp_path / "results.json")
+    assert benchmark.load_results(tmp_path / "results.json") == results
+
+
+def test_find_regressions():
+    baseline = [
+        BenchmarkResult("a", {"num_cars": 1}, 1.0, 10),
+        BenchmarkResult("a", {"num_cars": 10}, 1.0, 10),
+    ]
+    results = [
+        BenchmarkResult("a", {"num_cars": 1}, 1.2, 10),
+        BenchmarkResult("a", {"num_cars": 10}, 1.3, 10),
+        BenchmarkResult("b", {}, 5.0, 10),
+    ]
+
+    regressions = benchmark.find_regressions(results, baseline, tolerance=0.25)
+    assert [(result.key, baseline_result.key) for result, baseline_result in regressions] == [("a[num_cars=10]", "a[num_cars=10]")]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -5,11 +5,16 @@ project_root = Path(__file__).parent
 fps = 15
 view_width = 96
 view_height = 96
+render_at_image_size = False # render the views straight at the model's image size instead of resizing them
 training_width = 64
 training_height = 64
 view_display_width = 100
 view_display_height = 100
 num_cars = 10
+seed = None # seeds car placement and action sampling, None picks a fresh seed every run
+inference_latency = 0 # frames between observing and acting, 1 overlaps inference with the rest of the frame
+inference_engine_names = ["eager", "traced", "compiled", "int8"] # here so the CLI can list them without importing torch
+int8_calibration_frames = 256 # recorded frames the int8 engine calibrates its activation ranges on
 
 car_width = 6
 car_height = 10 
@@ -18,8 +23,22 @@ car_acceleration = 60
 car_deceleration = 8
 car_max_steering_ratio = 5 #deg/distance
 car_steering_ratio_speed = 15 #deg/distance/second
+car_color = (255, 0, 0)
+car_sprite_angles = 360 # number of pre-rotated car sprites, one per 1 deg
 map_path = project_root / "map-with-roads-in-city-children-road-for-toy-vector-37977821.jpg"
+road_map_cache_dir = project_root / "map_cache" # drivable masks and distance fields keyed by map hash
+map_tile_size = 512 # pixels per side of the tiles of a tiled map
+map_tile_cache_mb = 256 # memory budget for the tiles of a tiled map kept in memory
 
 recording_dir = project_root / "recorded_data"
+recorder_queue_size = 256 # frames waiting to be written
+recorder_num_writers = 2 # background writer threads
+recorder_backpressure = "block" # "block" or "drop" when the queue is full
+recording_format = "png" # "png" files or memory-mappable "shards"
+recording_frames_per_shard = 4096
+recording_index_interval = 256 # frames between rewrites of a shard recording's index
+record_fleet = False # record every car into its own recording, not only car 0
+record_car_indices = None # cars recorded in fleet mode, None records all of them
+record_car_states = False # also record x, y, angle, speed and steering ratio of each car in fleet mode
 random_action_on_duration = 0.1
 random_action_off_duration = 0.1
\ No newline at end of file
@@ -1,82 +1,270 @@
 import pygame
 import numpy as np
 import config
-import cv2
 import dataclasses
+import functools
+import os
 from pathlib import Path
+from observation_renderer import ObservationRenderer
+from spatial_grid import SpatialGrid, oriented_boxes_overlap
+from road_map import RoadMap
+from tiled_map import ArrayMap, TiledMap, is_tiled_map
 
 class Environment:
-    def __init__(self, map_path: Path):
+    """
+    Cars driving on a map. The map is an image loaded whole, or for maps too large for memory
+    a directory of tiles built by tiled_map.build_tiled_map, which is only read around the cars.
+    """
+    def __init__(self,
+        map_path: Path,
+        headless: bool = False,
+        observation_size: tuple[int, int] | None = None,
+        road_map_cache_dir: Path = config.road_map_cache_dir,
+    ):
+        if headless:
+            # Use SDL's dummy video driver so no display is needed
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        self.headless = headless
         pygame.init()
           
-        # Load the map image first to get its dimensions
-        self.map_image = pygame.image.load(map_path)
-        self.map_width, self.map_height = self.map_image.get_size()
-        
-        # Create surface matching map dimensions
-        self.surface = pygame.Surface((self.map_width, self.map_height))
+        self.map_image: pygame.Surface | None = None
+        if is_tiled_map(map_path):
+            # Tiles are read on demand, the road map was built when the map was tiled
+            self.map_source = TiledMap(map_path)
+            self.road_map = self.map_source.load_road_map()
+        else:
+            # Keep the map as a uint8 (h,w,c) array once, so no frame needs a transpose
+            self.map_image = pygame.image.load(map_path)
+            self.map_source = ArrayMap(np.ascontiguousarray(np.transpose(pygame.surfarray.array3d(self.map_image), (1, 0, 2))))
+            # Where the road is, built once per map image and cached on disk
+            self.road_map = RoadMap.load_or_build(map_path, cache_dir=road_map_cache_dir)
+        self.map_width, self.map_height = self.map_source.width, self.map_source.height
+
+        # Renders each car's view straight from the map, without rendering the full surface
+        self.observation_renderer = ObservationRenderer(
+            map_source=self.map_source,
+            view_width=config.view_width,
+            view_height=config.view_height,
+            car_length=config.car_height,
+            car_width=config.car_width,
+            car_color=config.car_color,
+            output_size=observation_size,
+        )
+        # The width and height of the rendered views, the view window itself is always view_width by view_height map pixels
+        self.observation_width = self.observation_renderer.output_width
+        self.observation_height = self.observation_renderer.output_height
         
+        # The state of every car lives in the fleet, the Car objects are views into it
+        self.fleet = CarFleet(self.map_width, self.map_height)
         self.cars: list[Car] = []
 
+        # Cars bucketed by position, a cell is as large as the distance at which a car can appear in a view
+        self.grid = SpatialGrid(
+            self.map_width,
+            self.map_height,
+            cell_size=self.observation_renderer.view_radius + self.observation_renderer.car_radius,
+        )
+        # A finer grid for collisions, a cell is as large as the distance at which two cars can touch
+        self.collision_grid = SpatialGrid(self.map_width, self.map_height, cell_size=2 * self.observation_renderer.car_radius)
+        self.events = StepEvents.empty()
+
+        # Rectangles covered by the cars in the last render, None until the first full render
+        self.car_rects: list[pygame.Rect] | None = None
+
     def add_car(self, car: "Car"):
         self.cars.append(car)
 
-    def update(self, actions: list["Action"], dt: float):
-        # Update all cars
-        for car, action in zip(self.cars, actions):
-            car.update(action=action, dt=dt)
+    def add_random_cars(self, num_cars: int, rng: np.random.Generator):
+        """Add num_cars cars at random positions and headings, driving at a random speed"""
+        for _ in range(num_cars):
+            car = Car(
+                env=self,
+                x=rng.integers(0, self.map_width), 
+                y=rng.integers(0, self.map_height), 
+                angle_deg=rng.uniform(0, 360), 
+                speed=rng.uniform(10, 40), 
+            )
+            self.add_car(car)
+
+    def update(self, actions: "np.ndarray | list[Action]", dt: float) -> "StepEvents":
+        # Update all cars in one batch. Actions are stacked into an (N,4) array
+        actions = np.asarray(actions, dtype=bool).reshape(-1, 4)
+        was_on_road = self.road_map.is_on_road(self.fleet.x, self.fleet.y)
+        self.fleet.update(actions=actions, dt=dt)
+        on_road = self.road_map.is_on_road(self.fleet.x, self.fleet.y)
+
+        # Report the cars that overlap or are off the road after the step
+        self.events = StepEvents(
+            collisions=self.find_collisions(),
+            off_road=np.flatnonzero(~on_road),
+            left_road=np.flatnonzero(was_on_road & ~on_road),
+        )
+        return self.events
+
+    def get_road_distances(self) -> np.ndarray:
+        """The signed distance of every car to the road edge, positive on the road"""
+        return self.road_map.get_distance(self.fleet.x, self.fleet.y)
+
+    def reset_cars(self, indices: np.ndarray, rng: np.random.Generator):
+        """Put the cars at random places on the road, standing still with a random heading"""
+        x, y = self.road_map.sample_road_positions(len(indices), rng, min_distance=self.observation_renderer.car_radius)
+        self.fleet.x[indices] = x
+        self.fleet.y[indices] = y
+        self.fleet.angle_deg[indices] = rng.uniform(0, 360, size=len(indices))
+        self.fleet.speed[indices] = 0.0
+        self.fleet.steering_ratio[indices] = 0.0
+
+    def find_collisions(self) -> np.ndarray:
+        """The (M,2) index pairs i < j of cars whose rectangles overlap"""
+        # Only cars whose bounding circles touch can overlap
+        self.collision_grid.rebuild(self.fleet.x, self.fleet.y)
+        pairs = self.collision_grid.find_pairs(self.fleet.x, self.fleet.y, radius=self.collision_grid.cell_size)
+        first, second = pairs[:, 0], pairs[:, 1]
+        x, y, angle_deg = self.fleet.x, self.fleet.y, self.fleet.angle_deg
+        overlap = oriented_boxes_overlap(
+            x[first], y[first], angle_deg[first],
+            x[second], y[second], angle_deg[second],
+            length=config.car_height, width=config.car_width,
+        )
+        return pairs[overlap]
+
+    def get_cars_near(self, index: int, radius: float) -> np.ndarray:
+        """The sorted indices of the other cars whose centre is within radius of car index"""
+        self.grid.rebuild(self.fleet.x, self.fleet.y)
+        if radius > self.grid.cell_size:
+            # Past the cell size the box query would visit most of the grid
+            distances = np.hypot(self.fleet.x - self.fleet.x[index], self.fleet.y - self.fleet.y[index])
+            near = np.flatnonzero(distances <= radius)
+        else:
+            near = self.grid.query_radius(self.fleet.x, self.fleet.y, self.fleet.x[index], self.fleet.y[index], radius)
+        return near[near != index]
+
+    @functools.cached_property
+    def surface(self) -> pygame.Surface:
+        """The whole map with the cars on it, only created when the whole map is rendered"""
+        if self.map_image is None:
+            raise ValueError("A tiled map is never rendered whole, use render_region")
+        return pygame.Surface((self.map_width, self.map_height))
 
     def render(self) -> pygame.Surface:
         
-        # Draw the map
-        self.surface.blit(self.map_image, (0, 0))
+        if self.car_rects is None:
+            # Draw the whole map once
+            self.surface.blit(self.map_image, (0, 0))
+        else:
+            # Restore only the map under the cars drawn last frame
+            self.surface.blits([(self.map_image, rect, rect) for rect in self.car_rects], doreturn=False)
         
-        # Draw all cars
-        for car in self.cars:
-            car.draw(self.surface)
+        # Draw all cars and remember where they were drawn
+        self.car_rects = [car.draw(self.surface) for car in self.cars]
         
         return self.surface
 
-    def get_observations(self) -> list["Observation"]:
+    def render_region(self, x: int, y: int, width: int, height: int) -> pygame.Surface:
+        """Render the part of the map with its top left corner at x, y, reading only the map around it"""
+        region = np.zeros((height, width, 3), dtype=np.uint8)
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.map_width), min(y + height, self.map_height)
+        if x0 < x1 and y0 < y1:
+            self.map_source.read_region(x0, y0, x1, y1, out=region[y0 - y:y1 - y, x0 - x:x1 - x])
+        surface = pygame.surfarray.make_surface(region.transpose(1, 0, 2))
 
-        self.render()
+        # Draw the cars that reach into the region, in car order
+        self.grid.rebuild(self.fleet.x, self.fleet.y)
+        half_size = max(width, height) / 2 + self.observation_renderer.car_radius
+        for index in np.sort(self.grid.query_box(x + width / 2, y + height / 2, half_size)):
+            self.cars[index].draw(surface, offset=(x, y))
+        return surface
 
-        # Convert to numpy array
-        surface_np = pygame.surfarray.array3d(surface=self.surface) # (w,h,c)
-        surface_np = np.transpose(surface_np, (1, 0, 2)) # (h,w,c)
+    def get_views(self, out: np.ndarray | None = None) -> np.ndarray:
+        """Render the views of all cars as one (N,h,w,c) uint8 array, optionally into out"""
+        # Cars may have moved or been added since the last step
+        self.grid.rebuild(self.fleet.x, self.fleet.y)
+        return self.observation_renderer.render_views(
+            x=self.fleet.x,
+            y=self.fleet.y,
+            angle_deg=self.fleet.angle_deg,
+            out=out,
+            grid=self.grid,
+        )
+
+    def get_observations(self) -> list["Observation"]:
 
-        # Get views for all cars
-        observations = [car.get_observation(surface_np) for car in self.cars]
+        # Get views for all cars in one batch
+        views = self.get_views()
+        observations = [Observation(view=view) for view in views]
         
         return observations
 
-class Car:
-    def __init__(self,env: "Environment", x: float, y: float, angle_deg: float = 0.0, speed: float = 0.0):
-        self.x = x
-        self.y = y
-        self.angle_deg = angle_deg  
-        self.speed = speed
-        self.steering_ratio = 0.0
-        self.env = env
-        self.width = config.car_width  # car width in pixels
-        self.length = config.car_height  # car length in pixels
-        self.view_width = config.view_width
-        self.view_height = config.view_height
-        self.random_action_enabled = False
+@dataclasses.dataclass
+class StepEvents:
+    """What happened in one step of the environment"""
+    collisions: np.ndarray # (M,2) index pairs i < j of cars overlapping after the step
+    off_road: np.ndarray # indices of the cars off the road after the step
+    left_road: np.ndarray # indices of the cars that went off the road in the step
+
+    @classmethod
+    def empty(cls) -> "StepEvents":
+        no_cars = np.zeros(0, dtype=np.int64)
+        return cls(collisions=np.zeros((0, 2), dtype=np.int64), off_road=no_cars, left_road=no_cars)
+
+class CarFleet:
+    """
+    Struct-of-arrays state for all cars in an environment.
+    Each car is one index into contiguous x, y, angle_deg, speed and steering_ratio arrays,
+    so the whole fleet is stepped with a handful of batched numpy operations.
+    """
+    def __init__(self, map_width: int, map_height: int, capacity: int = 16):
+        self.map_width = map_width
+        self.map_height = map_height
+        self.size = 0
+        self._state = np.zeros((5, capacity))
+        self._bind_views()
+
+    def __len__(self) -> int:
+        return self.size
 
+    def _bind_views(self):
+        # Each field is a contiguous row of the state array, trimmed to the number of cars
+        self.x = self._state[0, :self.size]
+        self.y = self._state[1, :self.size]
+        self.angle_deg = self._state[2, :self.size]
+        self.speed = self._state[3, :self.size]
+        self.steering_ratio = self._state[4, :self.size]
 
-    def update(self, action: "Action", dt: float):
+    def get_states(self) -> np.ndarray:
+        """A copy of the state of every car as an (N,5) array of x, y, angle_deg, speed and steering_ratio"""
+        return self._state[:, :self.size].T.copy()
 
-        left, right, forward, backward = action
+    def add(self, x: float, y: float, angle_deg: float = 0.0, speed: float = 0.0) -> int:
+        """Add a car to the fleet and return its index"""
+        capacity = self._state.shape[1]
+        if self.size == capacity:
+            # Double the capacity so adding many cars stays cheap
+            state = np.zeros((5, capacity * 2))
+            state[:, :capacity] = self._state
+            self._state = state
+
+        index = self.size
+        self.size += 1
+        self._bind_views()
+        self._state[:, index] = (x, y, angle_deg, speed, 0.0)
+        return index
+
+    def update(self, actions: np.ndarray, dt: float):
+        """Step the kinematics of every car from an (N,4) boolean action array"""
+
+        left, right, forward, backward = actions.T.astype(np.float64)
 
         # Update the speed
         target_speed = config.car_max_speed * forward - config.car_max_speed * backward
-        if forward or backward:
-            acceleration = config.car_acceleration * dt
-        else:
-            acceleration = config.car_deceleration * dt
-
+        acceleration = np.where(
+            (forward + backward) > 0,
+            config.car_acceleration * dt,
+            config.car_deceleration * dt,
+        )
         self.speed += np.clip(target_speed - self.speed, -acceleration, acceleration)
+
         # Steering ratio connect distance to degrees turned.
         # This is a simple model of the car's steering.
         steering_ratio_target = config.car_max_steering_ratio * right - config.car_max_steering_ratio * left
@@ -87,41 +275,105 @@ class Car:
         self.angle_deg += self.steering_ratio * self.speed * dt
 
         # Update position
-        self.x += self.speed * np.cos(np.radians(self.angle_deg)) * dt
-        self.y += self.speed * np.sin(np.radians(self.angle_deg)) * dt
+        angle_rad = np.radians(self.angle_deg)
+        self.x += self.speed * np.cos(angle_rad) * dt
+        self.y += self.speed * np.sin(angle_rad) * dt
 
-        # Keep car in bounds
-        self.x = np.clip(self.x, 0, self.env.map_width)
-        self.y = np.clip(self.y, 0, self.env.map_height)
+        # Keep cars in bounds
+        np.clip(self.x, 0, self.map_width, out=self.x)
+        np.clip(self.y, 0, self.map_height, out=self.y)
 
-    def draw(self, surface: pygame.Surface):
-        # Create a rectangle for the car
-        car_rect = pygame.Surface((self.length, self.width), pygame.SRCALPHA)
-        pygame.draw.rect(car_rect, (255, 0, 0), (0, 0, self.length, self.width))
-        
-        # Rotate the car rectangle
-        rotated_car = pygame.transform.rotate(car_rect, -self.angle_deg)
-        new_rect = rotated_car.get_rect(center=(self.x, self.y))
+class Car:
+    """
+    A lightweight view of one car in the environment's CarFleet.
+    Creating a Car reserves its slot in the fleet, reading or writing its attributes
+    reads or writes the fleet arrays.
+    """
+    def __init__(self,env: "Environment", x: float, y: float, angle_deg: float = 0.0, speed: float = 0.0):
+        self.env = env
+        self.fleet = env.fleet
+        self.index = env.fleet.add(x=x, y=y, angle_deg=angle_deg, speed=speed)
+        self.width = config.car_width  # car width in pixels
+        self.length = config.car_height  # car length in pixels
+        self.color = config.car_color
+        self.sprites = CarSprites.for_car(length=self.length, width=self.width, color=self.color)
+        self.view_width = config.view_width
+        self.view_height = config.view_height
+        self.random_action_enabled = False
+
+    @property
+    def x(self) -> float:
+        return self.fleet.x[self.index]
+
+    @x.setter
+    def x(self, value: float):
+        self.fleet.x[self.index] = value
+
+    @property
+    def y(self) -> float:
+        return self.fleet.y[self.index]
+
+    @y.setter
+    def y(self, value: float):
+        self.fleet.y[self.index] = value
+
+    @property
+    def angle_deg(self) -> float:
+        return self.fleet.angle_deg[self.index]
+
+    @angle_deg.setter
+    def angle_deg(self, value: float):
+        self.fleet.angle_deg[self.index] = value
+
+    @property
+    def speed(self) -> float:
+        return self.fleet.speed[self.index]
+
+    @speed.setter
+    def speed(self, value: float):
+        self.fleet.speed[self.index] = value
+
+    @property
+    def steering_ratio(self) -> float:
+        return self.fleet.steering_ratio[self.index]
+
+    @steering_ratio.setter
+    def steering_ratio(self, value: float):
+        self.fleet.steering_ratio[self.index] = value
+
+    def draw(self, surface: pygame.Surface, offset: tuple[int, int] = (0, 0)) -> pygame.Rect:
+        """Draw the car on a surface whose top left corner is at offset on the map, and return the rectangle it covers"""
+        # Get the car rectangle pre-rotated to the nearest quantized angle
+        rotated_car = self.sprites.get(self.angle_deg)
+        new_rect = rotated_car.get_rect(center=(self.x - offset[0], self.y - offset[1]))
         
         # Draw the car on the surface
-        surface.blit(rotated_car, new_rect.topleft)
+        return surface.blit(rotated_car, new_rect.topleft)
+
+class CarSprites:
+    """
+    Car rectangles pre-rotated at quantized angles.
+    The sprites are built once per car size and colour and shared by every car that looks the same.
+    """
+    def __init__(self, length: int, width: int, color: tuple[int, int, int], num_angles: int):
+        # Create a rectangle for the car
+        car_rect = pygame.Surface((length, width), pygame.SRCALPHA)
+        pygame.draw.rect(car_rect, color, (0, 0, length, width))
 
-    def get_observation(self, surface_image: np.ndarray) -> "Observation":
+        # Rotate the car rectangle to every quantized angle
+        self.angle_step = 360 / num_angles
+        self.sprites = [pygame.transform.rotate(car_rect, -i * self.angle_step) for i in range(num_angles)]
 
-        M = cv2.getRotationMatrix2D(
-            center=(self.x,self.y),
-            angle=self.angle_deg+90,
-            scale=1.0,
-        )
-        M[0,2] += self.view_width/2 - self.x
-        M[1,2] += self.view_height/2 - self.y
-        view = cv2.warpAffine(surface_image,M,(self.view_width,self.view_height))
+    @classmethod
+    @functools.cache
+    def for_car(cls, length: int, width: int, color: tuple[int, int, int], num_angles: int = config.car_sprite_angles) -> "CarSprites":
+        return cls(length=length, width=width, color=color, num_angles=num_angles)
+
+    def get(self, angle_deg: float) -> pygame.Surface:
+        """Get the sprite rotated to the quantized angle nearest to angle_deg"""
+        index = round(angle_deg / self.angle_step) % len(self.sprites)
+        return self.sprites[index]
 
-        observation = Observation(
-            view=view,
-        )
-        return observation
-      
 @dataclasses.dataclass
 class Observation:
     view: np.ndarray
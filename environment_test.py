@@ -0,0 +1,110 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pygame
+import pytest
+import config
+from environment import Environment, Car, CarSprites
+
+
+def render_full(env: Environment) -> np.ndarray:
+    """Render the map and every car from scratch"""
+    surface = pygame.Surface((env.map_width, env.map_height))
+    surface.blit(env.map_image, (0, 0))
+    for car in env.cars:
+        car.draw(surface)
+    return pygame.surfarray.array3d(surface)
+
+
+def test_incremental_render_matches_full_render():
+    env = Environment(config.map_path, headless=True)
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        env.add_car(Car(env, x=rng.uniform(0, env.map_width), y=rng.uniform(0, env.map_height), angle_deg=rng.uniform(0, 360), speed=20))
+
+    for _ in range(10):
+        actions = rng.integers(0, 2, size=(len(env.cars), 4)).astype(bool)
+        env.update(actions=actions, dt=1/config.fps)
+        surface = env.render()
+        assert np.array_equal(pygame.surfarray.array3d(surface), render_full(env))
+
+
+def reference_car_update(car: dict, action: np.ndarray, dt: float, map_width: int, map_height: int):
+    """One car stepped on its own, the kinematics of Car.update before the cars were batched into CarFleet"""
+    left, right, forward, backward = action
+
+    target_speed = config.car_max_speed * forward - config.car_max_speed * backward
+    if forward or backward:
+        acceleration = config.car_acceleration * dt
+    else:
+        acceleration = config.car_deceleration * dt
+    car["speed"] += np.clip(target_speed - car["speed"], -acceleration, acceleration)
+
+    steering_ratio_target = config.car_max_steering_ratio * right - config.car_max_steering_ratio * left
+    steering_ratio_speed = config.car_steering_ratio_speed * dt
+    car["steering_ratio"] += np.clip(steering_ratio_target - car["steering_ratio"], -steering_ratio_speed, steering_ratio_speed)
+
+    car["angle_deg"] += car["steering_ratio"] * car["speed"] * dt
+
+    car["x"] += car["speed"] * np.cos(np.radians(car["angle_deg"])) * dt
+    car["y"] += car["speed"] * np.sin(np.radians(car["angle_deg"])) * dt
+
+    car["x"] = np.clip(car["x"], 0, map_width)
+    car["y"] = np.clip(car["y"], 0, map_height)
+
+
+def test_fleet_update_matches_per_car_update(tmp_path):
+    env = Environment(config.map_path, headless=True, road_map_cache_dir=tmp_path / "cache")
+    rng = np.random.default_rng(0)
+    env.add_random_cars(40, rng)
+    # Fast cars heading into every wall, so the clamping to the map is stepped too
+    for x, y, angle_deg in [(1, 300, 180), (env.map_width - 1, 300, 0), (300, 1, 270), (300, env.map_height - 1, 90), (0, 0, 225)]:
+        env.add_car(Car(env, x=x, y=y, angle_deg=angle_deg, speed=config.car_max_speed))
+    cars = [{"x": car.x, "y": car.y, "angle_deg": car.angle_deg, "speed": car.speed, "steering_ratio": car.steering_ratio} for car in env.cars]
+
+    dt = 1 / config.fps
+    for step in range(30):
+        actions = rng.integers(0, 2, size=(len(cars), 4)).astype(bool)
+        # The wall cars keep driving forward into the wall
+        actions[-5:] = [False, False, True, False]
+        was_on_road = np.array([env.road_map.is_on_road(np.array([car["x"]]), np.array([car["y"]]))[0] for car in cars])
+
+        events = env.update(actions=actions, dt=dt)
+        for car, action in zip(cars, actions):
+            reference_car_update(car, action, dt, env.map_width, env.map_height)
+
+        for key in cars[0]:
+            assert np.allclose(getattr(env.fleet, key), [car[key] for car in cars], rtol=1e-12, atol=1e-9), f"{key} differs at step {step}"
+        on_road = np.array([env.road_map.is_on_road(np.array([car["x"]]), np.array([car["y"]]))[0] for car in cars])
+        assert np.array_equal(events.off_road, np.flatnonzero(~on_road))
+        assert np.array_equal(events.left_road, np.flatnonzero(was_on_road & ~on_road))
+
+    assert len(events.off_road) > 0
+    # The wall cars end up against the walls
+    assert np.array_equal(env.fleet.x[-5:-3], [0, env.map_width])
+    assert np.array_equal(env.fleet.y[-3:-1], [0, env.map_height])
+    assert (env.fleet.x[-1], env.fleet.y[-1]) == (0, 0)
+
+
+@pytest.mark.parametrize("angle_deg, expected_index", [
+    (0.0, 0),
+    (0.4, 0),
+    (0.6, 1),
+    (359.6, 0),
+    (-1.0, 359),
+    (721.0, 1),
+])
+def test_car_sprites_quantize_angle(angle_deg, expected_index):
+    sprites = CarSprites.for_car(length=config.car_height, width=config.car_width, color=config.car_color, num_angles=360)
+    assert sprites.get(angle_deg) is sprites.sprites[expected_index]
+
+
+def test_car_sprites_are_shared():
+    first = CarSprites.for_car(length=config.car_height, width=config.car_width, color=config.car_color)
+    second = CarSprites.for_car(length=config.car_height, width=config.car_width, color=config.car_color)
+    assert first is second
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,119 @@
+import dataclasses
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import config
+
+@dataclasses.dataclass
+class EpisodeMetrics:
+    """Driving metrics of one headless episode, averaged over its cars"""
+    seed: int
+    num_steps: int
+    num_cars: int
+    distance_travelled: float # pixels per car over the episode
+    stuck_fraction: float # fraction of car steps pressed against the map bounds
+    off_road_fraction: float # fraction of car steps off the road
+    collisions_per_step: float
+    action_distribution: list[float] # fraction of car steps each action category was taken
+    simulation_steps_per_second: float
+    inference_frames_per_second: float # car views run through the model per second of inference
+
+def run_episode(
+    checkpoint_path: Path,
+    seed: int,
+    num_steps: int,
+    num_cars: int,
+    engine: str = "eager",
+    num_threads: int | None = None,
+) -> EpisodeMetrics:
+    """Drive num_cars cars, placed on the road from seed, with the model for num_steps steps and measure how they drive"""
+    # Imported here so worker processes only pay for torch and pygame when they run an episode
+    import torch
+    from game import Game
+
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    game = Game(checkpoint_path, headless=True, engine=engine, seed=seed, num_cars=num_cars)
+    game.setup()
+    env = game.env
+    fleet = env.fleet
+    env.reset_cars(np.arange(num_cars), game.rng)
+    dt = 1 / config.fps
+
+    distance_travelled = np.zeros(num_cars)
+    stuck_count = 0
+    off_road_count = 0
+    collision_count = 0
+    category_counts = np.zeros(game.action_categorizer.num_categories, dtype=np.int64)
+    inference_time = 0.0
+
+    start_time = time.perf_counter()
+    for _ in range(num_steps):
+        game.get_observations()
+        inference_start_time = time.perf_counter()
+        actions = game.get_model_actions()
+        inference_time += time.perf_counter() - inference_start_time
+
+        previous_x, previous_y = fleet.x.copy(), fleet.y.copy()
+        events = env.update(actions=actions, dt=dt)
+
+        distance_travelled += np.hypot(fleet.x - previous_x, fleet.y - previous_y)
+        stuck_count += np.count_nonzero((fleet.x <= 0) | (fleet.x >= fleet.map_width) | (fleet.y <= 0) | (fleet.y >= fleet.map_height))
+        off_road_count += len(events.off_road)
+        collision_count += len(events.collisions)
+        category_counts += np.bincount(game.action_categorizer.to_categories(actions), minlength=len(category_counts))
+    elapsed_time = time.perf_counter() - start_time
+    game.close()
+
+    num_car_steps = max(num_steps * num_cars, 1)
+    return EpisodeMetrics(
+        seed=seed,
+        num_steps=num_steps,
+        num_cars=num_cars,
+        distance_travelled=float(distance_travelled.mean()),
+        stuck_fraction=stuck_count / num_car_steps,
+        off_road_fraction=off_road_count / num_car_steps,
+        collisions_per_step=collision_count / max(num_steps, 1),
+        action_distribution=(category_counts / num_car_steps).tolist(),
+        simulation_steps_per_second=num_steps / max(elapsed_time, 1e-9),
+        inference_frames_per_second=num_steps * num_cars / max(inference_time, 1e-9),
+    )
+
+def evaluate_checkpoint(
+    checkpoint_path: Path,
+    num_episodes: int,
+    num_steps: int,
+    num_cars: int = config.num_cars,
+    num_workers: int = 1,
+    engine: str = "eager",
+    first_seed: int = 0,
+) -> list[EpisodeMetrics]:
+    """
+    Run num_episodes episodes seeded first_seed, first_seed + 1, ... in num_workers processes.
+    Every checkpoint evaluated with the same seeds starts its cars from the same places.
+    """
+    seeds = list(range(first_seed, first_seed + num_episodes))
+    # Share the cores between the workers instead of every worker starting a thread per core
+    num_threads = max(1, multiprocessing.cpu_count() // num_workers)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as executor:
+        futures = [
+            executor.submit(run_episode, checkpoint_path, seed, num_steps, num_cars, engine, num_threads)
+            for seed in seeds
+        ]
+        return [future.result() for future in futures]
+
+def summarize_episodes(episodes: list[EpisodeMetrics]) -> dict:
+    """The mean of every metric over the episodes"""
+    return {
+        "num_episodes": len(episodes),
+        "distance_travelled": float(np.mean([episode.distance_travelled for episode in episodes])),
+        "stuck_fraction": float(np.mean([episode.stuck_fraction for episode in episodes])),
+        "off_road_fraction": float(np.mean([episode.off_road_fraction for episode in episodes])),
+        "collisions_per_step": float(np.mean([episode.collisions_per_step for episode in episodes])),
+        "action_distribution": np.mean([episode.action_distribution for episode in episodes], axis=0).tolist(),
+        "simulation_steps_per_second": float(np.mean([episode.simulation_steps_per_second for episode in episodes])),
+        "inference_frames_per_second": float(np.mean([episode.inference_frames_per_second for episode in episodes])),
+    }
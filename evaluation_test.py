@@ -0,0 +1,55 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import lightning as L
+import pytest
+import torch
+import yaml
+import config
+import evaluation
+from lit_module import LitModule
+
+
+@pytest.fixture
+def checkpoint_path(tmp_path):
+    """A checkpoint of an untrained model"""
+    with open(config.project_root / "config.yaml", "r") as f:
+        model_config = yaml.load(f, Loader=yaml.SafeLoader)
+    torch.manual_seed(0)
+    model = LitModule(model_config)
+    checkpoint_path = tmp_path / "untrained.ckpt"
+    # The fields of a Trainer checkpoint that load_from_checkpoint reads
+    torch.save({
+        "state_dict": model.state_dict(),
+        LitModule.CHECKPOINT_HYPER_PARAMS_KEY: dict(model.hparams),
+        LitModule.CHECKPOINT_HYPER_PARAMS_NAME: "config",
+        "pytorch-lightning_version": L.__version__,
+    }, checkpoint_path)
+    return checkpoint_path
+
+
+def test_evaluation_is_reproducible(checkpoint_path):
+    episodes = evaluation.evaluate_checkpoint(checkpoint_path, num_episodes=2, num_steps=5, num_cars=3, num_workers=2)
+
+    assert [episode.seed for episode in episodes] == [0, 1]
+    for episode in episodes:
+        assert episode.num_steps == 5 and episode.num_cars == 3
+        assert sum(episode.action_distribution) == pytest.approx(1.0)
+        assert 0 <= episode.stuck_fraction <= 1
+        assert episode.distance_travelled >= 0
+        # Every car starts on the road
+        assert episode.off_road_fraction < 1
+
+    # The same seed drives the same episode
+    repeated = evaluation.run_episode(checkpoint_path, seed=1, num_steps=5, num_cars=3)
+    assert repeated.distance_travelled == pytest.approx(episodes[1].distance_travelled)
+    assert repeated.action_distribution == episodes[1].action_distribution
+    # The episode's fleet size is the game's own, not a change to the config
+    assert config.num_cars != 3
+
+    summary = evaluation.summarize_episodes(episodes)
+    assert summary["num_episodes"] == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,28 @@
+from typing import Hashable
+from collections import OrderedDict
+import numpy as np
+
+class FrameCache:
+    """A least recently used cache of decoded frames or map tiles, bounded by a memory budget"""
+    def __init__(self, max_bytes:int):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.frames:OrderedDict[Hashable, np.ndarray] = OrderedDict()
+
+    def get(self, key:Hashable) -> np.ndarray | None:
+        frame = self.frames.get(key)
+        if frame is not None:
+            self.frames.move_to_end(key)
+        return frame
+
+    def put(self, key:Hashable, frame:np.ndarray):
+        if frame.nbytes > self.max_bytes or key in self.frames:
+            return
+
+        self.frames[key] = frame
+        self.num_bytes += frame.nbytes
+
+        # Evict the least recently used frames until the cache fits the budget
+        while self.num_bytes > self.max_bytes:
+            _, evicted_frame = self.frames.popitem(last=False)
+            self.num_bytes -= evicted_frame.nbytes
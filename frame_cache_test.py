@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from frame_cache import FrameCache
+
+
+def make_frame(value):
+    return np.full((96, 96, 3), value, dtype=np.uint8)
+
+
+def test_frame_cache_evicts_least_recently_used():
+    frame_bytes = make_frame(0).nbytes
+    cache = FrameCache(max_bytes=2 * frame_bytes)
+
+    cache.put("a", make_frame(1))
+    cache.put("b", make_frame(2))
+    # Using "a" makes "b" the least recently used frame
+    assert cache.get("a")[0, 0, 0] == 1
+    cache.put("c", make_frame(3))
+
+    assert cache.get("b") is None
+    assert cache.get("a")[0, 0, 0] == 1
+    assert cache.get("c")[0, 0, 0] == 3
+    assert cache.num_bytes == 2 * frame_bytes
+
+
+def test_disabled_frame_cache_stores_nothing():
+    cache = FrameCache(max_bytes=0)
+    cache.put("a", make_frame(1))
+
+    assert cache.get("a") is None
+    assert cache.num_bytes == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,38 @@
+import torch
+import torch.nn as nn
+from torch.utils.data import default_collate
+
+def preprocess_frames(frames:torch.Tensor, image_size:int, out:torch.Tensor | None = None) -> torch.Tensor:
+    """
+    Convert a (B,H,W,C) uint8 batch of frames to the (B,C,image_size,image_size) float model input in [0, 1].
+    The frames are resized while still uint8 and channels last, which the antialiased bilinear resize
+    has a fast path for, then converted and scaled in one op into out if it is given.
+    Training and inference both call this, so the model sees bit-identical inputs for identical frames.
+    """
+    frames = frames.permute(0, 3, 1, 2) # a channels last view, nothing is copied
+    if frames.shape[-2:] != (image_size, image_size):
+        frames = nn.functional.interpolate(
+            frames,
+            size=(image_size, image_size),
+            mode="bilinear",
+            antialias=True,
+            align_corners=False,
+        )
+    if out is None:
+        out = torch.empty(frames.shape, dtype=torch.float32, device=frames.device)
+    return torch.div(frames, 255, out=out)
+
+def collate_frames(items:list[dict], image_size:int) -> dict:
+    """
+    Collate dataset items and preprocess the batch of their uint8 frames, in the DataLoader workers.
+    Recordings may have been recorded at different view sizes, a batch mixing them is resized one frame at a time.
+    """
+    frames = [torch.as_tensor(item["frame"]) for item in items]
+    batch = default_collate([{key: value for key, value in item.items() if key != "frame"} for item in items])
+    if all(frame.shape == frames[0].shape for frame in frames):
+        batch["frame"] = preprocess_frames(torch.stack(frames), image_size)
+    else:
+        batch["frame"] = torch.empty((len(frames), frames[0].shape[-1], image_size, image_size), dtype=torch.float32)
+        for frame, out in zip(frames, batch["frame"]):
+            preprocess_frames(frame[None], image_size, out=out[None])
+    return batch
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+import torch
+from frame_preprocessing import collate_frames, preprocess_frames
+
+
+def make_item(rng, view_size):
+    return {
+        "frame": rng.integers(0, 256, size=(view_size, view_size, 3), dtype=np.uint8),
+        "action": rng.random(4).astype(np.float32),
+    }
+
+
+def test_collate_resizes_a_batch_of_mixed_view_sizes():
+    rng = np.random.default_rng(0)
+    items = [make_item(rng, view_size) for view_size in [64, 96, 96, 64]]
+
+    batch = collate_frames(items, image_size=64)
+    assert batch["frame"].shape == (4, 3, 64, 64)
+    assert batch["action"].shape == (4, 4)
+    # Each frame is preprocessed exactly as in a batch of its own size
+    for item, frame in zip(items, batch["frame"]):
+        expected = preprocess_frames(torch.as_tensor(item["frame"])[None], image_size=64)[0]
+        assert torch.equal(frame, expected)
+
+
+def test_collate_batch_of_one_view_size():
+    rng = np.random.default_rng(0)
+    items = [make_item(rng, 96) for _ in range(3)]
+
+    batch = collate_frames(items, image_size=64)
+    expected = preprocess_frames(torch.as_tensor(np.stack([item["frame"] for item in items])), image_size=64)
+    assert torch.equal(batch["frame"], expected)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,105 @@
+import csv
+import time
+from pathlib import Path
+import numpy as np
+
+class FrameTimer:
+    """
+    Times the stages of each frame of the game loop.
+    Call start_frame at the start of a frame, lap(stage) as each stage finishes and end_frame
+    at the end. A stage takes the time since the previous lap, stages a frame skips take 0.
+    The last window frames are kept for rolling percentiles, every frame can also be
+    written to a CSV file and to TensorBoard.
+    """
+    enabled = True
+
+    def __init__(self,
+        stage_names:list[str],
+        window:int = 300,
+        csv_path:Path | None = None,
+        tensorboard_dir:Path | None = None,
+    ):
+        self.stage_names = stage_names
+        self.window = window
+
+        # Ring buffer of stage times in seconds, one row per frame
+        self.frame_times = np.zeros((window, len(stage_names)))
+        self.frame_count = 0
+        self.current_frame = np.zeros(len(stage_names))
+        self.lap_time = 0.0
+
+        self.csv_file = None
+        if csv_path is not None:
+            csv_path.parent.mkdir(parents=True, exist_ok=True)
+            self.csv_file = open(csv_path, "w", newline="")
+            self.csv_writer = csv.writer(self.csv_file)
+            self.csv_writer.writerow(["frame", *stage_names, "total"])
+
+        self.tensorboard_writer = None
+        if tensorboard_dir is not None:
+            # Only imported when TensorBoard export is asked for
+            from torch.utils.tensorboard import SummaryWriter
+            self.tensorboard_writer = SummaryWriter(log_dir=str(tensorboard_dir))
+
+    def start_frame(self):
+        self.current_frame[:] = 0
+        self.lap_time = time.perf_counter()
+
+    def lap(self, stage:int):
+        """Finish stage, the index of its name in stage_names"""
+        now = time.perf_counter()
+        self.current_frame[stage] += now - self.lap_time
+        self.lap_time = now
+
+    def end_frame(self):
+        self.frame_times[self.frame_count % self.window] = self.current_frame
+        self.frame_count += 1
+
+        if self.csv_file is not None:
+            self.csv_writer.writerow([self.frame_count, *self.current_frame.tolist(), self.current_frame.sum()])
+
+        if self.tensorboard_writer is not None:
+            stage_times_ms = dict(zip(self.stage_names, (self.current_frame * 1000).tolist()))
+            self.tensorboard_writer.add_scalars("frame_time_ms", stage_times_ms, global_step=self.frame_count)
+
+    def get_percentiles(self, percentiles:tuple[float, ...] = (50, 95, 99)) -> np.ndarray:
+        """(len(percentiles), num_stages) stage times in seconds over the last window frames"""
+        num_frames = min(self.frame_count, self.window)
+        if num_frames == 0:
+            return np.zeros((len(percentiles), len(self.stage_names)))
+        return np.percentile(self.frame_times[:num_frames], percentiles, axis=0)
+
+    def format_percentiles(self) -> list[str]:
+        """One line per stage with its p50/p95/p99 in milliseconds"""
+        p50, p95, p99 = self.get_percentiles() * 1000
+        return [
+            f"{name:<18} p50 {p50[i]:6.2f}  p95 {p95[i]:6.2f}  p99 {p99[i]:6.2f} ms"
+            for i, name in enumerate(self.stage_names)
+        ]
+
+    def close(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+        if self.tensorboard_writer is not None:
+            self.tensorboard_writer.close()
+            self.tensorboard_writer = None
+
+class NullFrameTimer:
+    """Stands in for a FrameTimer when timing is disabled, every call does nothing"""
+    enabled = False
+
+    def start_frame(self):
+        pass
+
+    def lap(self, stage:int):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def format_percentiles(self) -> list[str]:
+        return []
+
+    def close(self):
+        pass
@@ -0,0 +1,52 @@
+import csv
+import numpy as np
+import pytest
+from frame_timer import FrameTimer, NullFrameTimer
+
+
+def test_percentiles_over_rolling_window():
+    timer = FrameTimer(["a", "b"], window=4)
+    for frame_time in [10.0, 1.0, 2.0, 3.0, 4.0]:
+        timer.current_frame[:] = [frame_time, 2 * frame_time]
+        timer.end_frame()
+
+    # The first frame has left the window
+    p50, p95, p99 = timer.get_percentiles()
+    assert np.allclose(p50, [2.5, 5.0])
+    assert np.all(p99 <= [4.0, 8.0])
+    assert len(timer.format_percentiles()) == 2
+
+
+def test_laps_and_csv_export(tmp_path):
+    csv_path = tmp_path / "frame_times.csv"
+    timer = FrameTimer(["a", "b", "c"], csv_path=csv_path)
+    for _ in range(3):
+        timer.start_frame()
+        timer.lap(0)
+        timer.lap(2)
+        timer.end_frame()
+    timer.close()
+
+    with open(csv_path, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["frame", "a", "b", "c", "total"]
+    assert len(rows) == 4
+    for row in rows[1:]:
+        a, b, c, total = map(float, row[1:])
+        # Skipped stages take no time
+        assert b == 0
+        assert a >= 0 and c >= 0
+        assert total == pytest.approx(a + c)
+
+
+def test_null_timer_does_nothing():
+    timer = NullFrameTimer()
+    timer.start_frame()
+    timer.lap(0)
+    timer.end_frame()
+    assert not timer.enabled
+    assert timer.format_percentiles() == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
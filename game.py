@@ -1,12 +1,37 @@
 import time
-from environment import Environment, Car, Observation, Action
+import dataclasses
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from environment import Environment, Observation, Action
 import numpy as np
 import pygame
 import config
 from recorder import Recorder
-import torch
 from pathlib import Path
-from lit_module import LitModule
+from frame_timer import FrameTimer, NullFrameTimer
+
+if TYPE_CHECKING:
+    # torch and lightning are only imported when a model is loaded, driving by hand never needs them
+    import torch
+    from lit_module import LitModule
+
+# The stages of a frame timed by the frame timer, in loop order
+FRAME_STAGES = ["get_observations", "get_model_actions", "draw_screen", "handle_events", "env_update", "recorder_record", "frame_wait"]
+OBSERVE_STAGE, INFER_STAGE, DRAW_STAGE, EVENTS_STAGE, UPDATE_STAGE, RECORD_STAGE, WAIT_STAGE = range(len(FRAME_STAGES))
+
+@dataclasses.dataclass
+class InferenceSlot:
+    """The buffers for one frame of inference: views, model inputs and the sampled actions"""
+    views: np.ndarray # (N,h,w,c) uint8
+    observations: list[Observation] # views into views
+    views_tensor: "torch.Tensor | None" # shares its memory with views, the model inputs are None without a model
+    frame_batch: "torch.Tensor | None" # (N,c,image_size,image_size) float model input
+    history_batch: "torch.Tensor | None" # (N,num_windows,action_length) float
+    logit_max: "torch.Tensor | None" # (N,1) float, the largest logit of every car
+    action_weights: "torch.Tensor | None" # (N,num_categories) float, the unnormalized action probabilities
+    sampled_categories: "torch.Tensor | None" # (N,1) int64
+    actions: np.ndarray # (N,4) bool
 
 class Game:
     screen: pygame.Surface
@@ -15,73 +40,299 @@ class Game:
     keys_pressed: dict[int, bool] 
     running: bool = False
 
-    def __init__(self, checkpoint_path: Path):
+    def __init__(self,
+        checkpoint_path: Path | None,
+        headless: bool = False,
+        engine: str = "eager",
+        device: str = "cpu",
+        inference_latency: int = config.inference_latency,
+        seed: int | None = config.seed,
+        frame_timer: FrameTimer | NullFrameTimer | None = None,
+        show_frame_times: bool = False,
+        record_fleet: bool = config.record_fleet,
+        record_car_indices: list[int] | None = config.record_car_indices,
+        render_at_image_size: bool = config.render_at_image_size,
+        num_cars: int = config.num_cars,
+    ):
         self.checkpoint_path = checkpoint_path
+        self.headless = headless
+        self.engine_name = engine
+        self.device = device
+        self.inference_latency = inference_latency
+        self.frame_timer = frame_timer if frame_timer is not None else NullFrameTimer()
+        self.show_frame_times = show_frame_times and self.frame_timer.enabled
+        self.record_fleet = record_fleet
+        self.record_car_indices = record_car_indices
+        self.render_at_image_size = render_at_image_size
+        self.num_cars = num_cars
+
+        # One seed drives the car placement, the random actions and the action sampling
+        self.rng = np.random.default_rng(seed)
+        self.sampling_seed = int(self.rng.integers(2**63))
+        self.screen_size = (800, 600)
         self.random_action_start_time = time.time()
         self.random_action = self.generate_random_action()
    
 
     def setup(self):
 
-        self.load_model(self.checkpoint_path)
-
-        # Initialize pygame
-        pygame.init()
-        
-        # Create environment with a blank map
-        self.env = Environment(config.map_path)
-        self.recorder = Recorder(config.recording_dir)
+        # Without a checkpoint car 0 is driven by hand and the other cars stand still
+        self.model: LitModule | None = None
+        if self.checkpoint_path is not None:
+            self.load_model(self.checkpoint_path)
+
+        # Create environment with a blank map, this also initializes pygame.
+        # Views rendered at the model's image size are fed to the model without a resize
+        observation_size = None
+        if self.render_at_image_size and self.model is not None:
+            image_size = self.model.hparams.image_size
+            observation_size = (image_size, image_size)
+        self.env = Environment(config.map_path, headless=self.headless, observation_size=observation_size)
+        # In fleet mode every recorded car gets its own recording, otherwise only car 0 is recorded
+        car_indices = None
+        if self.record_fleet:
+            car_indices = self.record_car_indices if self.record_car_indices is not None else list(range(self.num_cars))
+        self.recorder = Recorder(config.recording_dir, car_indices=car_indices)
         
         # Generate all the cars
-        for _ in range(config.num_cars):
-            car = Car(
-                env=self.env,
-                x=np.random.randint(0, self.env.map_width), 
-                y=np.random.randint(0, self.env.map_height), 
-                angle_deg=np.random.uniform(0, 360), 
-                speed=np.random.uniform(10, 40), 
-            )
-            self.env.add_car(car)
+        self.env.add_random_cars(self.num_cars, self.rng)
+
+        self.allocate_buffers()
+
+        if self.headless:
+            # No window and no clock, the simulation runs as fast as it can
+            return
         
         # Initialize the display
-        self.screen = pygame.display.set_mode((800, 600))
+        self.screen = pygame.display.set_mode(self.screen_size)
         pygame.display.set_caption("Autonomous Driver Simulation")
         
         self.clock = pygame.time.Clock()
+        self.font = pygame.font.Font(None, 20)
 
     def load_model(self, checkpoint_path: Path):
-        self.model = LitModule.load_from_checkpoint(checkpoint_path)
+        # Imported here so the game only pays for torch and lightning when it runs a model
+        import torch
+        from lit_module import LitModule
+        from inference_engine import EagerEngine, create_inference_engine, check_action_agreement
+
+        self.sampling_generator = torch.Generator().manual_seed(self.sampling_seed)
+
+        # The LitModule stays on the cpu, the inference engine runs the network on the device
+        self.model = LitModule.load_from_checkpoint(checkpoint_path, map_location="cpu")
         self.model.eval()
-        self.model.to("mps")
 
         self.action_categorizer = self.model.create_action_categorizer()
-        self.transform = self.model.create_transform()
 
-        # Each car has its own history digest
-        self.history_digest_for_each_car = [self.model.create_history_digest() for _ in range(config.num_cars)]
-        print(self.history_digest_for_each_car[0])
+        # The history of every car is kept in one bank
+        self.history_digest_bank = self.model.create_history_digest_bank(num_sequences=self.num_cars)
+        print(self.history_digest_bank)
+
+        # Export the network to the selected engine, using random inputs shaped like the real ones
+        generator = torch.Generator().manual_seed(0)
+        image_size = self.model.hparams.image_size
+        example_frames = torch.rand((self.num_cars, 3, image_size, image_size), generator=generator)
+        example_action_histories = torch.rand(self.history_digest_bank.get_window_averages_numpy().shape, generator=generator)
+        example_inputs = (example_frames, example_action_histories)
+
+        calibration_inputs = None
+        if self.engine_name == "int8":
+            # Quantize with the activation ranges of recorded frames, random frames only if there are none
+            calibration_inputs = self.model.create_calibration_batches(config.recording_dir, config.int8_calibration_frames, batch_size=self.num_cars)
+            if len(calibration_inputs) == 0:
+                print(f"No recordings in {config.recording_dir} to calibrate the int8 engine with, calibrating with random frames")
+                calibration_inputs = [example_inputs]
+
+        self.inference_engine = create_inference_engine(
+            self.engine_name,
+            self.model.model,
+            self.device,
+            example_inputs=example_inputs,
+            calibration_inputs=calibration_inputs,
+        )
+        if self.engine_name != "eager":
+            reference_engine = EagerEngine(self.model.model, self.device)
+            agreement = check_action_agreement(self.inference_engine, reference_engine, *example_inputs)
+            print(f"The {self.engine_name} engine agrees with the eager model on {agreement:.0%} of actions")
 
         return self.model
 
+    def allocate_buffers(self):
+        """
+        Allocate the buffers the loop reuses every frame, so the steady-state loop
+        does not allocate any large arrays.
+        """
+        num_cars = self.num_cars
+        view_height, view_width = self.env.observation_height, self.env.observation_width
+
+        # Model inference for frame t may run while frame t+1 to t+inference_latency are being
+        # simulated, each of those frames needs its own slot of buffers
+        history_shape = self.history_digest_bank.get_window_averages_numpy().shape if self.model is not None else None
+        self.slots = [self.create_slot(history_shape) for _ in range(self.inference_latency + 1)]
+        self.frame_index = 0
+
+        # Cars stand still until the first actions come out of the pipeline
+        self.idle_actions = np.zeros((num_cars, 4), dtype=bool)
+        self.pending_inferences: deque[Future] = deque()
+        self.inference_executor = ThreadPoolExecutor(max_workers=1) if self.inference_latency > 0 and self.model is not None else None
+
+        # The screen shows the views in a grid of two columns, the views that fit are
+        # copied into one (w,h,c) mosaic that is blitted to the screen in one go
+        padding = 10  # Padding between views
+        screen_width, screen_height = self.screen_size
+        self.mosaic = np.zeros((screen_width, screen_height, 3), dtype=np.uint8)
+        self.mosaic_tiles = []
+        for i in range(num_cars):
+            # Calculate position in grid (2 column layout)
+            row = i // 2
+            col = i % 2
+            x = col * (view_width + padding)
+            y = row * (view_height + padding)
+            if x < screen_width and y < screen_height:
+                # Views on the edge of the screen are cut off
+                self.mosaic_tiles.append((i, x, y, min(view_width, screen_width - x), min(view_height, screen_height - y)))
+
+    def create_slot(self, history_shape: tuple[int, ...] | None) -> InferenceSlot:
+        num_cars = self.num_cars
+        view_height, view_width = self.env.observation_height, self.env.observation_width
+
+        # One buffer holds the views of all cars, each observation is a view into it
+        views = np.zeros((num_cars, view_height, view_width, 3), dtype=np.uint8)
+        slot = InferenceSlot(
+            views=views,
+            observations=[Observation(view=view) for view in views],
+            views_tensor=None,
+            frame_batch=None,
+            history_batch=None,
+            logit_max=None,
+            action_weights=None,
+            sampled_categories=None,
+            actions=np.zeros((num_cars, 4), dtype=bool),
+        )
+        if self.model is not None:
+            import torch
+            image_size = self.model.hparams.image_size
+            slot.views_tensor = torch.from_numpy(views)
+            # Channels last like the inference engines run the model, so they use it without a copy
+            slot.frame_batch = torch.zeros((num_cars, 3, image_size, image_size)).contiguous(memory_format=torch.channels_last)
+            slot.history_batch = torch.zeros(history_shape)
+            slot.logit_max = torch.zeros((num_cars, 1))
+            slot.action_weights = torch.zeros((num_cars, self.action_categorizer.num_categories))
+            slot.sampled_categories = torch.zeros((num_cars, 1), dtype=torch.int64)
+        return slot
+
+    @property
+    def slot(self) -> InferenceSlot:
+        """The slot of the current frame"""
+        return self.slots[self.frame_index % len(self.slots)]
+
     def run(self):
         self.running = True
 
         while self.running:
             self.loop()
 
-        # Clean up pygame
+        self.close()
+
+    def close(self):
+        # Finish the inference still in flight, write the remaining frames and clean up pygame
+        if self.inference_executor is not None:
+            self.inference_executor.shutdown(wait=True)
+        self.recorder.close()
         pygame.quit()
 
+        if self.frame_timer.enabled:
+            print("Frame times over the last frames:")
+            print("\n".join(self.frame_timer.format_percentiles()))
+        self.frame_timer.close()
+
+    def run_headless(self, num_steps: int | None = None, record: bool = False, report_interval: float = 5.0):
+        """
+        Step the simulation without a display or clock throttling.
+        Every step still advances the fixed dt = 1/config.fps, only wall-clock time is not waited for.
+        """
+        self.running = True
+
+        if record:
+            self.recorder.start_recording()
+
+        step = 0
+        start_time = time.perf_counter()
+        report_time = start_time
+        report_step = 0
+        try:
+            while self.running and (num_steps is None or step < num_steps):
+                self.headless_loop()
+                step += 1
+
+                now = time.perf_counter()
+                if now - report_time >= report_interval:
+                    print(f"Steps per second: {(step - report_step) / (now - report_time):.1f}")
+                    report_time = now
+                    report_step = step
+        except KeyboardInterrupt:
+            pass
+
+        elapsed_time = time.perf_counter() - start_time
+        print(f"Ran {step} steps in {elapsed_time:.1f}s, {step / max(elapsed_time, 1e-9):.1f} steps per second")
+
+        self.close()
+
     def loop(self):
+        timer = self.frame_timer
+        timer.start_frame()
         observations = self.get_observations()
+        timer.lap(OBSERVE_STAGE)
+        # With pipelined inference the model runs on this frame while the screen is drawn
+        actions = self.get_model_actions()
+        timer.lap(INFER_STAGE)
         self.draw_screen(observations)
+        timer.lap(DRAW_STAGE)
         self.handle_events()
+        # After the events, so a recording started this frame has states from its first frame,
+        # and before the update, while the cars are still where their views were rendered
+        states = self.get_recorded_states()
         human_action = self.get_human_actions()
-        actions = self.get_model_actions(observations)
         modified_human_action = self.inject_random_action_when_enabled(human_action, self.recorder.recording)
         actions[0] = modified_human_action
+        timer.lap(EVENTS_STAGE)
+        self.update(actions=actions)
+        timer.lap(UPDATE_STAGE)
+        # Car 0 is recorded with the action of the human, without the injected random action
+        actions[0] = human_action
+        self.record(observations, actions, states)
+        timer.lap(RECORD_STAGE)
+        self.clock.tick(config.fps)
+        timer.lap(WAIT_STAGE)
+        timer.end_frame()
+
+    def headless_loop(self):
+        # Without a human the model drives every car, including car 0
+        timer = self.frame_timer
+        timer.start_frame()
+        observations = self.get_observations()
+        states = self.get_recorded_states()
+        timer.lap(OBSERVE_STAGE)
+        actions = self.get_model_actions()
+        timer.lap(INFER_STAGE)
         self.update(actions=actions)
-        self.recorder.record(observations[0], human_action)
+        timer.lap(UPDATE_STAGE)
+        self.record(observations, actions, states)
+        timer.lap(RECORD_STAGE)
+        timer.end_frame()
+
+    def get_recorded_states(self) -> np.ndarray | None:
+        """The states of the fleet when its views are rendered, taken before the step moves the cars, if they are recorded"""
+        if self.record_fleet and self.recorder.recording and self.recorder.record_states:
+            return self.env.fleet.get_states()
+        return None
+
+    def record(self, observations: list[Observation], actions: np.ndarray, states: np.ndarray | None = None):
+        """Record car 0, or in fleet mode the recorded cars of the fleet with the states from when their views were rendered"""
+        if not self.record_fleet:
+            self.recorder.record(observations[0], actions[0])
+        elif self.recorder.recording:
+            self.recorder.record_fleet(observations, actions, states)
 
     def handle_events(self):
         # Handle events
@@ -96,7 +347,7 @@ class Game:
         self.keys_pressed = pygame.key.get_pressed()
 
 
-    def update(self, actions: list[Action]):
+    def update(self, actions: np.ndarray):
         dt = 1/config.fps   
 
         # Update and render
@@ -104,38 +355,20 @@ class Game:
 
 
     def get_observations(self) -> list[Observation]:
-        # Get views for all cars
-        observations = self.env.get_observations()
+        # Render the views of all cars into the view buffer of the current slot
+        slot = self.slot
+        self.env.get_views(out=slot.views)
 
-        return observations
+        return slot.observations
 
 
     def draw_screen(self, observations: list[Observation]):
         
-        self.screen.fill((0, 0, 0))
+        # Copy the view of each car into the mosaic and draw it on the screen
+        for i, x, y, width, height in self.mosaic_tiles:
+            self.mosaic[x:x + width, y:y + height] = observations[i].view[:height, :width].transpose(1, 0, 2) #h,w,c to w,h,c
 
-        # Convert numpy arrays to pygame surfaces and display them
-        view_width = config.view_width  # Width of each view
-        view_height = config.view_height  # Height of each view
-        padding = 10  # Padding between views
-
-        # Draw the view of each car
-        for i, observation in enumerate(observations):
-            # Convert numpy array to pygame surface
-            view = np.transpose(observation.view, (1, 0, 2)) #h,w,c to w,h,c
-            view_surface = pygame.surfarray.make_surface(view)
-            
-            # Calculate position in grid (2x2 layout)
-            row = i // 2
-            col = i % 2
-            x = col * (view_width + padding)
-            y = row * (view_height + padding)
-            
-            # Scale the view to desired size
-            view_surface = pygame.transform.scale(view_surface, (view_width, view_height))
-            
-            # Draw the view
-            self.screen.blit(view_surface, (x, y))
+        pygame.surfarray.blit_array(self.screen, self.mosaic)
 
         # Draw red border when recording
         if self.recorder.recording:
@@ -146,10 +379,17 @@ class Game:
                 2  # Border thickness
             )
 
+        if self.show_frame_times:
+            self.draw_frame_times()
+
         # Update the display
         pygame.display.flip()
 
-        self.clock.tick(config.fps)
+    def draw_frame_times(self):
+        """Draw the rolling percentiles of each stage in the top left corner"""
+        for i, line in enumerate(self.frame_timer.format_percentiles()):
+            text = self.font.render(line, True, (255, 255, 255), (0, 0, 0))
+            self.screen.blit(text, (4, 4 + i * text.get_height()))
     
 
     def get_human_actions(self) -> Action:
@@ -165,37 +405,68 @@ class Game:
         return action
 
 
-    def get_model_actions(self, observations: list[Observation]) -> list[Action]:
-        """Get actions from AI model for each car"""
+    def get_model_actions(self) -> np.ndarray:
+        """
+        Get actions from AI model for each car.
+        With an inference latency of 0 these are the actions for the views just rendered.
+        With a latency of k the model is started on the views just rendered in the background,
+        and the actions returned are those for the views rendered k frames ago.
+        """
+        slot = self.slot
+        self.frame_index += 1
+
+        if self.model is None:
+            # Nothing drives the cars but the human, who takes over car 0 after this
+            return slot.actions
+
+        if self.inference_latency == 0:
+            self.prepare_model_inputs(slot)
+            self.run_model(slot)
+            self.history_digest_bank.push(slot.actions)
+            return slot.actions
+
+        # Collect the actions for the frame observed inference_latency frames ago
+        actions = self.idle_actions
+        if len(self.pending_inferences) == self.inference_latency:
+            finished_slot = self.pending_inferences.popleft().result()
+            self.history_digest_bank.push(finished_slot.actions)
+            actions = finished_slot.actions
+
+        self.prepare_model_inputs(slot)
+        self.pending_inferences.append(self.inference_executor.submit(self.run_model, slot))
 
-        # Convert view observations to tensors
-        views = [self.transform(observation.view) for observation in observations]
-        views = torch.stack(views)
+        return actions
+
+    def prepare_model_inputs(self, slot: InferenceSlot):
+        import torch
+
+        # Convert action histories of all cars to one tensor
+        action_histories = self.history_digest_bank.get_window_averages_numpy()
+        slot.history_batch.copy_(torch.from_numpy(action_histories))
 
-        # Convert action histories to tensors
-        action_histories = [history_digest.get_window_averages_numpy() for history_digest in self.history_digest_for_each_car]
-        action_histories = [torch.from_numpy(action_history) for action_history in action_histories]
-        action_histories = torch.stack(action_histories).float()
+    def run_model(self, slot: InferenceSlot) -> InferenceSlot:
+        """Run the model on the inputs of a slot and sample the actions of all cars into it"""
+        import torch
 
-        # Move tensors to GPU
-        views = views.to("mps")
-        action_histories = action_histories.to("mps")
+        # Resize and convert the views of all cars in one go, with the preprocessing training uses
+        self.model.preprocess_frames(slot.views_tensor, out=slot.frame_batch)
 
         # Get model predictions
-        action_logits = self.model(views, action_histories)
-        action_probs = torch.softmax(action_logits, dim=1)
-        action_categories = torch.multinomial(action_probs, num_samples=1).squeeze(1)
+        action_logits = self.inference_engine(slot.frame_batch, slot.history_batch)
 
-        actions = [self.action_categorizer.to_action(category.item()) for category in action_categories]
-        # Update history digests
-        for history_digest, action in zip(self.history_digest_for_each_car, actions):
-            history_digest.push(action)
+        # Sample from the softmax of the logits, multinomial normalizes the weights itself so
+        # exp(logits - max) is enough. Every step writes into the buffers of the slot
+        torch.amax(action_logits, dim=1, keepdim=True, out=slot.logit_max)
+        torch.sub(action_logits, slot.logit_max, out=slot.action_weights).exp_()
+        torch.multinomial(slot.action_weights, num_samples=1, generator=self.sampling_generator, out=slot.sampled_categories)
 
-        # Return actions
-        return actions
+        # Decode the categories of all cars at once through the categorizer's lookup table
+        self.action_categorizer.to_actions(slot.sampled_categories.numpy()[:, 0], out=slot.actions)
+
+        return slot
 
     def generate_random_action(self) -> Action:
-        return np.array([ bool(np.random.randint(2)) for _ in range(4) ])
+        return self.rng.integers(0, 2, size=4).astype(bool)
         
     def inject_random_action_when_enabled(self, action: Action, enable: bool):
 
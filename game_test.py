@@ -0,0 +1,219 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pygame
+import pytest
+import torch
+import yaml
+from click.testing import CliRunner
+import config
+import game
+import main
+from lit_module import LitModule
+from recorder import PngRecordingWriter, Recorder
+from recording_preprocessing import open_recording_frames
+
+
+@pytest.fixture
+def untrained_model(monkeypatch, tmp_path):
+    """Games load an untrained model instead of a checkpoint"""
+    with open(config.project_root / "config.yaml", "r") as f:
+        model_config = yaml.load(f, Loader=yaml.SafeLoader)
+    monkeypatch.setattr(LitModule, "load_from_checkpoint", lambda checkpoint_path, **kwargs: LitModule(model_config))
+    monkeypatch.setattr(config, "recording_dir", tmp_path)
+    monkeypatch.setattr(config, "fps", 1000)
+
+
+@pytest.fixture(params=[0, 1], ids=["serial", "pipelined"])
+def model_game(request, untrained_model):
+    """A Game driven by an untrained model, without loading a checkpoint, with serial and pipelined inference"""
+    model_game = game.Game(checkpoint_path=Path("unused.ckpt"), inference_latency=request.param)
+    model_game.setup()
+    yield model_game
+    model_game.close()
+
+
+def test_steady_state_loop_does_not_allocate_arrays(model_game):
+    # Warm up so every lazily created buffer exists
+    for _ in range(3):
+        model_game.loop()
+
+    tracemalloc.start()
+    try:
+        # Objects replaced every frame were allocated before tracing started, let them be replaced once
+        for _ in range(2):
+            model_game.loop()
+        start_memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for _ in range(10):
+            model_game.loop()
+        end_memory, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # tracemalloc sees the Python heap, numpy arrays included, but not torch's allocator. The model's
+    # activations are allocated by every forward pass, the loop's own tensors are preallocated in the slots.
+    # A single view is 27kB and all the views are 276kB, so neither may be allocated per frame
+    assert peak_memory - start_memory < 25_000
+    assert end_memory - start_memory < 10_000
+
+
+def test_sampling_writes_into_the_slot(model_game):
+    slot = model_game.slot
+    buffers = [slot.frame_batch, slot.logit_max, slot.action_weights, slot.sampled_categories]
+    pointers = [buffer.data_ptr() for buffer in buffers]
+    model_game.run_model(slot)
+
+    assert [buffer.data_ptr() for buffer in buffers] == pointers
+    assert np.array_equal(slot.actions, model_game.action_categorizer.to_actions(slot.sampled_categories.numpy()[:, 0]))
+
+
+def test_observations_share_the_view_buffer(model_game):
+    observations = model_game.get_observations()
+
+    assert observations is model_game.slot.observations
+    assert np.array_equal(np.stack([observation.view for observation in observations]), model_game.env.get_views())
+    assert all(np.shares_memory(observation.view, model_game.slot.views) for observation in observations)
+
+
+def test_pipelined_actions_lag_by_the_inference_latency(model_game):
+    latency = model_game.inference_latency
+    slots = model_game.slots
+    assert len(slots) == latency + 1
+
+    for frame_index in range(4):
+        model_game.get_observations()
+        actions = model_game.get_model_actions()
+        if frame_index < latency:
+            # Nothing has come out of the pipeline yet, the cars stand still
+            assert not actions.any()
+        else:
+            # The actions sampled for the views observed latency frames ago
+            assert actions is slots[(frame_index - latency) % len(slots)].actions
+
+
+def test_seeded_games_sample_the_same_actions(model_game):
+    seed_actions = []
+    for _ in range(2):
+        seeded_game = game.Game(checkpoint_path=Path("unused.ckpt"), inference_latency=model_game.inference_latency, seed=1)
+        # The untrained model gets the same weights in both games
+        torch.manual_seed(0)
+        seeded_game.setup()
+        actions = []
+        for _ in range(4):
+            seeded_game.get_observations()
+            actions.append(seeded_game.get_model_actions().copy())
+            seeded_game.env.update(actions[-1], 1 / config.fps)
+        seeded_game.close()
+        seed_actions.append(np.stack(actions))
+
+    assert np.array_equal(seed_actions[0], seed_actions[1])
+
+
+@pytest.mark.parametrize("render_at_image_size", [False, True], ids=["resized", "rendered-at-image-size"])
+def test_training_and_game_preprocess_views_identically(untrained_model, tmp_path, monkeypatch, render_at_image_size):
+    model_game = game.Game(checkpoint_path=Path("unused.ckpt"), render_at_image_size=render_at_image_size)
+    model_game.setup()
+    model_game.get_observations()
+    slot = model_game.slot
+    model_game.run_model(slot)
+    model_game.close()
+    image_size = model_game.model.hparams.image_size
+    assert slot.frame_batch.shape == (config.num_cars, 3, image_size, image_size)
+
+    # Record the views the game rendered and load them back through the training data loader
+    writer = PngRecordingWriter(tmp_path / "data" / "recording_0")
+    for frame_index, view in enumerate(slot.views):
+        writer.write(frame_index, view, np.zeros(4, dtype=bool))
+    monkeypatch.setitem(model_game.model.hparams, "data_dir", str(tmp_path / "data"))
+    monkeypatch.setitem(model_game.model.hparams, "dataloader", {"num_workers": 0})
+    dataloader = model_game.model.train_dataloader()
+    dataloader = torch.utils.data.DataLoader(dataloader.dataset, batch_size=config.num_cars, collate_fn=dataloader.collate_fn)
+    training_frames = next(iter(dataloader))["frame"]
+
+    assert torch.equal(training_frames, slot.frame_batch)
+
+def test_recorded_states_are_from_when_the_views_were_rendered(untrained_model):
+    fleet_game = game.Game(checkpoint_path=Path("unused.ckpt"), headless=True, record_fleet=True)
+    fleet_game.setup()
+    fleet_game.recorder.record_states = True
+    fleet_game.recorder.start_recording()
+
+    # Keep the fleet state at every render and every recorded state
+    rendered_states, recorded_states = [], []
+    get_views = fleet_game.env.get_views
+    def get_views_and_state(*args, **kwargs):
+        rendered_states.append(fleet_game.env.fleet.get_states())
+        return get_views(*args, **kwargs)
+    fleet_game.env.get_views = get_views_and_state
+    record_fleet = fleet_game.recorder.record_fleet
+    def record_fleet_and_state(observations, actions, states=None):
+        recorded_states.append(states.copy())
+        record_fleet(observations, actions, states)
+    fleet_game.recorder.record_fleet = record_fleet_and_state
+
+    for _ in range(3):
+        fleet_game.headless_loop()
+    fleet_game.close()
+
+    assert len(recorded_states) == 3
+    # The cars move every step, so states from after the step would not match
+    assert not np.array_equal(rendered_states[0], rendered_states[-1])
+    for rendered_state, recorded_state in zip(rendered_states, recorded_states):
+        assert np.array_equal(recorded_state, rendered_state)
+
+
+@pytest.mark.parametrize("recording_format", ["png", "shards"])
+def test_recording_started_mid_loop_records_states(untrained_model, tmp_path, recording_format):
+    fleet_game = game.Game(checkpoint_path=Path("unused.ckpt"), record_fleet=True)
+    fleet_game.setup()
+    fleet_game.recorder.close()
+    fleet_game.recorder = Recorder(tmp_path, recording_format=recording_format, car_indices=[0, 2], record_states=True)
+
+    fleet_game.loop()
+    # Start recording with the R key, like a player does
+    pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_r))
+    for _ in range(3):
+        fleet_game.loop()
+    fleet_game.close()
+
+    for recording_dir in fleet_game.recorder.recording_dirs:
+        frames = open_recording_frames(recording_dir)
+        assert len(frames) == 3
+        states = frames.load_states()
+        assert states is not None and len(states) == 3
+
+
+def test_int8_engine_is_calibrated_on_recordings(untrained_model, tmp_path, capsys):
+    rng = np.random.default_rng(0)
+    writer = PngRecordingWriter(tmp_path / "recording_0")
+    for frame_index in range(12):
+        writer.write(frame_index, rng.integers(0, 256, size=(config.view_height, config.view_width, 3), dtype=np.uint8), rng.integers(0, 2, size=4).astype(bool))
+    writer.close()
+
+    int8_game = game.Game(checkpoint_path=Path("unused.ckpt"), headless=True, engine="int8")
+    int8_game.setup()
+    calibration_batches = int8_game.model.create_calibration_batches(tmp_path, num_frames=8, batch_size=int8_game.num_cars)
+    assert sum(len(frames) for frames, _ in calibration_batches) == 8
+    assert "No recordings" not in capsys.readouterr().out
+
+    int8_game.headless_loop()
+    int8_game.close()
+
+
+def test_headless_run_from_the_cli(untrained_model, tmp_path):
+    result = CliRunner().invoke(main.cli, ["run", "--headless", "--checkpoint-path", "unused.ckpt", "--num-steps", "3", "--record", "--seed", "0"])
+    assert result.exit_code == 0, result.output
+    assert "Ran 3 steps" in result.output
+
+    # Car 0 was recorded from the first step
+    recording_dirs = list(tmp_path.glob("recording_*"))
+    assert len(recording_dirs) == 1
+    assert len(open_recording_frames(recording_dirs[0])) == 3
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -1,16 +1,21 @@
 from collections import deque
 from typing import override
 import numpy as np
+
+def window_sizes_from_growth_rate(num_windows:int, growth_rate:float)->list[int]:
+    window_sizes = []
+    for i in range(num_windows):
+        window_sizes.append(int(growth_rate**i))
+    return window_sizes
+
 class HistoryDigest:
 
     @classmethod
     def from_window_growth_rate(cls,num_windows:int, growth_rate:float):
-        window_sizes = []
-        for i in range(num_windows):
-            window_sizes.append(int(growth_rate**i))
-        return cls(window_sizes)
+        return cls(window_sizes_from_growth_rate(num_windows, growth_rate))
 
     def __init__(self, window_sizes:list[int]):
+        self.window_sizes = list(window_sizes)
         self.windows = self._build_window_chain(window_sizes)
         self.total_length = sum(window_sizes)
 
@@ -43,6 +48,32 @@ class HistoryDigest:
         for _ in range(self.total_length):
             self.push(value)
 
+    def get_window_averages_for_sequence(self, values:np.ndarray) -> np.ndarray:
+        """
+        Get the window averages before each value of a whole sequence in one vectorized pass.
+        Row i equals get_window_averages_numpy() of a digest filled with values[0] that has had
+        values[:i] pushed. Returns an array of shape (len(values), num_windows, *value_shape).
+        This does not change the state of the digest.
+        """
+        values = np.asarray(values, dtype=np.float64)
+
+        # The fill with the first value comes before the sequence
+        padded_values = np.concatenate([np.repeat(values[:1], self.total_length, axis=0), values])
+
+        # Window sums are differences of the cumulative sum at the window boundaries
+        cumulative_sums = np.concatenate([np.zeros_like(values[:1]), np.cumsum(padded_values, axis=0)])
+
+        window_sizes = np.array(self.window_sizes)
+        window_starts = np.cumsum([0] + self.window_sizes[:-1])
+
+        # Before value i, total_length + i values have been pushed. Window k holds the ones
+        # with ages window_starts[k] to window_starts[k] + window_sizes[k], age 0 being the newest
+        window_ends = self.total_length + np.arange(len(values))[:, None] - window_starts[None, :]
+        window_sums = cumulative_sums[window_ends] - cumulative_sums[window_ends - window_sizes]
+
+        window_sizes = window_sizes.reshape(1, -1, *(1,) * (values.ndim - 1))
+        return window_sums / window_sizes
+
     @override
     def __str__(self) -> str:
         window_sizes = [str(window.window_size) for window in self.windows]
@@ -87,4 +118,72 @@ class RollingWindowChain:
         return self.sum / len(self.queue)
     
     def get_window(self):
-        return list(self.queue) 
\ No newline at end of file
+        return list(self.queue)
+
+class HistoryDigestBank:
+    """
+    The history digests of many sequences (e.g. one per car) in one preallocated ring buffer.
+    Values are pushed for all sequences at once and the window averages of all sequences
+    are computed in one vectorized call. The averages match HistoryDigest exactly.
+    """
+
+    @classmethod
+    def from_window_growth_rate(cls, num_windows:int, growth_rate:float, num_sequences:int, value_shape:tuple[int, ...]=()):
+        return cls(window_sizes_from_growth_rate(num_windows, growth_rate), num_sequences, value_shape)
+
+    def __init__(self, window_sizes:list[int], num_sequences:int, value_shape:tuple[int, ...]=()):
+        self.window_sizes = list(window_sizes)
+        self.total_length = sum(window_sizes)
+        self.num_sequences = num_sequences
+        self.value_shape = tuple(value_shape)
+
+        # Ring buffer of the last total_length values of every sequence, (total_length, num_sequences, *value_shape)
+        self.buffer = np.zeros((self.total_length, num_sequences, *self.value_shape))
+        self.head = 0 # Index the next value is written to
+        self.count = 0 # Number of values pushed, up to total_length
+
+        # Windows cover consecutive ages, the newest value has age 0
+        self.window_starts = np.cumsum([0] + self.window_sizes[:-1])
+        self.ages = np.arange(self.total_length)
+
+        # Scratch buffers reused by every call
+        self.history_by_age = np.zeros_like(self.buffer)
+        self.window_sums = np.zeros((len(self.window_sizes), num_sequences, *self.value_shape))
+        self.window_averages = np.zeros_like(self.window_sums)
+
+    def push(self, values:np.ndarray):
+        """Push one value for every sequence, values has shape (num_sequences, *value_shape)"""
+        self.buffer[self.head] = values
+        self.head = (self.head + 1) % self.total_length
+        self.count = min(self.count + 1, self.total_length)
+
+    def fill(self, values:np.ndarray):
+        """Fill all windows of every sequence with the same values"""
+        self.buffer[:] = values
+        self.head = 0
+        self.count = self.total_length
+
+    def get_window_averages_numpy(self) -> np.ndarray:
+        """
+        Get the window averages of all sequences as a (num_sequences, num_windows, *value_shape) array.
+        The array is a view of a buffer that the next call overwrites.
+        """
+        # Reorder the ring buffer so index 0 is the newest value
+        order = (self.head - 1 - self.ages) % self.total_length
+        # mode="clip" lets np.take write straight into out, the default mode buffers it
+        np.take(self.buffer, order, axis=0, out=self.history_by_age, mode="clip")
+
+        # Values that have not been pushed yet are zero, so they do not add to the sums
+        np.add.reduceat(self.history_by_age, self.window_starts, axis=0, out=self.window_sums)
+
+        # Like HistoryDigest, partly filled windows average only the values they hold
+        counts = np.clip(self.count - self.window_starts, 0, self.window_sizes)
+        counts = counts.reshape(-1, 1, *(1,) * len(self.value_shape))
+        np.divide(self.window_sums, counts, out=self.window_averages, where=counts > 0)
+
+        return np.moveaxis(self.window_averages, 0, 1)
+
+    @override
+    def __str__(self) -> str:
+        window_sizes_str = ", ".join(str(window_size) for window_size in self.window_sizes)
+        return f"HistoryDigestBank: {self.num_sequences} sequences, total length {self.total_length}, window sizes: {window_sizes_str}"
@@ -1,5 +1,5 @@
 import pytest
-from history_digest import RollingWindowChain, HistoryDigest
+from history_digest import RollingWindowChain, HistoryDigest, HistoryDigestBank
 import numpy as np
 
 @pytest.mark.parametrize("window_size, values, expected_average", [
@@ -57,6 +57,65 @@ def test_average_history_windows_from_window_growth_rate(num_windows, growth_rat
     for window, expected_window_size in zip(windows.windows, expected_window_sizes):
         assert window.window_size == expected_window_size
     
+@pytest.mark.parametrize("window_sizes, values", [
+    ([1, 2], [1, 2, 3, 4, 5, 6]),
+    ([2, 3], [1, 2, 3, 4, 5, 6]),
+    ([3, 2], [1, 2, 3, 4, 5, 6]),
+    ([4, 1], [1, 2, 3, 4, 5, 6]),
+    ([5, 1], [1, 2, 3, 4, 5, 6]),
+    ([1, 2], np.array([[i,2*i] for i in range(7)])),
+    ([3, 2], np.array([[i,2*i] for i in range(7)])),
+])
+def test_history_digest_bank_matches_history_digest(window_sizes, values):
+    """Test HistoryDigestBank gives exactly the HistoryDigest averages for every sequence"""
+    values = np.asarray(values)
+    num_sequences = 3
+    bank = HistoryDigestBank(window_sizes, num_sequences=num_sequences, value_shape=values.shape[1:])
+    digests = [HistoryDigest(window_sizes) for _ in range(num_sequences)]
+
+    for value in values:
+        # Each sequence gets a different scaled copy of the values
+        sequence_values = np.stack([value * (i + 1) for i in range(num_sequences)])
+        bank.push(sequence_values)
+        for digest, sequence_value in zip(digests, sequence_values):
+            digest.push(sequence_value)
+
+        bank_averages = bank.get_window_averages_numpy()
+        assert bank_averages.shape == (num_sequences, len(window_sizes), *values.shape[1:])
+        for digest, sequence_averages in zip(digests, bank_averages):
+            # Windows the digest has not reached yet are empty, the bank reports them as zero
+            for window, window_average in zip(digest.windows, sequence_averages):
+                expected = window.get_average() if len(window.queue) > 0 else 0
+                assert np.all(window_average == expected)
+
+def test_history_digest_bank_fill():
+    bank = HistoryDigestBank.from_window_growth_rate(num_windows=4, growth_rate=2.0, num_sequences=2, value_shape=(3,))
+    digest = HistoryDigest.from_window_growth_rate(num_windows=4, growth_rate=2.0)
+
+    bank.fill(np.zeros(3))
+    digest.fill(np.zeros(3))
+    for value in [np.array([1, 0, 1]), np.array([0, 1, 1]), np.array([1, 1, 0])]:
+        bank.push(np.stack([value, value]))
+        digest.push(value)
+
+    assert bank.window_sizes == [1, 2, 4, 8]
+    assert np.all(bank.get_window_averages_numpy() == digest.get_window_averages_numpy())
+
+@pytest.mark.parametrize("window_sizes", [[1, 2], [3, 2], [1, 1, 2, 3, 5]])
+def test_window_averages_for_sequence_matches_pushing(window_sizes):
+    """Test the vectorized sequence averages match filling with the first value and pushing one by one"""
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 2, size=(50, 4)).astype(bool)
+
+    digest = HistoryDigest(window_sizes)
+    sequence_averages = digest.get_window_averages_for_sequence(values)
+
+    digest.fill(values[0])
+    assert sequence_averages.shape == (len(values), len(window_sizes), 4)
+    for value, averages in zip(values, sequence_averages):
+        assert np.all(averages == digest.get_window_averages_numpy())
+        digest.push(value)
+
 
 if __name__ == "__main__":
     pytest.main([__file__]) 
\ No newline at end of file
@@ -0,0 +1,100 @@
+import copy
+import torch
+import torch.nn as nn
+from model import Model
+import config
+
+ENGINE_NAMES = config.inference_engine_names
+
+class InferenceEngine:
+    """
+    Runs the forward pass of a Model for a batch of frames and action histories.
+    Every engine runs in inference mode and keeps the frames in channels_last layout,
+    which is the faster layout for the ResNet convolutions on CPU.
+    """
+    def __init__(self, model: Model, device: str = "cpu"):
+        self.device = device
+        self.model = copy.deepcopy(model).eval().to(device, memory_format=torch.channels_last)
+
+    def __call__(self, frames: torch.Tensor, action_histories: torch.Tensor) -> torch.Tensor:
+        with torch.inference_mode():
+            frames = frames.to(self.device).contiguous(memory_format=torch.channels_last)
+            return self.model(frames, action_histories.to(self.device))
+
+class EagerEngine(InferenceEngine):
+    """The model run as is"""
+
+class TracedEngine(InferenceEngine):
+    """The model traced to TorchScript, then frozen and optimized for inference"""
+    def __init__(self, model: Model, device: str = "cpu", example_inputs: tuple[torch.Tensor, torch.Tensor] | None = None):
+        if example_inputs is None:
+            raise ValueError("The traced engine needs example inputs to trace the model with")
+        super().__init__(model, device)
+        frames, action_histories = example_inputs
+        with torch.inference_mode():
+            frames = frames.to(device).contiguous(memory_format=torch.channels_last)
+            traced_model = torch.jit.trace(self.model, (frames, action_histories.to(device)))
+            self.model = torch.jit.optimize_for_inference(torch.jit.freeze(traced_model))
+
+class CompiledEngine(InferenceEngine):
+    """The model compiled with torch.compile, the first call compiles it"""
+    def __init__(self, model: Model, device: str = "cpu"):
+        super().__init__(model, device)
+        self.model = torch.compile(self.model)
+
+class Int8Engine(InferenceEngine):
+    """
+    The model statically quantized to int8, the convolutions as well as the linear layers.
+    The ranges of the activations are calibrated by running the float model on calibration_inputs,
+    batches of recorded frames and action histories, then the weights and activations are quantized once.
+    """
+    def __init__(self, model: Model, device: str = "cpu", calibration_inputs: list[tuple[torch.Tensor, torch.Tensor]] | None = None):
+        if device != "cpu":
+            raise ValueError(f"The int8 engine only runs on cpu, not {device}")
+        if not calibration_inputs:
+            raise ValueError("The int8 engine needs calibration inputs to quantize the activations with")
+        super().__init__(model, device)
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        backend = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+        torch.backends.quantized.engine = backend
+        # Tracing the model into a graph lets the residual additions of the ResNet be quantized too
+        frames, action_histories = calibration_inputs[0]
+        prepared_model = prepare_fx(self.model, get_default_qconfig_mapping(backend), example_inputs=(frames, action_histories))
+        with torch.no_grad():
+            for frames, action_histories in calibration_inputs:
+                prepared_model(frames.contiguous(memory_format=torch.channels_last), action_histories)
+        self.model = convert_fx(prepared_model)
+
+def create_inference_engine(
+    name: str,
+    model: Model,
+    device: str = "cpu",
+    example_inputs: tuple[torch.Tensor, torch.Tensor] | None = None,
+    calibration_inputs: list[tuple[torch.Tensor, torch.Tensor]] | None = None,
+) -> InferenceEngine:
+    """
+    Create the engine called name. Tracing needs example_inputs of the shape the engine will be called with,
+    quantizing needs calibration_inputs, batches of inputs like the ones the engine will see.
+    """
+    if name == "eager":
+        return EagerEngine(model, device)
+    if name == "traced":
+        return TracedEngine(model, device, example_inputs=example_inputs)
+    if name == "compiled":
+        return CompiledEngine(model, device)
+    if name == "int8":
+        return Int8Engine(model, device, calibration_inputs=calibration_inputs)
+    raise ValueError(f"Unknown inference engine {name}, expected one of {', '.join(ENGINE_NAMES)}")
+
+def check_action_agreement(
+    engine: InferenceEngine,
+    reference_engine: InferenceEngine,
+    frames: torch.Tensor,
+    action_histories: torch.Tensor,
+) -> float:
+    """The fraction of the batch for which both engines give the same most likely action category"""
+    actions = engine(frames, action_histories).argmax(dim=1).cpu()
+    reference_actions = reference_engine(frames, action_histories).argmax(dim=1).cpu()
+    return (actions == reference_actions).float().mean().item()
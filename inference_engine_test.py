@@ -0,0 +1,74 @@
+import pytest
+import torch
+import torch.nn as nn
+import yaml
+import config
+from inference_engine import ENGINE_NAMES, EagerEngine, create_inference_engine, check_action_agreement
+from lit_module import LitModule
+
+
+@pytest.fixture(scope="module")
+def lit_module():
+    with open(config.project_root / "config.yaml", "r") as f:
+        model_config = yaml.load(f, Loader=yaml.SafeLoader)
+    torch.manual_seed(0)
+    return LitModule(model_config).eval()
+
+
+@pytest.fixture(scope="module")
+def example_inputs(lit_module):
+    p = lit_module.hparams
+    generator = torch.Generator().manual_seed(0)
+    frames = torch.rand((16, 3, p.image_size, p.image_size), generator=generator)
+    action_histories = torch.rand((16, p.history_digest["num_windows"], p.action_vector_length), generator=generator)
+    return frames, action_histories
+
+
+@pytest.mark.parametrize("engine_name, min_agreement, logits_tolerance", [
+    ("eager", 1.0, 1e-6),
+    ("traced", 1.0, 1e-4),
+    ("compiled", 1.0, 1e-4),
+    ("int8", 0.9, 5e-2),
+])
+def test_engine_agrees_with_eager_model(lit_module, example_inputs, engine_name, min_agreement, logits_tolerance):
+    engine = create_inference_engine(engine_name, lit_module.model, example_inputs=example_inputs, calibration_inputs=[example_inputs])
+    reference_engine = EagerEngine(lit_module.model)
+
+    assert check_action_agreement(engine, reference_engine, *example_inputs) >= min_agreement
+
+    logits = engine(*example_inputs)
+    with torch.no_grad():
+        reference_logits = lit_module(*example_inputs)
+    assert logits.shape == reference_logits.shape
+    assert torch.allclose(logits, reference_logits, atol=logits_tolerance)
+
+
+def test_engines_do_not_change_the_model(lit_module, example_inputs):
+    parameters = [parameter.clone() for parameter in lit_module.parameters()]
+    for engine_name in ENGINE_NAMES:
+        create_inference_engine(engine_name, lit_module.model, example_inputs=example_inputs, calibration_inputs=[example_inputs])
+
+    for parameter, original_parameter in zip(lit_module.parameters(), parameters):
+        assert torch.equal(parameter, original_parameter)
+        assert parameter.is_contiguous()
+
+
+def test_int8_engine_quantizes_the_convolutions(lit_module, example_inputs):
+    engine = create_inference_engine("int8", lit_module.model, calibration_inputs=[example_inputs])
+    module_types = {type(module) for module in engine.model.modules()}
+    assert nn.Conv2d not in module_types
+    assert nn.Linear not in module_types
+
+
+def test_int8_engine_needs_calibration_inputs(lit_module):
+    with pytest.raises(ValueError):
+        create_inference_engine("int8", lit_module.model)
+
+
+def test_unknown_engine(lit_module):
+    with pytest.raises(ValueError):
+        create_inference_engine("tensorrt", lit_module.model)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -2,13 +2,23 @@ import lightning as L
 from torch.utils.data import DataLoader
 import torch
 import recorded_dataset
-from history_digest import HistoryDigest
+from history_digest import HistoryDigest, HistoryDigestBank
 from action_categorizer import ActionCategorizer
 import torch.nn as nn
 from pathlib import Path
-from torchvision import transforms
 import model
 import numpy as np
+from frame_preprocessing import collate_frames, preprocess_frames
+from functools import partial
+
+# How the model is trained, the training section of the config overrides these
+TRAINING_PROFILE_DEFAULTS = {
+    "precision": "32-true", # a Lightning precision, bf16-mixed autocasts to bfloat16 on the CPU
+    "channels_last": False, # keep the image encoder weights and the frames channels last
+    "compile": False, # torch.compile the model
+    "accumulate_grad_batches": 1, # batches per optimizer step
+    "num_threads": None, # intra-op threads, None keeps torch's default
+}
 
 class LitModule(L.LightningModule):
     """Custom trainer class that extends lightning.Trainer."""
@@ -28,6 +38,19 @@ class LitModule(L.LightningModule):
     def forward(self, frame: torch.Tensor, action_history: torch.Tensor) -> torch.Tensor:
         return self.model(frame, action_history)
 
+    def get_training_profile(self) -> dict:
+        """The training performance settings, the defaults overridden by the training section of the config"""
+        return {**TRAINING_PROFILE_DEFAULTS, **self.hparams.get("training", {})}
+
+    def configure_model(self):
+        # Only applied when training, a model loaded for inference keeps its default layout
+        profile = self.get_training_profile()
+        if profile["channels_last"]:
+            self.model.to(memory_format=torch.channels_last)
+        if profile["compile"]:
+            # Compiles in place, so the state dict keys of checkpoints stay the same
+            self.model.compile()
+
     def create_history_digest(self) -> HistoryDigest:
         """Create HistoryDigest instance from config parameters."""
         p = self.hparams
@@ -39,6 +62,19 @@ class LitModule(L.LightningModule):
 
         return history_digest
 
+    def create_history_digest_bank(self, num_sequences: int) -> HistoryDigestBank:
+        """Create HistoryDigestBank instance holding the history of num_sequences cars."""
+        p = self.hparams
+        history_digest_bank = HistoryDigestBank.from_window_growth_rate(
+            num_windows=p.history_digest["num_windows"],
+            growth_rate=p.history_digest["growth_rate"],
+            num_sequences=num_sequences,
+            value_shape=(p.action_vector_length,),
+        )
+        history_digest_bank.fill(np.zeros(p.action_vector_length))
+
+        return history_digest_bank
+
     def create_action_categorizer(self) -> ActionCategorizer:
         """Create ActionCategorizer instance from config parameters."""
         p = self.hparams
@@ -46,49 +82,79 @@ class LitModule(L.LightningModule):
             action_vector_length=p.action_vector_length
         )
 
-    def create_transform(self) -> transforms.Compose:
-        """Create image transforms from config parameters."""
-        p = self.hparams
-        return transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Resize((p.image_size, p.image_size)),
-        ])
+    def preprocess_frames(self, frames: torch.Tensor, out: torch.Tensor | None = None) -> torch.Tensor:
+        """Convert a (B,H,W,C) uint8 batch of frames to the (B,C,image_size,image_size) float model input"""
+        return preprocess_frames(frames, self.hparams.image_size, out=out)
+
+    def create_calibration_batches(self, data_dir: Path, num_frames: int, batch_size: int) -> list[tuple[torch.Tensor, torch.Tensor]]:
+        """
+        (frames, action histories) batches of up to num_frames random recorded frames, preprocessed like
+        the training batches, to calibrate a quantized model with. Empty when there are no recordings.
+        """
+        if not data_dir.exists():
+            return []
+        dataset = recorded_dataset.RecordedDataset(
+            data_dir=data_dir,
+            history_digest=self.create_history_digest(),
+            action_categorizer=self.create_action_categorizer(),
+        )
+        indices = np.random.default_rng(0).permutation(len(dataset))[:num_frames]
+        batches = []
+        for start in range(0, len(indices), batch_size):
+            batch = collate_frames([dataset[index] for index in indices[start:start + batch_size]], self.hparams.image_size)
+            batches.append((batch["frame"], batch["action_history"]))
+        return batches
 
     def train_dataloader(self) -> DataLoader:
         print("train_dataloader")
         p = self.hparams
+        dataloader_config = p.get("dataloader", {})
+        num_workers = dataloader_config.get("num_workers", 0)
 
         history_digest = self.create_history_digest()
         action_categorizer = self.create_action_categorizer()
-        transform = self.create_transform()
 
         print(history_digest)
 
+        # Every worker holds its own frame cache, so the budget is split between them
+        frame_cache_bytes = p.get("frame_cache_mb", 0) * 2**20 // max(num_workers, 1)
+
+        # The dataset returns uint8 frames, the workers preprocess each batch with the same code the game runs
         dataset = recorded_dataset.RecordedDataset(
             data_dir=Path(p.data_dir),
             history_digest=history_digest,
             action_categorizer=action_categorizer,
-            transform=transform,
+            frame_cache_bytes=frame_cache_bytes,
+            num_preprocess_workers=dataloader_config.get("preprocess_workers", 1),
         )
 
         return DataLoader(
             dataset=dataset, 
             batch_size=p.batch_size,
             shuffle=True,
+            num_workers=num_workers,
+            persistent_workers=num_workers > 0 and dataloader_config.get("persistent_workers", False),
+            prefetch_factor=dataloader_config.get("prefetch_factor", 2) if num_workers > 0 else None,
+            pin_memory=dataloader_config.get("pin_memory", False),
+            collate_fn=partial(collate_frames, image_size=p.image_size),
         )
 
     def configure_optimizers(self):
         return torch.optim.Adam(self.parameters(), lr=0.001)
 
-    def training_step(self, batch, batch_idx):
-        
+    def compute_loss(self, batch) -> torch.Tensor:
         frame = batch["frame"]
-        action = batch["action"]
         action_category = batch["action_category"]
         action_history = batch["action_history"]
 
+        if self.get_training_profile()["channels_last"]:
+            frame = frame.contiguous(memory_format=torch.channels_last)
+
         action_logits = self.model(frame, action_history)
-        loss = self.criterion(action_logits, action_category)
+        return self.criterion(action_logits, action_category)
+
+    def training_step(self, batch, batch_idx):
+        loss = self.compute_loss(batch)
         self.log("train_loss", loss)
         return loss
     
@@ -1,11 +1,10 @@
 import click
-from game import Game
 from pathlib import Path
-from lit_module import LitModule
-import lightning as L
-import yaml
-from lightning.pytorch.loggers import TensorBoardLogger
-from lightning.pytorch.callbacks import ModelCheckpoint
+import config as sim_config
+import json
+import dataclasses
+
+# The commands import what they use themselves, so no command pays for torch and lightning unless it needs them
 
 @click.group()
 def cli():
@@ -13,12 +12,77 @@ def cli():
     pass
 
 @cli.command()
-@click.option('--checkpoint-path', type=Path, help='Path to the checkpoint file')
-def run(checkpoint_path: Path):
-    """Run the autonomous driver with a trained model"""
-    game = Game(checkpoint_path)
+@click.option('--checkpoint-path', type=Path, help='Path to the checkpoint file, without one you drive car 0 by hand and the model is never loaded')
+@click.option('--headless', is_flag=True, help='Run without a display as fast as the CPU allows')
+@click.option('--num-steps', type=int, default=None, help='Number of steps to run in headless mode')
+@click.option('--record', is_flag=True, help='Record from the first step in headless mode')
+@click.option('--engine', type=click.Choice(sim_config.inference_engine_names), default='eager', help='Inference engine to run the model with')
+@click.option('--device', type=str, default='cpu', help='Device to run the model on, e.g. cpu or mps')
+@click.option('--inference-latency', type=click.IntRange(min=0), default=sim_config.inference_latency, help='Frames between observing and acting, 1 or more runs inference in the background')
+@click.option('--seed', type=int, default=sim_config.seed, help='Seed for car placement and action sampling, for reproducible runs')
+@click.option('--time-frames', is_flag=True, help='Time each stage of the game loop and report its percentiles')
+@click.option('--show-frame-times', is_flag=True, help='Draw the frame time percentiles on screen, implies --time-frames')
+@click.option('--frame-times-csv', type=Path, default=None, help='CSV file to write the stage times of every frame to, implies --time-frames')
+@click.option('--frame-times-logdir', type=Path, default=None, help='TensorBoard log directory for the stage times of every frame, implies --time-frames')
+@click.option('--record-fleet', is_flag=True, default=sim_config.record_fleet, help='Record every car into its own recording, not only car 0')
+@click.option('--record-cars', type=str, default=None, help='Comma separated indices of the cars recorded in fleet mode, all cars by default')
+@click.option('--render-at-image-size', is_flag=True, default=sim_config.render_at_image_size, help="Render the views at the model's image size so they need no resize, recordings are then at that size too")
+def run(
+    checkpoint_path: Path,
+    headless: bool,
+    num_steps: int | None,
+    record: bool,
+    engine: str,
+    device: str,
+    inference_latency: int,
+    seed: int | None,
+    time_frames: bool,
+    show_frame_times: bool,
+    frame_times_csv: Path | None,
+    frame_times_logdir: Path | None,
+    record_fleet: bool,
+    record_cars: str | None,
+    render_at_image_size: bool,
+):
+    """Run the autonomous driver with a trained model, or drive by hand without one"""
+    if checkpoint_path is None and headless:
+        raise click.UsageError("Headless runs are driven by the model, give a --checkpoint-path")
+
+    from game import Game, FRAME_STAGES
+    from frame_timer import FrameTimer
+
+    record_car_indices = sim_config.record_car_indices
+    if record_cars is not None:
+        try:
+            record_car_indices = [int(car_index) for car_index in record_cars.split(",")]
+        except ValueError:
+            raise click.BadParameter(f"{record_cars} is not a comma separated list of car indices", param_hint="--record-cars")
+        out_of_range = [car_index for car_index in record_car_indices if not 0 <= car_index < sim_config.num_cars]
+        if len(out_of_range) > 0:
+            raise click.BadParameter(f"car indices {out_of_range} are not in [0, {sim_config.num_cars})", param_hint="--record-cars")
+
+    frame_timer = None
+    if time_frames or show_frame_times or frame_times_csv is not None or frame_times_logdir is not None:
+        frame_timer = FrameTimer(FRAME_STAGES, csv_path=frame_times_csv, tensorboard_dir=frame_times_logdir)
+
+    game = Game(
+        checkpoint_path,
+        headless=headless,
+        engine=engine,
+        device=device,
+        inference_latency=inference_latency,
+        seed=seed,
+        frame_timer=frame_timer,
+        show_frame_times=show_frame_times,
+        record_fleet=record_fleet,
+        record_car_indices=record_car_indices,
+        render_at_image_size=render_at_image_size,
+    )
     game.setup()
-    game.run()
+    if headless:
+        game.run_headless(num_steps=num_steps, record=record)
+    else:
+        game.run()
 
 
 @cli.command()
@@ -26,10 +90,18 @@ def run(checkpoint_path: Path):
 @click.option('--checkpoint-path', type=Path, help='Path to the checkpoint file')
 def train(config_path: Path, checkpoint_path: Path):
     """Train the autonomous driver model"""
+    import lightning as L
+    from lightning.pytorch.loggers import TensorBoardLogger
+    from lightning.pytorch.callbacks import ModelCheckpoint
+    import torch
+    from lit_module import LitModule
 
     config = load_config(config_path)
 
     model = LitModule(config)
+    profile = model.get_training_profile()
+    if profile["num_threads"] is not None:
+        torch.set_num_threads(profile["num_threads"])
 
     logger = TensorBoardLogger(
         save_dir="lightning_logs",
@@ -49,6 +121,8 @@ def train(config_path: Path, checkpoint_path: Path):
         max_epochs=None,
         logger=logger,
         callbacks=[checkpoint_callback],
+        precision=profile["precision"],
+        accumulate_grad_batches=profile["accumulate_grad_batches"],
     )
 
     trainer.fit(
@@ -56,7 +130,148 @@ def train(config_path: Path, checkpoint_path: Path):
         ckpt_path=checkpoint_path,
     )
 
+@cli.command()
+@click.option('--data-dir', type=Path, required=True, help='Directory with the PNG recordings')
+@click.option('--output-dir', type=Path, required=True, help='Directory to write the shard recordings to')
+@click.option('--frames-per-shard', type=int, default=sim_config.recording_frames_per_shard, help='Number of frames in each shard')
+def convert_recordings(data_dir: Path, output_dir: Path, frames_per_shard: int):
+    """Convert PNG recordings to the memory-mapped shard format"""
+    from shard_recording import convert_png_recording, is_shard_recording
+
+    for recording_dir in sorted(data_dir.glob("recording_*")):
+        if is_shard_recording(recording_dir):
+            continue
+        shard_recording_dir = output_dir / recording_dir.name
+        if is_shard_recording(shard_recording_dir):
+            print(f"Skipping {recording_dir}, already converted")
+            continue
+        num_frames = convert_png_recording(recording_dir, shard_recording_dir, frames_per_shard=frames_per_shard)
+        print(f"Converted {num_frames} frames from {recording_dir} to {shard_recording_dir}")
+
+@cli.command()
+@click.option('--output', type=Path, default=Path('benchmarks/results.json'), help='File to save the results to')
+@click.option('--baseline', type=Path, default=Path('benchmarks/baseline.json'), help='Results to compare against, created from this run if it does not exist')
+@click.option('--tolerance', type=float, default=0.25, help='Fraction a measurement may be slower than its baseline before it is a regression')
+@click.option('--min-time', type=float, default=1.0, help='Seconds to time each measurement for')
+@click.option('--quick', is_flag=True, help='Run a smaller sweep')
+def bench(output: Path, baseline: Path, tolerance: float, min_time: float, quick: bool):
+    """Benchmark the simulation, history, dataset and model hot paths"""
+    import benchmark
+
+    sweep = benchmark.QUICK_SWEEP if quick else benchmark.FULL_SWEEP
+    results = benchmark.run_benchmarks(sweep, min_time=min_time)
+    benchmark.save_results(results, output)
+
+    if not baseline.exists():
+        print(benchmark.format_results(results))
+        benchmark.save_results(results, baseline)
+        print(f"Saved the results as the new baseline {baseline}")
+        return
+
+    baseline_results = benchmark.load_results(baseline)
+    print(benchmark.format_results(results, baseline_results))
+    regressions = benchmark.find_regressions(results, baseline_results, tolerance)
+    for result, baseline_result in regressions:
+        print(f"Regression: {result.key} took {result.seconds_per_call / baseline_result.seconds_per_call:.2f}x its baseline")
+    if len(regressions) > 0:
+        raise SystemExit(1)
+
+@cli.command()
+@click.option('--batch-size', type=int, default=32, help='Samples per training step')
+@click.option('--min-time', type=float, default=5.0, help='Seconds to time each setting for')
+@click.option('--profile', 'profiles', type=str, multiple=True, help='Training setting to time, may be given several times, all settings by default')
+def bench_training(batch_size: int, min_time: float, profiles: tuple[str, ...]):
+    """Report the training samples per second of each training performance setting"""
+    import benchmark
+
+    profiles = list(profiles) if len(profiles) > 0 else list(benchmark.TRAINING_PROFILES)
+    sweep = dataclasses.replace(benchmark.FULL_SWEEP, batch_sizes=[batch_size], training_profiles=profiles)
+    for result in benchmark.bench_training(sweep, min_time=min_time):
+        print(f"{result.params['profile']:<20} {1 / result.seconds_per_call:8.1f} samples/s")
+
+@cli.command()
+@click.option('--checkpoint-path', type=Path, multiple=True, help='Checkpoint to evaluate, may be given several times')
+@click.option('--checkpoint-dir', type=Path, default=None, help='Evaluate every .ckpt file in this directory, like the top-k checkpoints of a training run')
+@click.option('--num-episodes', type=int, default=4, help='Number of seeded episodes per checkpoint')
+@click.option('--num-steps', type=int, default=300, help='Number of steps per episode')
+@click.option('--num-cars', type=int, default=sim_config.num_cars, help='Number of cars per episode')
+@click.option('--num-workers', type=int, default=4, help='Number of worker processes running episodes')
+@click.option('--engine', type=click.Choice(sim_config.inference_engine_names), default='eager', help='Inference engine to run the model with')
+@click.option('--output', type=Path, default=None, help='JSON file to save the metrics of every episode to')
+def evaluate(
+    checkpoint_path: tuple[Path, ...],
+    checkpoint_dir: Path | None,
+    num_episodes: int,
+    num_steps: int,
+    num_cars: int,
+    num_workers: int,
+    engine: str,
+    output: Path | None,
+):
+    """Evaluate checkpoints on seeded headless episodes"""
+    import evaluation
+
+    checkpoint_paths = list(checkpoint_path)
+    if checkpoint_dir is not None:
+        checkpoint_paths += sorted(checkpoint_dir.glob("*.ckpt"))
+    if len(checkpoint_paths) == 0:
+        raise click.UsageError("Give a --checkpoint-path or a --checkpoint-dir with checkpoints in it")
+
+    report = {}
+    for path in checkpoint_paths:
+        episodes = evaluation.evaluate_checkpoint(
+            path,
+            num_episodes=num_episodes,
+            num_steps=num_steps,
+            num_cars=num_cars,
+            num_workers=num_workers,
+            engine=engine,
+        )
+        summary = evaluation.summarize_episodes(episodes)
+        report[str(path)] = {"summary": summary, "episodes": [dataclasses.asdict(episode) for episode in episodes]}
+        print(
+            f"{path}: distance {summary['distance_travelled']:.0f}px, "
+            f"stuck {summary['stuck_fraction']:.1%}, off road {summary['off_road_fraction']:.1%}, "
+            f"collisions {summary['collisions_per_step']:.2f}/step, "
+            f"{summary['simulation_steps_per_second']:.1f} steps/s, {summary['inference_frames_per_second']:.0f} inference frames/s"
+        )
+        print(f"  action distribution: {' '.join(f'{fraction:.2f}' for fraction in summary['action_distribution'])}")
+
+    if output is not None:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+@cli.command()
+@click.option('--map-path', type=Path, default=sim_config.map_path, help='Map image to build the road map of')
+@click.option('--preview-path', type=Path, default=None, help='Image file to draw the drivable area over the map into')
+def preprocess_map(map_path: Path, preview_path: Path | None):
+    """Build and cache the drivable mask and road edge distances of a map"""
+    import cv2
+    import numpy as np
+    from road_map import RoadMap, get_map_hash
+
+    road_map = RoadMap.load_or_build(map_path)
+    print(f"Road map {get_map_hash(map_path)} in {sim_config.road_map_cache_dir}: {road_map.drivable.mean():.1%} of the map is road, up to {road_map.distance.max():.0f} pixels from its edge")
+
+    if preview_path is not None:
+        preview = cv2.imread(str(map_path))
+        preview[road_map.drivable] = preview[road_map.drivable] // 2 + np.array([0, 0, 128], dtype=np.uint8)
+        cv2.imwrite(str(preview_path), preview)
+
+@cli.command()
+@click.option('--map-path', type=Path, default=sim_config.map_path, help='Map image to cut into tiles')
+@click.option('--output-dir', type=Path, required=True, help='Directory to write the tiled map to, usable as the map path')
+@click.option('--tile-size', type=int, default=sim_config.map_tile_size, help='Width and height of each tile in pixels')
+def tile_map(map_path: Path, output_dir: Path, tile_size: int):
+    """Cut a map image into tiles, which are loaded lazily around the cars instead of holding the whole map in memory"""
+    from tiled_map import build_tiled_map
+
+    tiled_map = build_tiled_map(map_path, output_dir, tile_size=tile_size)
+    print(f"Tiled {tiled_map.width}x{tiled_map.height} map into {tiled_map.num_tile_rows}x{tiled_map.num_tile_cols} tiles of {tile_size} pixels in {output_dir}")
+
 def load_config(config: Path):
+    import yaml
     with open(config, 'r') as f:
         return yaml.load(f, Loader=yaml.SafeLoader)
    
@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+import pytest
+from click.testing import CliRunner
+import config
+import main
+
+
+def get_imported_modules(code):
+    """The modules imported after running code in a fresh interpreter"""
+    environment = {**os.environ, "SDL_VIDEODRIVER": "dummy"}
+    result = subprocess.run(
+        [sys.executable, "-c", f"{code}\nimport sys\nprint(' '.join(sys.modules))"],
+        cwd=config.project_root, env=environment, check=True, capture_output=True, text=True,
+    )
+    # The modules are printed last, after anything the code printed
+    return set(result.stdout.splitlines()[-1].split())
+
+
+@pytest.mark.parametrize("code", [
+    # The CLI help
+    "import sys; sys.argv = ['main.py', '--help']\nimport main\ntry: main.cli()\nexcept SystemExit: pass",
+    # Driving by hand, without a checkpoint
+    "import game\ngame_ = game.Game(None)\ngame_.setup()\ngame_.loop()\ngame_.close()",
+])
+def test_startup_does_not_import_torch(code):
+    modules = get_imported_modules(code)
+    assert "pygame" in modules or "click" in modules
+    assert "torch" not in modules
+    assert "lightning" not in modules
+
+
+@pytest.mark.parametrize("record_cars", ["0,-1", f"1,{config.num_cars}", "0,a"])
+def test_record_cars_are_checked(record_cars):
+    result = CliRunner().invoke(main.cli, ["run", "--record-fleet", "--record-cars", record_cars])
+    assert result.exit_code == 2
+    assert "--record-cars" in result.output
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,135 @@
+import math
+import cv2
+import numpy as np
+from spatial_grid import SpatialGrid
+from tiled_map import ArrayMap, TiledMap
+
+
+class ObservationRenderer:
+    """
+    Renders the ego view of every car directly from the map, held in memory or as tiles.
+    Each view only touches the map pixels under the car's rotated view window and
+    the cars near enough to appear in it, so the cost per view does not depend on map size.
+    The view window of view_width by view_height map pixels can be rendered at another output
+    size, like the model's image size, so the views need no resize afterwards.
+    """
+    def __init__(self,
+        map_source: ArrayMap | TiledMap,
+        view_width: int,
+        view_height: int,
+        car_length: int,
+        car_width: int,
+        car_color: tuple[int, int, int] = (255, 0, 0),
+        output_size: tuple[int, int] | None = None,
+    ):
+        self.map_source = map_source
+        self.map_height, self.map_width = map_source.height, map_source.width
+
+        self.view_width = view_width
+        self.view_height = view_height
+        self.output_width, self.output_height = output_size if output_size is not None else (view_width, view_height)
+        self.car_length = car_length
+        self.car_width = car_width
+        self.car_color = car_color
+
+        # Any pixel of the rotated view window lies within this radius of the car.
+        # The extra pixels leave room for the bilinear interpolation neighbours.
+        self.view_radius = math.hypot(view_width, view_height) / 2 + 2
+        self.car_radius = math.hypot(car_length, car_width) / 2
+
+        # Scratch image for the map crop of one view, reused for every car
+        crop_size = 2 * math.ceil(self.view_radius) + 3
+        self.crop_buffer = np.zeros((crop_size, crop_size, 3), dtype=np.uint8)
+
+    def get_view_matrices(self, x: np.ndarray, y: np.ndarray, angle_deg: np.ndarray) -> np.ndarray:
+        """
+        Get the (N,2,3) affine matrices mapping map pixels to view pixels.
+        This is cv2.getRotationMatrix2D(center=(x,y), angle=angle_deg+90) shifted so the car sits
+        in the centre of the view, computed for all cars at once.
+        """
+        angle_rad = np.radians(angle_deg + 90)
+        alpha = np.cos(angle_rad)
+        beta = np.sin(angle_rad)
+
+        matrices = np.empty((len(x), 2, 3))
+        matrices[:, 0, 0] = alpha
+        matrices[:, 0, 1] = beta
+        matrices[:, 0, 2] = (1 - alpha) * x - beta * y + self.view_width / 2 - x
+        matrices[:, 1, 0] = -beta
+        matrices[:, 1, 1] = alpha
+        matrices[:, 1, 2] = beta * x + (1 - alpha) * y + self.view_height / 2 - y
+
+        # Scale the view window to the output size, keeping the pixel centres aligned like a resize
+        if (self.output_width, self.output_height) != (self.view_width, self.view_height):
+            scale = np.array([[self.output_width / self.view_width], [self.output_height / self.view_height]])
+            matrices *= scale
+            matrices[:, :, 2] += 0.5 * scale[:, 0] - 0.5
+        return matrices
+
+    def get_car_corners(self, x: np.ndarray, y: np.ndarray, angle_deg: np.ndarray) -> np.ndarray:
+        """Get the (N,4,2) corners of each car's rectangle in map pixel coordinates"""
+        angle_rad = np.radians(angle_deg)
+        cos = np.cos(angle_rad)[:, None]
+        sin = np.sin(angle_rad)[:, None]
+
+        # Corners relative to the car centre, length along the heading and width across it.
+        # The polygon runs through the centres of the outermost pixels, like the rotated pygame rect.
+        half_length = (self.car_length - 1) / 2
+        half_width = (self.car_width - 1) / 2
+        along = np.array([-half_length, half_length, half_length, -half_length])
+        across = np.array([-half_width, -half_width, half_width, half_width])
+
+        corners = np.empty((len(x), 4, 2))
+        corners[:, :, 0] = x[:, None] + along * cos - across * sin
+        corners[:, :, 1] = y[:, None] + along * sin + across * cos
+        return corners
+
+    def render_views(self,
+        x: np.ndarray,
+        y: np.ndarray,
+        angle_deg: np.ndarray,
+        out: np.ndarray | None = None,
+        grid: SpatialGrid | None = None,
+    ) -> np.ndarray:
+        """
+        Render the views of all cars into an (N,output_height,output_width,3) uint8 array.
+        Pass out to reuse a preallocated buffer. Pass a grid built from x and y to find the
+        cars near each view from its cells instead of from every car.
+        """
+        num_cars = len(x)
+        if out is None:
+            out = np.empty((num_cars, self.output_height, self.output_width, 3), dtype=np.uint8)
+
+        matrices = self.get_view_matrices(x, y, angle_deg)
+        car_corners = self.get_car_corners(x, y, angle_deg)
+
+        # Bounds of the map crop around each car
+        x0 = np.clip(np.floor(x - self.view_radius), 0, self.map_width).astype(np.int64)
+        x1 = np.clip(np.ceil(x + self.view_radius) + 1, 0, self.map_width).astype(np.int64)
+        y0 = np.clip(np.floor(y - self.view_radius), 0, self.map_height).astype(np.int64)
+        y1 = np.clip(np.ceil(y + self.view_radius) + 1, 0, self.map_height).astype(np.int64)
+
+        # A car can appear in a view when its centre is this close to the viewing car
+        reach = self.view_radius + self.car_radius
+
+        for i in range(num_cars):
+            crop = self.crop_buffer[:y1[i] - y0[i], :x1[i] - x0[i]]
+            self.map_source.read_region(x0[i], y0[i], x1[i], y1[i], out=crop)
+
+            # Draw the cars inside the view window on the crop, in the same order the full render does
+            if grid is None:
+                nearby = np.flatnonzero((np.abs(x - x[i]) <= reach) & (np.abs(y - y[i]) <= reach))
+            else:
+                candidates = grid.query_box(x[i], y[i], reach)
+                nearby = np.sort(candidates[(np.abs(x[candidates] - x[i]) <= reach) & (np.abs(y[candidates] - y[i]) <= reach)])
+            for j in nearby:
+                corners = car_corners[j] - (x0[i], y0[i])
+                # Draw with 4 fractional bits so sub pixel positions are kept
+                cv2.fillConvexPoly(crop, np.round(corners * 16).astype(np.int32), self.car_color, lineType=cv2.LINE_8, shift=4)
+
+            # Shift the matrix from map coordinates to crop coordinates
+            matrix = matrices[i].copy()
+            matrix[:, 2] += matrix[:, :2] @ (x0[i], y0[i])
+            cv2.warpAffine(crop, matrix, (self.output_width, self.output_height), dst=out[i])
+
+        return out
@@ -0,0 +1,94 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import cv2
+import numpy as np
+import pygame
+import pytest
+import config
+from environment import Environment, Car
+
+
+def render_reference_views(env: Environment, draw_cars: bool = True) -> np.ndarray:
+    """The original full-map render, array3d and one warpAffine per car"""
+    env.surface.blit(env.map_image, (0, 0))
+    if draw_cars:
+        for car in env.cars:
+            car_rect = pygame.Surface((car.length, car.width), pygame.SRCALPHA)
+            pygame.draw.rect(car_rect, (255, 0, 0), (0, 0, car.length, car.width))
+            rotated_car = pygame.transform.rotate(car_rect, -car.angle_deg)
+            env.surface.blit(rotated_car, rotated_car.get_rect(center=(car.x, car.y)).topleft)
+
+    surface_np = np.transpose(pygame.surfarray.array3d(env.surface), (1, 0, 2))
+
+    views = []
+    for car in env.cars:
+        M = cv2.getRotationMatrix2D(center=(car.x, car.y), angle=car.angle_deg + 90, scale=1.0)
+        M[0, 2] += car.view_width / 2 - car.x
+        M[1, 2] += car.view_height / 2 - car.y
+        views.append(cv2.warpAffine(surface_np, M, (car.view_width, car.view_height)))
+    return np.stack(views)
+
+
+@pytest.fixture
+def env():
+    env = Environment(config.map_path, headless=True)
+    rng = np.random.default_rng(0)
+    # Cars spread over the whole map, including its edges
+    for _ in range(30):
+        env.add_car(Car(env, x=rng.uniform(0, env.map_width), y=rng.uniform(0, env.map_height), angle_deg=rng.uniform(0, 360)))
+    env.add_car(Car(env, x=0, y=0, angle_deg=45))
+    env.add_car(Car(env, x=env.map_width, y=env.map_height, angle_deg=200))
+    # A cluster of cars that appear in each other's views
+    for _ in range(20):
+        env.add_car(Car(env, x=500 + rng.uniform(-40, 40), y=500 + rng.uniform(-40, 40), angle_deg=rng.uniform(0, 360)))
+    return env
+
+
+def test_map_pixels_match_reference(env, monkeypatch):
+    reference = render_reference_views(env, draw_cars=False)
+
+    # Move every car polygon far off the map so only map pixels are rendered
+    monkeypatch.setattr(
+        env.observation_renderer,
+        "get_car_corners",
+        lambda x, y, angle_deg: np.full((len(x), 4, 2), -1000.0),
+    )
+    views = env.get_views()
+
+    difference = np.abs(reference.astype(np.int32) - views.astype(np.int32))
+    assert difference.max() <= 1
+
+
+def test_views_match_reference_within_tolerance(env):
+    reference = render_reference_views(env)
+    views = env.get_views()
+
+    assert views.shape == reference.shape
+    assert views.dtype == np.uint8
+
+    # Only the anti-aliased edges of the cars may differ
+    difference = np.abs(reference.astype(np.int32) - views.astype(np.int32))
+    assert difference.mean() < 2.0
+    assert np.mean(difference.max(axis=-1) > 32) < 0.03
+
+
+def test_views_are_written_into_out_buffer(env):
+    out = np.zeros((len(env.cars), config.view_height, config.view_width, 3), dtype=np.uint8)
+    views = env.get_views(out=out)
+
+    assert views is out
+    assert np.array_equal(out, env.get_views())
+
+
+def test_observations_views_match_batched_views(env):
+    observations = env.get_observations()
+    views = env.get_views()
+
+    assert len(observations) == len(env.cars)
+    for observation, view in zip(observations, views):
+        assert np.array_equal(observation.view, view)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -1,10 +1,27 @@
-from typing import Callable
+from typing import Callable, Sequence
 from torch.utils.data import Dataset
 from pathlib import Path
 from history_digest import HistoryDigest
+import dataclasses
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from PIL import Image
 from action_categorizer import ActionCategorizer
+from shard_recording import ShardRecordingReader
+from frame_cache import FrameCache
+from recording_preprocessing import PngFrames, get_recording_signature, open_recording_frames, preprocess_recording
+
+MANIFEST_FILE_NAME = "manifest.json"
+
+@dataclasses.dataclass
+class PreprocessedRecording:
+    """The frames of one recording with its actions and action histories held in memory"""
+    frames: Sequence[np.ndarray] # (height, width, channels) uint8 RGB frames
+    actions: np.ndarray # (num_frames, action_length)
+    action_categories: np.ndarray # (num_frames,) int64
+    action_histories: np.ndarray # (num_frames, num_windows, action_length)
 
 class RecordedDataset(Dataset):
     def __init__(self,
@@ -12,93 +29,174 @@ class RecordedDataset(Dataset):
         history_digest:HistoryDigest,
         action_categorizer:ActionCategorizer,
         transform:Callable = lambda x: x,
+        frame_cache_bytes:int = 0,
+        num_preprocess_workers:int = 1,
     ):
         self.data_dir = data_dir
         self.history_digest = history_digest
         self.action_categorizer = action_categorizer
         self.transform = transform
+        self.frame_cache = FrameCache(frame_cache_bytes)
+        self.num_preprocess_workers = num_preprocess_workers
 
         self.cache_dir = data_dir / "cache"
         self.cache_dir.mkdir(parents=True, exist_ok=True)
 
         recording_dirs = self.find_all_recording_dirs(self.data_dir)
-        self.frame_path_tuples = self.make_list_of_all_training_items(recording_dirs)
-        
+        self.recordings = self.make_list_of_all_recordings(recording_dirs)
+        self.items = self.make_list_of_all_training_items(self.recordings)
+
     def find_all_recording_dirs(self, data_dir:Path):
-        recordings = list(data_dir.glob("recording_*"))
+        recordings = sorted(data_dir.glob("recording_*"))
         print(f"Found {len(recordings)} recordings: {data_dir}")
         return recordings
 
-    def make_list_of_all_training_items(self, recording_dirs:list[Path]):
-        frame_path_tuples = []
-        for recording_dir in recording_dirs:
-            frame_path_tuples.extend(
-                self.preprocess_single_recording(recording_dir),
-            )
-        return frame_path_tuples
-
-    def preprocess_single_recording(self, recording_dir:Path):
-
-        frame_path_tuples = self.get_frame_path_tuples(recording_dir)
-
-        if self.check_preprocessing_complete(frame_path_tuples):
-            return frame_path_tuples
-
-        print(f"Preprocessing {recording_dir}")
-        for i, (frame_path, action_path, history_path) in enumerate(frame_path_tuples):
-            action = np.load(action_path)
-
-            if i == 0:
-                # Fill the history digest with the first action
-                self.history_digest.fill(action)
-
-            # Get the history digest and save it
-            action_history = self.history_digest.get_window_averages_numpy()
-            np.save(history_path, action_history)
-            
-            # Push the action to the history digest
-            self.history_digest.push(action)
-
-        return frame_path_tuples
-
-    def check_preprocessing_complete(self, frame_path_tuples:list[tuple[Path, Path, Path]]):
+    def make_list_of_all_recordings(self, recording_dirs:list[Path]):
+        """
+        Load the cached actions and histories of every recording, first preprocessing the recordings
+        that are new or changed since their cache was written, according to the manifest.
         """
-        Preprocessing is complete if the first and last history paths exist.
+        manifest = self.load_manifest()
+        frames = [self.get_frames(recording_dir) for recording_dir in recording_dirs]
+        signatures = {}
+        stale_recording_dirs = []
+        for recording_dir, recording_frames in zip(recording_dirs, frames):
+            if len(recording_frames) == 0:
+                continue
+            key = recording_dir.relative_to(self.data_dir).as_posix()
+            signatures[key] = get_recording_signature(recording_dir, len(recording_frames))
+            cache_paths = self.get_cache_paths(recording_dir)
+            if manifest.get(key) != signatures[key] or not all(path.exists() for path in cache_paths):
+                stale_recording_dirs.append((recording_dir, len(recording_frames)))
+
+        if len(stale_recording_dirs) > 0:
+            self.preprocess_recordings(stale_recording_dirs)
+        # Recordings that were deleted drop out of the manifest
+        self.save_manifest(signatures)
+
+        return [
+            self.load_preprocessed_recording(recording_dir, recording_frames)
+            for recording_dir, recording_frames in zip(recording_dirs, frames)
+            if len(recording_frames) > 0
+        ]
+
+    def preprocess_recordings(self, recording_dirs:list[tuple[Path, int]]):
+        """Preprocess the (recording dir, number of frames) recordings, one recording per task of the process pool"""
+        print(f"Preprocessing {len(recording_dirs)} new or changed recordings")
+        tasks = [
+            (recording_dir, num_frames, self.history_digest.window_sizes, *self.get_cache_paths(recording_dir))
+            for recording_dir, num_frames in recording_dirs
+        ]
+        num_workers = min(self.num_preprocess_workers, len(tasks))
+        if num_workers <= 1:
+            for task in tasks:
+                preprocess_recording(*task)
+            return
+
+        # Spawned workers start clean, they only import the numpy modules of preprocess_recording
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as executor:
+            futures = [executor.submit(preprocess_recording, *task) for task in tasks]
+            for future in futures:
+                future.result()
+
+    def load_preprocessed_recording(self, recording_dir:Path, frames:"PngFrames | ShardRecordingReader") -> PreprocessedRecording:
+        actions_cache_path, history_cache_path = self.get_cache_paths(recording_dir)
+        actions = np.load(actions_cache_path)
+        return PreprocessedRecording(
+            frames=frames,
+            actions=actions,
+            action_categories=self.action_categorizer.to_categories(actions),
+            action_histories=np.load(history_cache_path),
+        )
+
+    def get_manifest_path(self) -> Path:
+        return self.get_digest_cache_dir() / MANIFEST_FILE_NAME
+
+    def get_digest_config(self) -> dict:
+        return {
+            "window_sizes": self.history_digest.window_sizes,
+            "action_vector_length": self.action_categorizer.action_vector_length,
+        }
+
+    def load_manifest(self) -> dict[str, dict]:
+        """The signature of every recording whose cache is complete, empty when the digest config changed"""
+        manifest_path = self.get_manifest_path()
+        if not manifest_path.exists():
+            return {}
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("digest_config") != self.get_digest_config():
+            return {}
+        return manifest["recordings"]
+
+    def save_manifest(self, signatures:dict[str, dict]):
+        manifest_path = self.get_manifest_path()
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so an interrupted write never leaves a manifest vouching for missing caches
+        temporary_path = manifest_path.with_suffix(".tmp")
+        with open(temporary_path, "w") as f:
+            json.dump({"digest_config": self.get_digest_config(), "recordings": signatures}, f, indent=2)
+        os.replace(temporary_path, manifest_path)
+
+    def make_list_of_all_training_items(self, recordings:list[PreprocessedRecording]):
+        """
+        Each training item is a (recording index, frame index) row.
+        Keeping them in one integer array avoids a Python object per frame.
         """
-        first_history_path = frame_path_tuples[0][2]
-        last_history_path = frame_path_tuples[-1][2]
-        return first_history_path.exists() and last_history_path.exists()
-
-    def get_frame_path_tuples(self, recording_dir:Path):
-        frame_path_list = sorted(list(recording_dir.glob("*_frame.png")))
-        action_path_list = [p.with_name(p.name.replace("_frame.png", "_action.npy")) for p in frame_path_list]
-        history_path_list = [p.with_name(p.name.replace("_frame.png", "_history.npy")) for p in frame_path_list]
-        history_path_list = [self.map_path_to_cache_path(p) for p in history_path_list]
-        return list(zip(frame_path_list, action_path_list, history_path_list))
-
-    def map_path_to_cache_path(self, path:Path):
-        relative_path = path.relative_to(self.data_dir)
-        hash_str = "_".join([f"{window.window_size}" for window in self.history_digest.windows])
-        cache_path = self.cache_dir / hash_str / relative_path
+        items = [
+            np.stack([np.full(len(recording.frames), recording_index), np.arange(len(recording.frames))], axis=1)
+            for recording_index, recording in enumerate(recordings)
+        ]
+        if len(items) == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        return np.concatenate(items)
+
+    def get_frames(self, recording_dir:Path) -> "PngFrames | ShardRecordingReader":
+        return open_recording_frames(recording_dir)
+
+    def get_digest_cache_dir(self) -> Path:
+        """The caches of every digest configuration live in a directory of their own"""
+        hash_str = "_".join([f"{window_size}" for window_size in self.history_digest.window_sizes])
+        return self.cache_dir / hash_str
+
+    def get_cache_paths(self, recording_dir:Path):
+        """One actions array and one history array per recording, keyed by the window sizes"""
+        relative_path = recording_dir.relative_to(self.data_dir)
+        cache_path = self.get_digest_cache_dir() / relative_path
         cache_path.parent.mkdir(parents=True, exist_ok=True)
-        return cache_path
-    
+        actions_cache_path = cache_path.with_name(f"{cache_path.name}_actions.npy")
+        history_cache_path = cache_path.with_name(f"{cache_path.name}_history.npy")
+        return actions_cache_path, history_cache_path
+
     def __len__(self):
-        return len(self.frame_path_tuples)
+        return len(self.items)
 
     def __getitem__(self, index):
 
-        frame_path, action_path, action_history_path = self.frame_path_tuples[index]
-        frame = Image.open(frame_path)
-        action = np.load(action_path)
-        action_history = np.load(action_history_path)
+        recording_index, frame_index = self.items[index]
+        recording = self.recordings[recording_index]
+
+        frame = self.load_frame(recording_index, frame_index)
+        action = recording.actions[frame_index]
+        action_category = recording.action_categories[frame_index]
+        action_history = recording.action_histories[frame_index]
 
         frame = self.transform(frame)
-        action_category = self.action_categorizer.to_category(action)
 
         return {
             "frame": frame,
             "action": action.astype(np.float32),
-            "action_category": action_category.astype(np.float32),
+            "action_category": action_category,
             "action_history": action_history.astype(np.float32),
-        }
\ No newline at end of file
+        }
+
+    def load_frame(self, recording_index:int, frame_index:int) -> np.ndarray:
+        """Load a (height, width, channels) uint8 frame, from the frame cache when it is there"""
+        key = (recording_index, frame_index)
+        frame = self.frame_cache.get(key)
+        if frame is None:
+            # Copy so the frame is writable and does not hold on to a memory mapped shard
+            frame = np.array(self.recordings[recording_index].frames[frame_index])
+            self.frame_cache.put(key, frame)
+        return frame
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+import recorded_dataset
+from action_categorizer import ActionCategorizer
+from history_digest import HistoryDigest
+from recorded_dataset import RecordedDataset
+from recorder import PngRecordingWriter
+from shard_recording import convert_png_recording
+
+
+def write_recording(recording_dir, num_frames, first_frame_index=0):
+    rng = np.random.default_rng(first_frame_index)
+    writer = PngRecordingWriter(recording_dir)
+    for frame_index in range(first_frame_index, first_frame_index + num_frames):
+        writer.write(frame_index, rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8), rng.integers(0, 2, size=4).astype(bool))
+    writer.close()
+
+
+def make_dataset(data_dir, num_preprocess_workers=1):
+    return RecordedDataset(
+        data_dir=data_dir,
+        history_digest=HistoryDigest.from_window_growth_rate(num_windows=4, growth_rate=2.0),
+        action_categorizer=ActionCategorizer(4),
+        num_preprocess_workers=num_preprocess_workers,
+    )
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for recording_index, num_frames in enumerate([5, 12, 0, 7]):
+        write_recording(tmp_path / f"recording_{recording_index}", num_frames)
+    return tmp_path
+
+
+@pytest.fixture
+def preprocessed_dirs(monkeypatch):
+    """The recordings preprocessed while the fixture is active"""
+    preprocessed_dirs = []
+    preprocess_recording = recorded_dataset.preprocess_recording
+    def record_preprocessing(recording_dir, *args):
+        preprocessed_dirs.append(recording_dir.name)
+        preprocess_recording(recording_dir, *args)
+    monkeypatch.setattr(recorded_dataset, "preprocess_recording", record_preprocessing)
+    return preprocessed_dirs
+
+
+def test_only_new_and_changed_recordings_are_preprocessed(data_dir, preprocessed_dirs):
+    dataset = make_dataset(data_dir)
+    # The empty recording is skipped
+    assert preprocessed_dirs == ["recording_0", "recording_1", "recording_3"]
+    assert len(dataset) == 24
+
+    preprocessed_dirs.clear()
+    unchanged_dataset = make_dataset(data_dir)
+    assert preprocessed_dirs == []
+    for recording, unchanged_recording in zip(dataset.recordings, unchanged_dataset.recordings):
+        assert np.array_equal(recording.actions, unchanged_recording.actions)
+        assert np.array_equal(recording.action_histories, unchanged_recording.action_histories)
+
+    # Appending frames to a recording, or adding one, only preprocesses those
+    write_recording(data_dir / "recording_1", 3, first_frame_index=12)
+    write_recording(data_dir / "recording_4", 2)
+    appended_dataset = make_dataset(data_dir)
+    assert preprocessed_dirs == ["recording_1", "recording_4"]
+    assert len(appended_dataset) == 29
+    assert len(appended_dataset.recordings[1].action_histories) == 15
+
+
+def test_missing_cache_is_preprocessed_again(data_dir, preprocessed_dirs):
+    dataset = make_dataset(data_dir)
+    dataset.get_cache_paths(data_dir / "recording_3")[1].unlink()
+
+    preprocessed_dirs.clear()
+    make_dataset(data_dir)
+    assert preprocessed_dirs == ["recording_3"]
+
+
+def test_process_pool_matches_serial_preprocessing(data_dir):
+    serial_dataset = make_dataset(data_dir)
+    serial_recordings = serial_dataset.recordings
+    serial_dataset.get_manifest_path().unlink()
+
+    pool_dataset = make_dataset(data_dir, num_preprocess_workers=2)
+    assert len(pool_dataset) == len(serial_dataset)
+    for serial_recording, pool_recording in zip(serial_recordings, pool_dataset.recordings):
+        assert np.array_equal(serial_recording.actions, pool_recording.actions)
+        assert np.array_equal(serial_recording.action_histories, pool_recording.action_histories)
+
+
+@pytest.mark.parametrize("recording_format", ["png", "shards"])
+def test_action_history_starts_over_after_dropped_frames(tmp_path, recording_format):
+    # Frames 3 and 4 were dropped
+    png_dir = tmp_path / "png" / "recording_0"
+    write_recording(png_dir, 3)
+    write_recording(png_dir, 4, first_frame_index=5)
+    data_dir = tmp_path / "png"
+    if recording_format == "shards":
+        data_dir = tmp_path / "shards"
+        convert_png_recording(png_dir, data_dir / "recording_0", frames_per_shard=2)
+
+    dataset = make_dataset(data_dir)
+    recording = dataset.recordings[0]
+    assert np.array_equal(dataset.get_frames(data_dir / "recording_0").load_frame_indices(), [0, 1, 2, 5, 6, 7, 8])
+
+    history_digest = dataset.history_digest
+    expected_histories = np.concatenate([
+        history_digest.get_window_averages_for_sequence(recording.actions[:3]),
+        history_digest.get_window_averages_for_sequence(recording.actions[3:]),
+    ])
+    assert np.allclose(recording.action_histories, expected_histories)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -1,29 +1,112 @@
 from environment import Observation, Action
 from pathlib import Path
 from datetime import datetime
+import queue
+import threading
 import cv2
 import numpy as np
+import config
+from shard_recording import ShardRecordingWriter
+
+class PngRecordingWriter:
+    """Writes each frame as NNNNNN_frame.png and its action as NNNNNN_action.npy"""
+    def __init__(self, recording_dir:Path):
+        self.recording_dir = recording_dir
+        self.recording_dir.mkdir(parents=True, exist_ok=True)
+
+    def write(self, frame_index:int, view:np.ndarray, action:Action, state:np.ndarray | None = None):
+        image_path = self.recording_dir / f"{frame_index:06d}_frame.png"
+        action_path = self.recording_dir / f"{frame_index:06d}_action.npy"
+
+        view = cv2.cvtColor(view, cv2.COLOR_RGB2BGR)
+        cv2.imwrite(str(image_path), view)
+
+        np.save(action_path, action)
+
+        if state is not None:
+            np.save(self.recording_dir / f"{frame_index:06d}_state.npy", state)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
 
 class Recorder:
+    """
+    Records observations and actions to disk.
+    Frames are handed to background writer threads through a bounded queue, so PNG encoding
+    and disk writes never stall the game loop. When the queue is full the back-pressure policy
+    either blocks until there is room ("block") or drops the frame and counts it ("drop").
+    A dropped frame leaves a gap in the frame indices of the recording, where the dataset starts the action history over.
+    Recordings are written as PNG files ("png") or as memory-mappable shards ("shards").
+    By default one car is recorded with record. Given car_indices, record_fleet records the
+    listed cars of the fleet, each car into its own recording_<time>_car_<index> directory.
+    """
     recording:bool = False
     frame_count:int = 0
+    dropped_frame_count:int = 0
     data_dir:Path = Path("")
     recording_dir:Path = Path("")
+    recording_dirs:list[Path] = []
+
+    def __init__(self,
+        output_dir:Path,
+        queue_size:int = config.recorder_queue_size,
+        num_writers:int = config.recorder_num_writers,
+        backpressure:str = config.recorder_backpressure,
+        recording_format:str = config.recording_format,
+        car_indices:list[int] | None = None,
+        record_states:bool = config.record_car_states,
+    ):
+        if backpressure not in ("block", "drop"):
+            raise ValueError(f"Unknown back-pressure policy {backpressure}, expected 'block' or 'drop'")
+        if recording_format not in ("png", "shards"):
+            raise ValueError(f"Unknown recording format {recording_format}, expected 'png' or 'shards'")
 
-    def __init__(self, output_dir:Path):
         self.data_dir = output_dir
+        self.backpressure = backpressure
+        self.recording_format = recording_format
+        self.car_indices = car_indices
+        self.record_states = record_states
+
+        if recording_format == "shards":
+            # Shards are appended to in order, so only one thread may write them
+            num_writers = min(num_writers, 1)
+
+        self.queue:queue.Queue = queue.Queue(maxsize=queue_size)
+        self.writer_threads = [threading.Thread(target=self.write_loop, daemon=True) for _ in range(num_writers)]
+        for writer_thread in self.writer_threads:
+            writer_thread.start()
 
     def start_recording(self):
         datetime_str = datetime.now().strftime("%Y%m%d_%H%M%S")
         self.recording_dir = self.data_dir / f"recording_{datetime_str}"
-        self.recording_dir.mkdir(parents=True, exist_ok=True)
+        if self.car_indices is None:
+            self.recording_dirs = [self.recording_dir]
+        else:
+            # One stream per car, each is a recording of its own for the dataset
+            self.recording_dirs = [self.data_dir / f"recording_{datetime_str}_car_{car_index:03d}" for car_index in self.car_indices]
+        self.writers = [self.create_writer(recording_dir) for recording_dir in self.recording_dirs]
         self.frame_count = 0
+        self.dropped_frame_count = 0
         self.recording = True
-        print(f"Recording started to {self.recording_dir}")
+        if self.car_indices is None:
+            print(f"Recording started to {self.recording_dir}")
+        else:
+            print(f"Recording {len(self.car_indices)} cars started to {self.recording_dir}_car_*")
 
     def stop_recording(self):
         self.recording = False
-        print(f"Recording stopped")
+        self.flush()
+        for writer in self.writers:
+            writer.close()
+        print(f"Recording stopped, {self.frame_count} frames, {self.dropped_frame_count} dropped")
+
+    def create_writer(self, recording_dir:Path) -> "PngRecordingWriter | ShardRecordingWriter":
+        if self.recording_format == "shards":
+            return ShardRecordingWriter(recording_dir)
+        return PngRecordingWriter(recording_dir)
 
     def toggle_recording(self):
         if self.recording:
@@ -35,15 +118,62 @@ class Recorder:
         if not self.recording:
             return
 
-        image_path = self.recording_dir / f"{self.frame_count:06d}_frame.png"
-        action_path = self.recording_dir / f"{self.frame_count:06d}_action.npy"
- 
-        view = cv2.cvtColor(observation.view, cv2.COLOR_RGB2BGR)
-        cv2.imwrite(str(image_path), view)
+        # Copy the data, the caller is free to reuse its buffers once this returns
+        self.enqueue((self.writers[0], self.frame_count, observation.view.copy(), np.array(action, copy=True), None))
 
-        np.save(action_path, action)
+        # Dropped frames still take their frame number, so gaps show where they were
+        self.frame_count += 1
+
+    def record_fleet(self, observations:list[Observation], actions:np.ndarray, states:np.ndarray | None = None):
+        """
+        Record the observation and action of every car in car_indices, and its state when
+        record_states is set. The observations, (N,4) actions and (N,state_length) states are of the whole fleet.
+        """
+        if not self.recording:
+            return
+
+        for writer, car_index in zip(self.writers, self.car_indices):
+            state = states[car_index].copy() if self.record_states and states is not None else None
+            self.enqueue((writer, self.frame_count, observations[car_index].view.copy(), actions[car_index].copy(), state))
 
         self.frame_count += 1
 
+    def enqueue(self, frame:tuple):
+        if self.backpressure == "block":
+            self.queue.put(frame)
+        else:
+            try:
+                self.queue.put_nowait(frame)
+            except queue.Full:
+                self.dropped_frame_count += 1
+
+    def flush(self):
+        """Wait until every queued frame is written, and make the recordings readable up to them"""
+        self.queue.join()
+        if self.recording:
+            for writer in self.writers:
+                writer.flush()
+
+    def close(self):
+        """Stop recording, write the queued frames and stop the writer threads"""
+        if self.recording:
+            self.stop_recording()
+        self.flush()
+        for _ in self.writer_threads:
+            self.queue.put(None)
+        for writer_thread in self.writer_threads:
+            writer_thread.join()
+        self.writer_threads = []
 
-  
\ No newline at end of file
+    def write_loop(self):
+        while True:
+            frame = self.queue.get()
+            try:
+                if frame is None:
+                    return
+                writer, frame_index, view, action, state = frame
+                writer.write(frame_index, view, action, state)
+            except Exception as e:
+                print(f"Failed to write frame: {e}")
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+import pytest
+from action_categorizer import ActionCategorizer
+from environment import Observation
+from history_digest import HistoryDigest
+from recorded_dataset import RecordedDataset
+from recorder import Recorder
+
+
+def make_frames(num_frames):
+    rng = np.random.default_rng(0)
+    views = rng.integers(0, 256, size=(num_frames, 96, 96, 3), dtype=np.uint8)
+    actions = rng.integers(0, 2, size=(num_frames, 4)).astype(bool)
+    return views, actions
+
+
+def test_recording_matches_synchronous_write(tmp_path):
+    views, actions = make_frames(20)
+    recorder = Recorder(tmp_path, queue_size=4, num_writers=3)
+    recorder.start_recording()
+
+    # Reuse one buffer for every frame, like the game loop does
+    view_buffer = np.zeros_like(views[0])
+    for view, action in zip(views, actions):
+        view_buffer[:] = view
+        recorder.record(Observation(view=view_buffer), action)
+    recorder.stop_recording()
+
+    frame_paths = sorted(recorder.recording_dir.glob("*_frame.png"))
+    assert len(frame_paths) == len(views)
+    for i, (view, action) in enumerate(zip(views, actions)):
+        frame = cv2.imread(str(recorder.recording_dir / f"{i:06d}_frame.png"))
+        assert np.array_equal(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), view)
+        assert np.array_equal(np.load(recorder.recording_dir / f"{i:06d}_action.npy"), action)
+
+    recorder.close()
+
+
+def test_drop_policy_counts_dropped_frames(tmp_path):
+    views, actions = make_frames(10)
+    # Without writer threads nothing leaves the queue, so every frame after the first two is dropped
+    recorder = Recorder(tmp_path, queue_size=2, num_writers=0, backpressure="drop")
+    recorder.start_recording()
+    for view, action in zip(views, actions):
+        recorder.record(Observation(view=view), action)
+
+    assert recorder.dropped_frame_count == 8
+    assert recorder.frame_count == 10
+
+
+def test_unknown_backpressure_policy(tmp_path):
+    with pytest.raises(ValueError):
+        Recorder(tmp_path, backpressure="wait")
+
+
+@pytest.mark.parametrize("recording_format", ["png", "shards"])
+def test_fleet_recording_writes_one_stream_per_car(tmp_path, recording_format):
+    num_cars, num_steps, car_indices = 4, 6, [0, 2, 3]
+    views, actions = make_frames(num_steps * num_cars)
+    views = views.reshape(num_steps, num_cars, *views.shape[1:])
+    actions = actions.reshape(num_steps, num_cars, 4)
+    states = np.random.default_rng(1).random((num_steps, num_cars, 5))
+
+    recorder = Recorder(tmp_path, recording_format=recording_format, car_indices=car_indices, record_states=True)
+    recorder.start_recording()
+    for step_views, step_actions, step_states in zip(views, actions, states):
+        recorder.record_fleet([Observation(view=view) for view in step_views], step_actions, step_states)
+    recorder.close()
+
+    assert [recording_dir.name[-7:] for recording_dir in recorder.recording_dirs] == ["car_000", "car_002", "car_003"]
+
+    dataset = RecordedDataset(
+        data_dir=tmp_path,
+        history_digest=HistoryDigest.from_window_growth_rate(num_windows=4, growth_rate=2.0),
+        action_categorizer=ActionCategorizer(4),
+    )
+    assert len(dataset) == num_steps * len(car_indices)
+
+    # Recordings are found in name order, which is car order
+    for car_index, recording in zip(car_indices, dataset.recordings):
+        assert np.array_equal(np.stack([recording.frames[i] for i in range(num_steps)]), views[:, car_index])
+        assert np.array_equal(recording.actions, actions[:, car_index])
+        assert np.allclose(recording.frames.load_states(), states[:, car_index])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
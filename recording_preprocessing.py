@@ -0,0 +1,77 @@
+"""
+Reading recordings and preprocessing their actions, without torch.
+The preprocessing worker processes import this module, so it must not import torch or the dataset.
+"""
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from history_digest import HistoryDigest
+from shard_recording import INDEX_FILE_NAME, ShardRecordingReader, is_shard_recording
+
+class PngFrames:
+    """The frames of a recording stored as NNNNNN_frame.png files, decoded on access"""
+    def __init__(self, recording_dir:Path):
+        self.frame_paths = sorted(list(recording_dir.glob("*_frame.png")))
+
+    def __len__(self):
+        return len(self.frame_paths)
+
+    def __getitem__(self, index:int) -> np.ndarray:
+        return np.array(Image.open(self.frame_paths[index]).convert("RGB"))
+
+    def load_actions(self) -> np.ndarray:
+        action_paths = [p.with_name(p.name.replace("_frame.png", "_action.npy")) for p in self.frame_paths]
+        return np.stack([np.load(action_path) for action_path in action_paths])
+
+    def load_frame_indices(self) -> np.ndarray:
+        """The frame index of every frame, from its file name"""
+        return np.array([int(p.name.removesuffix("_frame.png")) for p in self.frame_paths], dtype=np.int64)
+
+    def load_states(self) -> np.ndarray | None:
+        """The car state of every frame, None if the recording has no states"""
+        state_paths = [p.with_name(p.name.replace("_frame.png", "_state.npy")) for p in self.frame_paths]
+        if len(state_paths) == 0 or not state_paths[0].exists():
+            return None
+        return np.stack([np.load(state_path) for state_path in state_paths])
+
+def open_recording_frames(recording_dir:Path) -> "PngFrames | ShardRecordingReader":
+    """Shard recordings are memory mapped, older recordings are read as PNG files"""
+    if is_shard_recording(recording_dir):
+        return ShardRecordingReader(recording_dir)
+    return PngFrames(recording_dir)
+
+def get_recording_signature(recording_dir:Path, num_frames:int) -> dict:
+    """
+    What the cached arrays of a recording are computed from. Adding or removing frames changes the
+    modification time of the recording directory, appending to a shard recording rewrites its index.
+    """
+    paths = [recording_dir]
+    if is_shard_recording(recording_dir):
+        paths.append(recording_dir / INDEX_FILE_NAME)
+    return {
+        "num_frames": num_frames,
+        "mtimes": {path.relative_to(recording_dir).as_posix(): path.stat().st_mtime_ns for path in paths},
+    }
+
+def preprocess_recording(recording_dir:Path, num_frames:int, window_sizes:list[int], actions_cache_path:Path, history_cache_path:Path):
+    """
+    Compute and save the actions and action histories of the first num_frames frames of a recording.
+    Runs in the preprocessing worker processes, so it only takes and returns small picklable values.
+    """
+    print(f"Preprocessing {recording_dir}")
+    frames = open_recording_frames(recording_dir)
+    actions = frames.load_actions()[:num_frames]
+    frame_indices = frames.load_frame_indices()[:num_frames]
+
+    # The history before every frame, as if the digest was filled with the first action
+    # and each action was pushed after its frame, computed in one pass over the recording.
+    # Frames the recorder dropped leave gaps in the frame indices, the history starts over after each gap
+    history_digest = HistoryDigest(window_sizes)
+    segment_starts = np.flatnonzero(np.diff(frame_indices) != 1) + 1
+    action_histories = np.concatenate([
+        history_digest.get_window_averages_for_sequence(segment_actions)
+        for segment_actions in np.split(actions, segment_starts)
+    ]).astype(np.float32)
+
+    np.save(actions_cache_path, actions)
+    np.save(history_cache_path, action_histories)
@@ -0,0 +1,14 @@
+import subprocess
+import sys
+import pytest
+import config
+
+
+def test_preprocessing_does_not_import_torch():
+    # The preprocessing worker processes only import this module
+    code = "import sys, recording_preprocessing; assert 'torch' not in sys.modules, 'torch was imported'"
+    subprocess.run([sys.executable, "-c", code], cwd=config.project_root, check=True)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,123 @@
+import hashlib
+import json
+from pathlib import Path
+import cv2
+import numpy as np
+import config
+
+# Road pixels are a neutral grey, the lane markings painted on them are closed over afterwards
+ROAD_CLASSIFICATION = {
+    "min_brightness": 90,
+    "max_brightness": 140,
+    "max_chroma": 20, # largest difference between the colour channels
+    "closing_size": 7, # pixels, wider than a lane marking
+    "min_area": 2000, # pixels, smaller grey patches are not roads
+}
+
+def classify_road_pixels(map_array:np.ndarray, classification:dict = ROAD_CLASSIFICATION) -> np.ndarray:
+    """Classify the pixels of an (h,w,3) uint8 RGB map as road, returned as an (h,w) bool mask"""
+    brightness = map_array.mean(axis=2)
+    chroma = map_array.max(axis=2).astype(np.int16) - map_array.min(axis=2)
+    grey = (brightness >= classification["min_brightness"]) & (brightness <= classification["max_brightness"]) & (chroma <= classification["max_chroma"])
+
+    # Close the gaps left by lane markings, then drop isolated patches like grey buildings
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (classification["closing_size"], classification["closing_size"]))
+    road = cv2.morphologyEx(grey.astype(np.uint8), cv2.MORPH_CLOSE, kernel)
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(road, connectivity=4)
+    large = stats[:, cv2.CC_STAT_AREA] >= classification["min_area"]
+    large[0] = False # the background label
+    return large[labels]
+
+def compute_signed_distance(drivable:np.ndarray) -> np.ndarray:
+    """
+    The (h,w) float32 distance of each pixel to the road edge.
+    Positive on the road, the distance to the nearest off-road pixel, and negative off the road,
+    minus the distance to the nearest road pixel.
+    """
+    drivable = drivable.astype(np.uint8)
+    inside = cv2.distanceTransform(drivable, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    outside = cv2.distanceTransform(1 - drivable, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    return (inside - outside).astype(np.float32)
+
+def get_map_hash(map_path:Path, classification:dict = ROAD_CLASSIFICATION) -> str:
+    """
+    Hash of the content of the map image and the classification settings, a change to either needs a new road map.
+    A copy of the image at another path finds the same road map, an image replaced in place never finds a stale one.
+    """
+    digest = hashlib.sha256(Path(map_path).read_bytes())
+    digest.update(json.dumps(classification, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+class RoadMap:
+    """
+    The drivable area of a map with the signed distance of every pixel to the road edge.
+    Lookups index the precomputed arrays at the cars' pixels, so checking every car is one
+    gather per array, whatever the size of the map.
+    """
+    def __init__(self, drivable:np.ndarray, distance:np.ndarray):
+        self.drivable = drivable
+        self.distance = distance
+        self.height, self.width = drivable.shape
+
+    @classmethod
+    def from_image(cls, map_path:Path, classification:dict = ROAD_CLASSIFICATION) -> "RoadMap":
+        map_array = cv2.cvtColor(cv2.imread(str(map_path)), cv2.COLOR_BGR2RGB)
+        return cls.from_array(map_array, classification)
+
+    @classmethod
+    def from_array(cls, map_array:np.ndarray, classification:dict = ROAD_CLASSIFICATION) -> "RoadMap":
+        """Build the road map of an (h,w,3) uint8 RGB map"""
+        drivable = classify_road_pixels(map_array, classification)
+        return cls(drivable, compute_signed_distance(drivable))
+
+    @classmethod
+    def load(cls, drivable_path:Path, distance_path:Path) -> "RoadMap":
+        """Memory map a saved road map, lookups only page in the parts of the map the cars are on"""
+        return cls(np.load(drivable_path, mmap_mode="r"), np.load(distance_path, mmap_mode="r"))
+
+    def save(self, drivable_path:Path, distance_path:Path):
+        np.save(drivable_path, self.drivable)
+        np.save(distance_path, self.distance)
+
+    @classmethod
+    def load_or_build(cls, map_path:Path, cache_dir:Path = config.road_map_cache_dir, classification:dict = ROAD_CLASSIFICATION) -> "RoadMap":
+        """Load the road map of the image from the cache, building and caching it if it is not there"""
+        map_hash = get_map_hash(map_path, classification)
+        drivable_path, distance_path = cls.get_cache_paths(map_hash, cache_dir)
+        if not drivable_path.exists() or not distance_path.exists():
+            print(f"Building the road map of {map_path}")
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            cls.from_image(map_path, classification).save(drivable_path, distance_path)
+        return cls.load(drivable_path, distance_path)
+
+    @staticmethod
+    def get_cache_paths(map_hash:str, cache_dir:Path) -> tuple[Path, Path]:
+        return cache_dir / f"{map_hash}_drivable.npy", cache_dir / f"{map_hash}_distance.npy"
+
+    def get_pixels(self, x:np.ndarray, y:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """The row and column of the pixel under each position, positions on the far map edge use the last pixel"""
+        rows = np.clip(np.asarray(y, dtype=np.int64), 0, self.height - 1)
+        cols = np.clip(np.asarray(x, dtype=np.int64), 0, self.width - 1)
+        return rows, cols
+
+    def is_on_road(self, x:np.ndarray, y:np.ndarray) -> np.ndarray:
+        return self.drivable[self.get_pixels(x, y)]
+
+    def get_distance(self, x:np.ndarray, y:np.ndarray) -> np.ndarray:
+        """Signed distance to the road edge, positive on the road"""
+        return self.distance[self.get_pixels(x, y)]
+
+    def sample_road_positions(self, num_positions:int, rng:np.random.Generator, min_distance:float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+        """Random x, y pixel centres on the road, at least min_distance from its edge"""
+        # Try random pixels first, which only reads the pages of the pixels tried
+        cols = rng.integers(0, self.width, size=16 * num_positions + 64)
+        rows = rng.integers(0, self.height, size=len(cols))
+        accepted = np.flatnonzero(self.distance[rows, cols] > min_distance)
+        if len(accepted) < num_positions:
+            # Little of the map is road, pick from all the road pixels
+            rows, cols = np.nonzero(self.distance > min_distance)
+            if len(rows) == 0:
+                raise ValueError(f"No road pixel is more than {min_distance} from the road edge")
+            accepted = rng.integers(0, len(rows), size=num_positions)
+        chosen = accepted[:num_positions]
+        return cols[chosen] + 0.5, rows[chosen] + 0.5
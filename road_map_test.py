@@ -0,0 +1,87 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import cv2
+import numpy as np
+import pytest
+import config
+from environment import Environment
+from road_map import RoadMap
+
+
+@pytest.fixture
+def map_path(tmp_path):
+    """A white map with a grey horizontal road, rows 100 to 139, with white lane markings on it"""
+    map_image = np.full((300, 400, 3), 255, dtype=np.uint8)
+    map_image[100:140] = 110
+    map_image[119:121, ::20] = 255
+    map_path = tmp_path / "map.png"
+    cv2.imwrite(str(map_path), map_image)
+    return map_path
+
+
+def test_road_mask_and_distance(map_path, tmp_path):
+    road_map = RoadMap.load_or_build(map_path, cache_dir=tmp_path / "cache")
+
+    expected = np.zeros((300, 400), dtype=bool)
+    expected[100:140] = True
+    # The lane markings are part of the road
+    assert np.array_equal(road_map.drivable, expected)
+
+    x = np.array([200.0, 200.0, 200.0, 399.9])
+    y = np.array([120.0, 100.5, 60.0, 300.0])
+    assert np.array_equal(road_map.is_on_road(x, y), [True, True, False, False])
+    assert np.allclose(road_map.get_distance(x, y), [20, 1, -40, -160], atol=0.5)
+
+
+def test_road_map_is_cached_by_image(map_path, tmp_path):
+    cache_dir = tmp_path / "cache"
+    road_map = RoadMap.load_or_build(map_path, cache_dir=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 2
+
+    # Loading again reads the cache
+    assert np.array_equal(RoadMap.load_or_build(map_path, cache_dir=cache_dir).distance, road_map.distance)
+    assert len(list(cache_dir.iterdir())) == 2
+
+    # A different image gets its own road map
+    map_image = cv2.imread(str(map_path))
+    map_image[:, 200:240] = 110
+    cv2.imwrite(str(map_path), map_image)
+    assert RoadMap.load_or_build(map_path, cache_dir=cache_dir).drivable[:, 220].all()
+    assert len(list(cache_dir.iterdir())) == 4
+
+    # A copy of the image keeps its road map, even with another path and modification time
+    copy_path = map_path.with_name("copy.png")
+    copy_path.write_bytes(map_path.read_bytes())
+    RoadMap.load_or_build(copy_path, cache_dir=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 4
+
+    # An image replaced in place that keeps its modification time gets its own road map
+    stat = map_path.stat()
+    map_image[:, 200:240] = 255
+    map_image[:, 300:340] = 110
+    cv2.imwrite(str(map_path), map_image)
+    os.utime(map_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    RoadMap.load_or_build(map_path, cache_dir=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 6
+
+
+def test_environment_reports_off_road_cars(tmp_path):
+    env = Environment(config.map_path, headless=True, road_map_cache_dir=tmp_path / "cache")
+    rng = np.random.default_rng(0)
+    env.add_random_cars(50, rng)
+    env.reset_cars(np.arange(50), rng)
+    assert env.road_map.is_on_road(env.fleet.x, env.fleet.y).all()
+    assert (env.get_road_distances() > 0).all()
+
+    # Move two cars off the road
+    off_road_x, off_road_y = np.nonzero(~env.road_map.drivable.T)
+    env.fleet.x[[3, 7]] = off_road_x[:2] + 0.5
+    env.fleet.y[[3, 7]] = off_road_y[:2] + 0.5
+    events = env.update(np.zeros((50, 4), dtype=bool), 1 / config.fps)
+    assert np.array_equal(events.off_road, [3, 7])
+    assert np.array_equal(events.left_road, [])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
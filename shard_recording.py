@@ -0,0 +1,218 @@
+import json
+import shutil
+from pathlib import Path
+import cv2
+import numpy as np
+import config
+
+INDEX_FILE_NAME = "index.json"
+
+def is_shard_recording(recording_dir:Path) -> bool:
+    return (recording_dir / INDEX_FILE_NAME).exists()
+
+class ShardRecordingWriter:
+    """
+    Writes a recording as shards of fixed-shape frames and actions, and optionally car states.
+    Each shard is a set of raw files that frames and actions are appended to, and a small JSON
+    index lists the shards with their frame counts. Frames beyond the counts in the index are
+    ignored by readers, so an interrupted recording stays readable. The index is rewritten when a
+    shard starts, every index_interval frames and on flush, so a crash loses at most the frames since.
+    The index also keeps the frame indices of the frames as runs of consecutive indices, so frames
+    the recorder dropped show up as gaps between the runs.
+    """
+    def __init__(self,
+        recording_dir:Path,
+        frames_per_shard:int = config.recording_frames_per_shard,
+        index_interval:int = config.recording_index_interval,
+    ):
+        self.recording_dir = recording_dir
+        self.frames_per_shard = frames_per_shard
+        self.index_interval = index_interval
+        self.num_frames = 0
+        self.recording_dir.mkdir(parents=True, exist_ok=True)
+
+        self.index:dict = {"shards": [], "frame_runs": []}
+        self.frames_file = None
+        self.actions_file = None
+        self.states_file = None
+
+    def write(self, frame_index:int, view:np.ndarray, action:np.ndarray, state:np.ndarray | None = None):
+        """
+        Append a frame and its action, frames are stored in the order they are written.
+        Either every frame of a recording has a state or none has.
+        """
+        action = np.asarray(action)
+        frame_runs = self.index["frame_runs"]
+
+        if len(self.index["shards"]) == 0:
+            # The first frame fixes the shapes of the whole recording
+            self.index["frame_shape"] = list(view.shape)
+            self.index["frame_dtype"] = str(view.dtype)
+            self.index["action_shape"] = list(action.shape)
+            self.index["action_dtype"] = str(action.dtype)
+            if state is not None:
+                self.index["state_shape"] = list(np.shape(state))
+                self.index["state_dtype"] = str(np.asarray(state).dtype)
+
+        if self.frames_file is None or self.index["shards"][-1]["num_frames"] == self.frames_per_shard:
+            self.start_shard()
+
+        self.frames_file.write(np.ascontiguousarray(view, dtype=self.index["frame_dtype"]).tobytes())
+        self.actions_file.write(np.ascontiguousarray(action, dtype=self.index["action_dtype"]).tobytes())
+        if self.states_file is not None:
+            self.states_file.write(np.ascontiguousarray(state, dtype=self.index["state_dtype"]).tobytes())
+        self.index["shards"][-1]["num_frames"] += 1
+        # Each run is a [first, stop) range of frame indices
+        if len(frame_runs) > 0 and frame_runs[-1][1] == frame_index:
+            frame_runs[-1][1] += 1
+        else:
+            frame_runs.append([frame_index, frame_index + 1])
+        self.num_frames += 1
+        if self.num_frames % self.index_interval == 0:
+            self.flush()
+
+    def start_shard(self):
+        if self.frames_file is not None:
+            self.close_shard()
+
+        shard_number = len(self.index["shards"])
+        shard = {
+            "frames": f"shard_{shard_number:05d}_frames.bin",
+            "actions": f"shard_{shard_number:05d}_actions.bin",
+            "num_frames": 0,
+        }
+        if "state_shape" in self.index:
+            shard["states"] = f"shard_{shard_number:05d}_states.bin"
+        self.index["shards"].append(shard)
+        self.frames_file = open(self.recording_dir / shard["frames"], "wb")
+        self.actions_file = open(self.recording_dir / shard["actions"], "wb")
+        if "states" in shard:
+            self.states_file = open(self.recording_dir / shard["states"], "wb")
+        self.write_index()
+
+    def close_shard(self):
+        self.frames_file.close()
+        self.actions_file.close()
+        if self.states_file is not None:
+            self.states_file.close()
+        self.frames_file = None
+        self.actions_file = None
+        self.states_file = None
+        self.write_index()
+
+    def flush(self):
+        """Write the buffered frames to the shard files, then the index that counts them"""
+        if self.frames_file is None:
+            return
+        self.frames_file.flush()
+        self.actions_file.flush()
+        if self.states_file is not None:
+            self.states_file.flush()
+        self.write_index()
+
+    def write_index(self):
+        # Write to a temporary file first so readers never see a half written index
+        index_path = self.recording_dir / INDEX_FILE_NAME
+        temporary_path = index_path.with_suffix(".tmp")
+        with open(temporary_path, "w") as f:
+            json.dump(self.index, f, indent=2)
+        temporary_path.replace(index_path)
+
+    def close(self):
+        if self.frames_file is not None:
+            self.close_shard()
+
+class ShardRecordingReader:
+    """
+    Reads a shard recording zero-copy through np.memmap.
+    Indexing returns a frame as a view of the mapped shard, so reading a sample is a page access
+    instead of a file open and a PNG decode.
+    """
+    def __init__(self, recording_dir:Path):
+        self.recording_dir = recording_dir
+        with open(recording_dir / INDEX_FILE_NAME, "r") as f:
+            self.index = json.load(f)
+
+        self.shards = [shard for shard in self.index["shards"] if shard["num_frames"] > 0]
+        self.shard_starts = np.cumsum([0] + [shard["num_frames"] for shard in self.shards])
+        self.open_shards()
+
+    def open_shards(self):
+        frame_shape = tuple(self.index.get("frame_shape", ()))
+        action_shape = tuple(self.index.get("action_shape", ()))
+        self.frames = [
+            np.memmap(self.recording_dir / shard["frames"], dtype=self.index["frame_dtype"], mode="r", shape=(shard["num_frames"], *frame_shape))
+            for shard in self.shards
+        ]
+        self.actions = [
+            np.memmap(self.recording_dir / shard["actions"], dtype=self.index["action_dtype"], mode="r", shape=(shard["num_frames"], *action_shape))
+            for shard in self.shards
+        ]
+
+    def __getstate__(self):
+        # Memory maps would be pickled as full copies, DataLoader workers reopen them instead
+        state = self.__dict__.copy()
+        del state["frames"]
+        del state["actions"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open_shards()
+
+    def __len__(self):
+        return int(self.shard_starts[-1])
+
+    def __getitem__(self, index:int) -> np.ndarray:
+        shard_number = np.searchsorted(self.shard_starts, index, side="right") - 1
+        return self.frames[shard_number][index - self.shard_starts[shard_number]]
+
+    def load_actions(self) -> np.ndarray:
+        """Load the actions of all frames as one array"""
+        if len(self.actions) == 0:
+            return np.zeros((0, *self.index.get("action_shape", ())), dtype=bool)
+        return np.concatenate(self.actions)
+
+    def load_frame_indices(self) -> np.ndarray:
+        """The frame index of every frame, recordings written before frame runs were kept have no gaps"""
+        if "frame_runs" not in self.index:
+            return np.arange(len(self))
+        frame_indices = [np.arange(first, stop) for first, stop in self.index["frame_runs"]]
+        return np.concatenate([np.zeros(0, dtype=np.int64), *frame_indices])[:len(self)]
+
+    def load_states(self) -> np.ndarray | None:
+        """Load the car states of all frames as one array, None if the recording has no states"""
+        if "state_shape" not in self.index:
+            return None
+        state_shape = tuple(self.index["state_shape"])
+        states = [
+            np.fromfile(self.recording_dir / shard["states"], dtype=self.index["state_dtype"], count=shard["num_frames"] * int(np.prod(state_shape))).reshape(-1, *state_shape)
+            for shard in self.shards
+        ]
+        if len(states) == 0:
+            return np.zeros((0, *state_shape), dtype=self.index["state_dtype"])
+        return np.concatenate(states)
+
+def convert_png_recording(png_recording_dir:Path, shard_recording_dir:Path, frames_per_shard:int = config.recording_frames_per_shard):
+    """
+    Convert a recording of NNNNNN_frame.png and NNNNNN_action.npy pairs, and NNNNNN_state.npy if it has states, to the shard format.
+    The shards are written to a hidden sibling directory that is renamed once the conversion is complete,
+    so an interrupted conversion never leaves a recording that looks converted.
+    """
+    converting_dir = shard_recording_dir.with_name(f".converting_{shard_recording_dir.name}")
+    if converting_dir.exists():
+        shutil.rmtree(converting_dir)
+
+    writer = ShardRecordingWriter(converting_dir, frames_per_shard=frames_per_shard)
+    frame_paths = sorted(png_recording_dir.glob("*_frame.png"))
+    for frame_path in frame_paths:
+        action_path = frame_path.with_name(frame_path.name.replace("_frame.png", "_action.npy"))
+        state_path = frame_path.with_name(frame_path.name.replace("_frame.png", "_state.npy"))
+        view = cv2.cvtColor(cv2.imread(str(frame_path)), cv2.COLOR_BGR2RGB)
+        state = np.load(state_path) if state_path.exists() else None
+        # Keep the frame index of the file name, so dropped frames stay gaps
+        frame_index = int(frame_path.name.removesuffix("_frame.png"))
+        writer.write(frame_index, view, np.load(action_path), state)
+    writer.close()
+    converting_dir.rename(shard_recording_dir)
+    return len(frame_paths)
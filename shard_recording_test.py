@@ -0,0 +1,168 @@
+import numpy as np
+import pytest
+from environment import Observation
+from history_digest import HistoryDigest
+from action_categorizer import ActionCategorizer
+from recorded_dataset import RecordedDataset
+from recorder import PngRecordingWriter, Recorder
+from shard_recording import ShardRecordingWriter, ShardRecordingReader, convert_png_recording, is_shard_recording
+
+
+def make_frames(num_frames):
+    rng = np.random.default_rng(0)
+    views = rng.integers(0, 256, size=(num_frames, 96, 96, 3), dtype=np.uint8)
+    actions = rng.integers(0, 2, size=(num_frames, 4)).astype(bool)
+    return views, actions
+
+
+@pytest.mark.parametrize("num_frames, frames_per_shard", [
+    (1, 4),
+    (10, 4),
+    (12, 4),
+    (10, 100),
+])
+def test_shard_roundtrip(tmp_path, num_frames, frames_per_shard):
+    views, actions = make_frames(num_frames)
+    writer = ShardRecordingWriter(tmp_path / "recording_0", frames_per_shard=frames_per_shard)
+    for i, (view, action) in enumerate(zip(views, actions)):
+        writer.write(i, view, action)
+    writer.close()
+
+    assert is_shard_recording(tmp_path / "recording_0")
+    reader = ShardRecordingReader(tmp_path / "recording_0")
+    assert len(reader) == num_frames
+    assert len(reader.shards) == -(-num_frames // frames_per_shard)
+    for i, view in enumerate(views):
+        assert np.array_equal(reader[i], view)
+    assert np.array_equal(reader.load_actions(), actions)
+
+
+def test_dataset_reads_converted_recording_like_png_recording(tmp_path):
+    views, actions = make_frames(30)
+
+    png_dir = tmp_path / "png"
+    recorder = Recorder(png_dir, recording_format="png")
+    recorder.start_recording()
+    for view, action in zip(views, actions):
+        recorder.record(Observation(view=view), action)
+    recorder.close()
+
+    shard_dir = tmp_path / "shards"
+    convert_png_recording(recorder.recording_dir, shard_dir / recorder.recording_dir.name, frames_per_shard=8)
+
+    def make_dataset(data_dir):
+        return RecordedDataset(
+            data_dir=data_dir,
+            history_digest=HistoryDigest.from_window_growth_rate(num_windows=4, growth_rate=2.0),
+            action_categorizer=ActionCategorizer(4),
+        )
+
+    png_dataset = make_dataset(png_dir)
+    shard_dataset = make_dataset(shard_dir)
+    assert len(png_dataset) == len(shard_dataset) == len(views)
+    for i in range(len(views)):
+        png_item = png_dataset[i]
+        shard_item = shard_dataset[i]
+        assert np.array_equal(png_item["frame"], views[i])
+        for key in png_item:
+            assert np.array_equal(png_item[key], shard_item[key])
+
+
+def test_converted_recording_keeps_the_states(tmp_path):
+    views, actions = make_frames(10)
+    states = np.random.default_rng(1).random((10, 5))
+    png_writer = PngRecordingWriter(tmp_path / "png")
+    for i, (view, action, state) in enumerate(zip(views, actions, states)):
+        png_writer.write(i, view, action, state)
+    png_writer.close()
+
+    convert_png_recording(tmp_path / "png", tmp_path / "shards", frames_per_shard=4)
+    reader = ShardRecordingReader(tmp_path / "shards")
+    assert reader.index["state_shape"] == [5]
+    assert np.array_equal(reader.load_states(), states)
+    assert np.array_equal(reader.load_actions(), actions)
+
+
+def test_interrupted_conversion_is_not_a_recording(tmp_path):
+    views, actions = make_frames(10)
+    png_writer = PngRecordingWriter(tmp_path / "png")
+    for i, (view, action) in enumerate(zip(views, actions)):
+        png_writer.write(i, view, action)
+    png_writer.close()
+
+    # A missing action file stops the conversion halfway
+    action_path = tmp_path / "png" / "000005_action.npy"
+    action_path.rename(tmp_path / "action.npy")
+    with pytest.raises(FileNotFoundError):
+        convert_png_recording(tmp_path / "png", tmp_path / "shards" / "recording_0", frames_per_shard=2)
+    assert not is_shard_recording(tmp_path / "shards" / "recording_0")
+
+    # Converting again starts over
+    (tmp_path / "action.npy").rename(action_path)
+    convert_png_recording(tmp_path / "png", tmp_path / "shards" / "recording_0", frames_per_shard=2)
+    reader = ShardRecordingReader(tmp_path / "shards" / "recording_0")
+    assert len(reader) == 10
+    assert [path.name for path in (tmp_path / "shards").iterdir()] == ["recording_0"]
+
+
+def test_recorder_writes_shards(tmp_path):
+    views, actions = make_frames(10)
+    recorder = Recorder(tmp_path, recording_format="shards")
+    recorder.start_recording()
+    for view, action in zip(views, actions):
+        recorder.record(Observation(view=view), action)
+    recorder.stop_recording()
+
+    reader = ShardRecordingReader(recorder.recording_dir)
+    assert np.array_equal(np.stack([reader[i] for i in range(len(reader))]), views)
+    assert np.array_equal(reader.load_actions(), actions)
+    recorder.close()
+
+
+def test_dropped_frames_are_gaps_in_the_frame_indices(tmp_path):
+    views, actions = make_frames(6)
+    frame_indices = [0, 1, 2, 5, 6, 9]
+    writer = ShardRecordingWriter(tmp_path / "recording_0", frames_per_shard=4)
+    for frame_index, view, action in zip(frame_indices, views, actions):
+        writer.write(frame_index, view, action)
+    writer.close()
+
+    reader = ShardRecordingReader(tmp_path / "recording_0")
+    assert np.array_equal(reader.load_frame_indices(), frame_indices)
+    assert reader.index["frame_runs"] == [[0, 3], [5, 7], [9, 10]]
+
+
+def test_unclosed_recording_is_readable(tmp_path):
+    views, actions = make_frames(10)
+    writer = ShardRecordingWriter(tmp_path / "recording_0", frames_per_shard=4, index_interval=3)
+    # The index exists from the first frame
+    writer.write(0, views[0], actions[0])
+    assert len(ShardRecordingReader(tmp_path / "recording_0")) == 0
+
+    for i in range(1, 8):
+        writer.write(i, views[i], actions[i])
+    # Without close, the frames up to the last index rewrite can be read
+    reader = ShardRecordingReader(tmp_path / "recording_0")
+    assert len(reader) == 6
+    assert np.array_equal(np.stack([reader[i] for i in range(len(reader))]), views[:6])
+    assert np.array_equal(reader.load_actions(), actions[:6])
+
+    writer.flush()
+    assert len(ShardRecordingReader(tmp_path / "recording_0")) == 8
+
+
+def test_recorder_flush_makes_the_recording_readable(tmp_path):
+    views, actions = make_frames(5)
+    recorder = Recorder(tmp_path, recording_format="shards")
+    recorder.start_recording()
+    for view, action in zip(views, actions):
+        recorder.record(Observation(view=view), action)
+    recorder.flush()
+
+    reader = ShardRecordingReader(recorder.recording_dir)
+    assert np.array_equal(np.stack([reader[i] for i in range(len(reader))]), views)
+    recorder.close()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,134 @@
+import math
+import numpy as np
+
+# Offsets to the cells paired with each cell, half of the 3x3 neighbourhood so each pair of cells is visited once
+HALF_NEIGHBOURHOOD = [(0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+class SpatialGrid:
+    """
+    A uniform grid over the map that buckets points by the cell they are in.
+    Only the occupied cells are indexed: the points are kept sorted by cell id, so the points of a
+    cell, and of a run of cells along a row, are one contiguous slice of the order array, found by
+    a binary search of the sorted cell ids. Memory and rebuild time grow with the number of points,
+    not with the map area. Rebuilding skips the sort when no point changed cell.
+    """
+    def __init__(self, width:float, height:float, cell_size:float):
+        self.cell_size = cell_size
+        self.num_cols = max(1, math.ceil(width / cell_size))
+        self.num_rows = max(1, math.ceil(height / cell_size))
+
+        self.cell_x = np.zeros(0, dtype=np.int64)
+        self.cell_y = np.zeros(0, dtype=np.int64)
+        self.cell_ids = np.zeros(0, dtype=np.int64)
+        self.order = np.zeros(0, dtype=np.int64) # point indices sorted by cell
+        self.sorted_cell_ids = np.zeros(0, dtype=np.int64) # cell_ids[order]
+
+    def __len__(self) -> int:
+        return len(self.cell_ids)
+
+    def get_cells(self, x:np.ndarray, y:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        cell_x = np.clip((np.asarray(x) // self.cell_size).astype(np.int64), 0, self.num_cols - 1)
+        cell_y = np.clip((np.asarray(y) // self.cell_size).astype(np.int64), 0, self.num_rows - 1)
+        return cell_x, cell_y
+
+    def rebuild(self, x:np.ndarray, y:np.ndarray):
+        """Bucket the points at x, y"""
+        cell_x, cell_y = self.get_cells(x, y)
+        cell_ids = cell_y * self.num_cols + cell_x
+        if np.array_equal(cell_ids, self.cell_ids):
+            return
+
+        self.cell_x, self.cell_y, self.cell_ids = cell_x, cell_y, cell_ids
+        self.order = np.argsort(cell_ids, kind="stable")
+        self.sorted_cell_ids = cell_ids[self.order]
+
+    def get_slices(self, first_cell_ids:np.ndarray | int, last_cell_ids:np.ndarray | int) -> tuple[np.ndarray, np.ndarray]:
+        """The start and stop in the order array of the points in the cells first_cell_ids to last_cell_ids inclusive"""
+        starts = np.searchsorted(self.sorted_cell_ids, first_cell_ids, side="left")
+        stops = np.searchsorted(self.sorted_cell_ids, last_cell_ids, side="right")
+        return starts, stops
+
+    def query_box(self, center_x:float, center_y:float, half_size:float) -> np.ndarray:
+        """The indices of the points in the cells overlapping the square around the center, a superset of the points in it"""
+        (cell_x0, cell_x1), (cell_y0, cell_y1) = self.get_cells(
+            [center_x - half_size, center_x + half_size],
+            [center_y - half_size, center_y + half_size],
+        )
+        # The cells of one row of the box are consecutive, so their points are one slice
+        rows = np.arange(cell_y0, cell_y1 + 1)
+        starts, stops = self.get_slices(rows * self.num_cols + cell_x0, rows * self.num_cols + cell_x1)
+        return np.concatenate([self.order[start:stop] for start, stop in zip(starts, stops)])
+
+    def query_radius(self, x:np.ndarray, y:np.ndarray, center_x:float, center_y:float, radius:float) -> np.ndarray:
+        """The sorted indices of the points within radius of the center, x and y are the positions the grid was built from"""
+        candidates = self.query_box(center_x, center_y, radius)
+        distances_squared = (x[candidates] - center_x) ** 2 + (y[candidates] - center_y) ** 2
+        return np.sort(candidates[distances_squared <= radius ** 2])
+
+    def find_pairs(self, x:np.ndarray, y:np.ndarray, radius:float) -> np.ndarray:
+        """
+        The (M,2) index pairs i < j of points within radius of each other, sorted.
+        Only neighbouring cells are searched, so radius may not exceed the cell size.
+        """
+        if radius > self.cell_size:
+            raise ValueError(f"The radius {radius} is larger than the cell size {self.cell_size}")
+
+        num_points = len(self.cell_ids)
+        point_indices = np.arange(num_points)
+        # Position of each point in the order array
+        ranks = np.empty(num_points, dtype=np.int64)
+        ranks[self.order] = point_indices
+
+        first, second = [], []
+        for offset_x, offset_y in HALF_NEIGHBOURHOOD:
+            neighbour_x = self.cell_x + offset_x
+            neighbour_y = self.cell_y + offset_y
+            valid = (neighbour_x >= 0) & (neighbour_x < self.num_cols) & (neighbour_y < self.num_rows)
+            neighbour_ids = neighbour_y * self.num_cols + neighbour_x
+
+            starts, stops = self.get_slices(neighbour_ids, neighbour_ids)
+            if (offset_x, offset_y) == (0, 0):
+                # Within a cell pair each point only with the points after it
+                starts = ranks + 1
+            counts = np.where(valid, np.maximum(stops - starts, 0), 0)
+
+            # Expand every point into one row per candidate in the neighbouring cell
+            total = counts.sum()
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            first.append(np.repeat(point_indices, counts))
+            second.append(self.order[np.repeat(starts, counts) + offsets])
+
+        first = np.concatenate(first)
+        second = np.concatenate(second)
+        close = (x[first] - x[second]) ** 2 + (y[first] - y[second]) ** 2 <= radius ** 2
+        pairs = np.sort(np.stack([first[close], second[close]], axis=1), axis=1)
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+def oriented_boxes_overlap(
+    x_a:np.ndarray, y_a:np.ndarray, angle_deg_a:np.ndarray,
+    x_b:np.ndarray, y_b:np.ndarray, angle_deg_b:np.ndarray,
+    length:float, width:float,
+) -> np.ndarray:
+    """
+    Whether each pair of length by width boxes, centred at x, y with their length along angle_deg, overlaps.
+    Uses the separating axis test on the two axes of each box. For boxes of equal size the projected
+    radius of one box on the axes of the other only depends on the angle between them.
+    """
+    half_length, half_width = length / 2, width / 2
+    angle_a = np.radians(angle_deg_a)
+    angle_b = np.radians(angle_deg_b)
+    cos_between = np.abs(np.cos(angle_b - angle_a))
+    sin_between = np.abs(np.sin(angle_b - angle_a))
+
+    # Reach of a box along an axis of the other box, across its length axis and across its width axis
+    reach_along_length = half_length + half_length * cos_between + half_width * sin_between
+    reach_along_width = half_width + half_length * sin_between + half_width * cos_between
+
+    dx = x_b - x_a
+    dy = y_b - y_a
+    overlap = np.ones(len(dx), dtype=bool)
+    for angle in (angle_a, angle_b):
+        cos, sin = np.cos(angle), np.sin(angle)
+        overlap &= np.abs(dx * cos + dy * sin) <= reach_along_length
+        overlap &= np.abs(dy * cos - dx * sin) <= reach_along_width
+    return overlap
@@ -0,0 +1,124 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pytest
+import config
+from environment import Environment
+from spatial_grid import SpatialGrid, oriented_boxes_overlap
+
+
+def make_points(num_points, size, seed=0):
+    rng = np.random.default_rng(seed)
+    # Half spread over the map, half in a dense cluster, with points on the map edges
+    x = np.concatenate([rng.uniform(0, size, num_points // 2), rng.normal(size / 3, 10, num_points - num_points // 2)])
+    y = np.concatenate([rng.uniform(0, size, num_points // 2), rng.normal(size / 3, 10, num_points - num_points // 2)])
+    x[:2], y[:2] = [0, size][:num_points], [0, size][:num_points]
+    return np.clip(x, 0, size), np.clip(y, 0, size)
+
+
+def brute_force_pairs(x, y, radius):
+    distances = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+    first, second = np.nonzero(np.triu(distances <= radius, k=1))
+    return np.stack([first, second], axis=1)
+
+
+@pytest.mark.parametrize("num_points, cell_size, radius", [(0, 10, 5), (1, 10, 5), (2000, 12, 12), (2000, 50, 8)])
+def test_find_pairs_matches_brute_force(num_points, cell_size, radius):
+    x, y = make_points(num_points, size=1000)
+    grid = SpatialGrid(1000, 1000, cell_size)
+    grid.rebuild(x, y)
+
+    assert np.array_equal(grid.find_pairs(x, y, radius).reshape(-1, 2), brute_force_pairs(x, y, radius))
+
+
+def test_query_radius_matches_brute_force():
+    x, y = make_points(2000, size=1000)
+    grid = SpatialGrid(1000, 1000, 30)
+    grid.rebuild(x, y)
+
+    for i in range(0, 2000, 97):
+        expected = np.flatnonzero(np.hypot(x - x[i], y - y[i]) <= 45)
+        assert np.array_equal(grid.query_radius(x, y, x[i], y[i], 45), expected)
+
+
+def test_rebuild_follows_moving_points():
+    x, y = make_points(500, size=1000)
+    grid = SpatialGrid(1000, 1000, 20)
+    grid.rebuild(x, y)
+    x, y = make_points(500, size=1000, seed=1)
+    grid.rebuild(x, y)
+
+    assert np.array_equal(grid.find_pairs(x, y, 20), brute_force_pairs(x, y, 20))
+
+
+def test_sparse_points_on_a_large_map():
+    # A city-scale map with millions of cells and few cars, the grid only holds the occupied cells
+    x, y = make_points(1000, size=30000)
+    grid = SpatialGrid(30000, 30000, 12)
+    assert grid.num_cols * grid.num_rows > 6_000_000
+    grid.rebuild(x, y)
+
+    grid_bytes = sum(value.nbytes for value in vars(grid).values() if isinstance(value, np.ndarray))
+    assert grid_bytes <= 10 * len(x) * 8
+    assert np.array_equal(grid.find_pairs(x, y, 12).reshape(-1, 2), brute_force_pairs(x, y, 12))
+    for i in range(0, 1000, 97):
+        expected = np.flatnonzero(np.hypot(x - x[i], y - y[i]) <= 30)
+        assert np.array_equal(grid.query_radius(x, y, x[i], y[i], 30), expected)
+
+
+@pytest.mark.parametrize("x_b, y_b, angle_deg_b, expected", [
+    (0, 0, 0, True),
+    (9.9, 0, 0, True), # end to end, just touching
+    (10.1, 0, 0, False),
+    (0, 5.9, 0, True), # side by side
+    (0, 6.1, 0, False),
+    (7.9, 0, 90, True), # T shape, the crossing box reaches 3 across its width
+    (8.1, 0, 90, False),
+    (8, 8, 45, False), # diagonal, the corner of the first box misses the second
+    (7.5, 7.5, 45, True), # diagonal, the corner of the first box pokes into the second
+    (5, 4, 45, True),
+])
+def test_oriented_boxes_overlap(x_b, y_b, angle_deg_b, expected):
+    overlap = oriented_boxes_overlap(
+        np.array([0.0]), np.array([0.0]), np.array([0.0]),
+        np.array([x_b], dtype=float), np.array([y_b], dtype=float), np.array([angle_deg_b], dtype=float),
+        length=10, width=6,
+    )
+    assert overlap[0] == expected
+    # Swapping the boxes does not change the answer
+    assert oriented_boxes_overlap(
+        np.array([x_b], dtype=float), np.array([y_b], dtype=float), np.array([angle_deg_b], dtype=float),
+        np.array([0.0]), np.array([0.0]), np.array([0.0]),
+        length=10, width=6,
+    )[0] == expected
+
+
+def test_collisions_match_brute_force():
+    env = Environment(config.map_path, headless=True)
+    env.add_random_cars(1500, np.random.default_rng(0))
+    events = env.update(np.zeros((1500, 4), dtype=bool), 1 / config.fps)
+
+    x, y, angle_deg = env.fleet.x, env.fleet.y, env.fleet.angle_deg
+    first, second = np.triu_indices(1500, k=1)
+    overlap = oriented_boxes_overlap(x[first], y[first], angle_deg[first], x[second], y[second], angle_deg[second], config.car_height, config.car_width)
+    expected = np.stack([first, second], axis=1)[overlap]
+    assert len(expected) > 0
+    assert np.array_equal(events.collisions, expected)
+
+    near = env.get_cars_near(0, 80)
+    distances = np.hypot(env.fleet.x - env.fleet.x[0], env.fleet.y - env.fleet.y[0])
+    assert np.array_equal(near, np.flatnonzero(distances <= 80)[1:])
+
+
+def test_views_with_grid_match_views_without():
+    env = Environment(config.map_path, headless=True)
+    env.add_random_cars(300, np.random.default_rng(0))
+    renderer = env.observation_renderer
+    fleet = env.fleet
+
+    assert np.array_equal(env.get_views(), renderer.render_views(fleet.x, fleet.y, fleet.angle_deg))
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,107 @@
+import json
+import math
+from pathlib import Path
+import cv2
+import numpy as np
+import config
+from frame_cache import FrameCache
+from road_map import RoadMap, get_map_hash
+
+TILED_MAP_INDEX_FILE_NAME = "index.json"
+TILES_FILE_NAME = "tiles.bin"
+# The road map is kept with the tiles, so a tiled map needs neither its source image nor the road map cache
+DRIVABLE_FILE_NAME = "drivable.npy"
+DISTANCE_FILE_NAME = "distance.npy"
+
+def is_tiled_map(map_path:Path) -> bool:
+    return (Path(map_path) / TILED_MAP_INDEX_FILE_NAME).exists()
+
+class ArrayMap:
+    """A map held in memory as one (h,w,3) uint8 RGB array"""
+    def __init__(self, map_array:np.ndarray):
+        self.map_array = map_array
+        self.height, self.width = map_array.shape[:2]
+
+    def read_region(self, x0:int, y0:int, x1:int, y1:int, out:np.ndarray) -> np.ndarray:
+        """Copy the map pixels of rows y0 to y1 and columns x0 to x1, which lie inside the map, into out"""
+        np.copyto(out, self.map_array[y0:y1, x0:x1])
+        return out
+
+class TiledMap:
+    """
+    A map cut into square tiles stored in one memory-mapped file.
+    Reads only touch the tiles under the region read. Tiles that were read are copied into an LRU
+    cache bounded by a memory budget, so the resident memory does not grow with the map.
+    """
+    def __init__(self, tiled_map_dir:Path, cache_bytes:int = config.map_tile_cache_mb * 2**20):
+        self.tiled_map_dir = Path(tiled_map_dir)
+        with open(self.tiled_map_dir / TILED_MAP_INDEX_FILE_NAME, "r") as f:
+            self.index = json.load(f)
+
+        self.width = self.index["width"]
+        self.height = self.index["height"]
+        self.tile_size = self.index["tile_size"]
+        self.num_tile_rows = math.ceil(self.height / self.tile_size)
+        self.num_tile_cols = math.ceil(self.width / self.tile_size)
+        self.tiles = np.memmap(
+            self.tiled_map_dir / TILES_FILE_NAME,
+            dtype=np.uint8,
+            mode="r",
+            shape=(self.num_tile_rows, self.num_tile_cols, self.tile_size, self.tile_size, 3),
+        )
+        self.tile_cache = FrameCache(cache_bytes)
+
+    def get_tile(self, tile_row:int, tile_col:int) -> np.ndarray:
+        tile = self.tile_cache.get((tile_row, tile_col))
+        if tile is None:
+            tile = np.array(self.tiles[tile_row, tile_col])
+            self.tile_cache.put((tile_row, tile_col), tile)
+        return tile
+
+    def read_region(self, x0:int, y0:int, x1:int, y1:int, out:np.ndarray) -> np.ndarray:
+        """Copy the map pixels of rows y0 to y1 and columns x0 to x1, which lie inside the map, into out"""
+        size = self.tile_size
+        for tile_row in range(y0 // size, (y1 - 1) // size + 1):
+            for tile_col in range(x0 // size, (x1 - 1) // size + 1):
+                tile = self.get_tile(tile_row, tile_col)
+                # The part of the region inside this tile, in map coordinates
+                top, bottom = max(y0, tile_row * size), min(y1, (tile_row + 1) * size)
+                left, right = max(x0, tile_col * size), min(x1, (tile_col + 1) * size)
+                out[top - y0:bottom - y0, left - x0:right - x0] = tile[top - tile_row * size:bottom - tile_row * size, left - tile_col * size:right - tile_col * size]
+        return out
+
+    def load_road_map(self) -> RoadMap:
+        """The road map built from the source image when the tiles were cut"""
+        return RoadMap.load(self.tiled_map_dir / DRIVABLE_FILE_NAME, self.tiled_map_dir / DISTANCE_FILE_NAME)
+
+def build_tiled_map(map_path:Path, tiled_map_dir:Path, tile_size:int = config.map_tile_size) -> TiledMap:
+    """
+    Cut the map image into tiles and build its road map into the tiled map directory.
+    The image is decoded once for both, the tiles are written one row of tiles at a time.
+    """
+    map_array = cv2.cvtColor(cv2.imread(str(map_path)), cv2.COLOR_BGR2RGB)
+    height, width = map_array.shape[:2]
+
+    tiled_map_dir.mkdir(parents=True, exist_ok=True)
+    num_tile_cols = math.ceil(width / tile_size)
+    with open(tiled_map_dir / TILES_FILE_NAME, "wb") as f:
+        for tile_y in range(0, height, tile_size):
+            # Pad the last row and column of tiles with black
+            tile_row = np.zeros((tile_size, num_tile_cols * tile_size, 3), dtype=np.uint8)
+            rows = map_array[tile_y:tile_y + tile_size]
+            tile_row[:len(rows), :width] = rows
+            f.write(tile_row.reshape(tile_size, num_tile_cols, tile_size, 3).transpose(1, 0, 2, 3).tobytes())
+
+    RoadMap.from_array(map_array).save(tiled_map_dir / DRIVABLE_FILE_NAME, tiled_map_dir / DISTANCE_FILE_NAME)
+    del map_array
+    index = {
+        "width": width,
+        "height": height,
+        "tile_size": tile_size,
+        "map_hash": get_map_hash(map_path),
+        "source": str(map_path),
+    }
+    with open(tiled_map_dir / TILED_MAP_INDEX_FILE_NAME, "w") as f:
+        json.dump(index, f, indent=2)
+
+    return TiledMap(tiled_map_dir)
@@ -0,0 +1,110 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import shutil
+import cv2
+import numpy as np
+import pygame
+import pytest
+from environment import Environment
+from tiled_map import ArrayMap, TiledMap, build_tiled_map, is_tiled_map
+
+
+@pytest.fixture
+def map_path(tmp_path):
+    """A noisy map with a grey road, 300 by 250 pixels so the last row and column of tiles are partial"""
+    map_image = np.random.default_rng(0).integers(0, 256, size=(250, 300, 3), dtype=np.uint8)
+    map_image[100:150] = 110
+    map_path = tmp_path / "map.png"
+    cv2.imwrite(str(map_path), map_image)
+    return map_path
+
+
+@pytest.fixture
+def tiled_map(map_path, tmp_path):
+    return build_tiled_map(map_path, tmp_path / "tiled", tile_size=64)
+
+
+@pytest.mark.parametrize("x0, y0, x1, y1", [
+    (0, 0, 300, 250), # the whole map
+    (10, 20, 40, 50), # inside one tile
+    (50, 60, 140, 200), # across tile boundaries
+    (250, 200, 300, 250), # the partial tiles
+])
+def test_tiled_region_matches_image(map_path, tiled_map, x0, y0, x1, y1):
+    array_map = ArrayMap(cv2.cvtColor(cv2.imread(str(map_path)), cv2.COLOR_BGR2RGB))
+    expected = array_map.read_region(x0, y0, x1, y1, out=np.empty((y1 - y0, x1 - x0, 3), dtype=np.uint8))
+    region = tiled_map.read_region(x0, y0, x1, y1, out=np.empty((y1 - y0, x1 - x0, 3), dtype=np.uint8))
+
+    assert is_tiled_map(tiled_map.tiled_map_dir)
+    assert not is_tiled_map(map_path)
+    assert np.array_equal(region, expected)
+
+
+def test_tile_cache_stays_in_budget(tiled_map):
+    tile_bytes = 64 * 64 * 3
+    tiled_map = TiledMap(tiled_map.tiled_map_dir, cache_bytes=4 * tile_bytes)
+    out = np.empty((250, 300, 3), dtype=np.uint8)
+    tiled_map.read_region(0, 0, 300, 250, out=out)
+
+    assert tiled_map.tile_cache.num_bytes == 4 * tile_bytes
+
+
+def test_environment_on_tiled_map_matches_image(map_path, tiled_map):
+    image_env = Environment(map_path, headless=True, road_map_cache_dir=map_path.parent / "map_cache")
+    tiled_env = Environment(tiled_map.tiled_map_dir, headless=True)
+    assert (tiled_env.map_width, tiled_env.map_height) == (image_env.map_width, image_env.map_height)
+
+    for env in (image_env, tiled_env):
+        env.add_random_cars(20, np.random.default_rng(0))
+        for _ in range(5):
+            env.update(actions=np.tile([False, True, True, False], (20, 1)), dt=0.1)
+
+    assert np.array_equal(tiled_env.get_views(), image_env.get_views())
+    assert np.array_equal(tiled_env.get_road_distances(), image_env.get_road_distances())
+
+    # Rendering a region only reads the tiles under it, and matches the full render of the image map
+    image_surface = image_env.render()
+    region = tiled_env.render_region(40, 60, 200, 120)
+    expected = pygame.surfarray.array3d(image_surface)[40:240, 60:180]
+    assert np.array_equal(pygame.surfarray.array3d(region), expected)
+    with pytest.raises(ValueError):
+        tiled_env.render()
+
+
+def get_grid_bytes(env):
+    return sum(
+        value.nbytes
+        for grid in (env.grid, env.collision_grid)
+        for value in vars(grid).values()
+        if isinstance(value, np.ndarray)
+    )
+
+
+def test_grid_memory_does_not_grow_with_the_map(tiled_map, tmp_path):
+    large_map_image = np.zeros((2000, 2000, 3), dtype=np.uint8)
+    large_map_image[1000:1200] = 110
+    large_map_path = tmp_path / "large_map.png"
+    cv2.imwrite(str(large_map_path), large_map_image)
+    large_tiled_map = build_tiled_map(large_map_path, tmp_path / "large_tiled", tile_size=256)
+
+    grid_bytes = []
+    for tiled_map_dir in (tiled_map.tiled_map_dir, large_tiled_map.tiled_map_dir):
+        env = Environment(tiled_map_dir, headless=True)
+        env.add_random_cars(50, np.random.default_rng(0))
+        env.update(np.zeros((50, 4), dtype=bool), 0.1)
+        grid_bytes.append(get_grid_bytes(env))
+    # The map has 50 times the area, the grids only hold the cars
+    assert grid_bytes[0] == grid_bytes[1]
+
+
+def test_tiled_map_is_self_contained(map_path, tiled_map, tmp_path):
+    expected = Environment(tiled_map.tiled_map_dir, headless=True).road_map.distance
+
+    # A copy of the tiled map works without the source image or the road map cache
+    moved_dir = tmp_path / "moved"
+    shutil.copytree(tiled_map.tiled_map_dir, moved_dir)
+    map_path.unlink()
+    env = Environment(moved_dir, headless=True)
+    assert np.array_equal(env.road_map.distance, expected)
+    assert env.road_map.drivable[110:140].all()
@@ -0,0 +1,148 @@
+import multiprocessing
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+import numpy as np
+import config
+
+def run_environment_worker(
+    connection: Connection,
+    map_path: Path,
+    num_cars: int,
+    seed: int | None,
+    views_name: str,
+    actions_name: str,
+    views_shape: tuple[int, ...],
+    actions_shape: tuple[int, ...],
+    env_index: int,
+    road_map_cache_dir: Path,
+):
+    """
+    Run one Environment in a worker process.
+    The worker reads its cars' actions from and renders its cars' views into the shared
+    buffers of the VectorEnvironment, the connection only carries the commands.
+    """
+    # Imported here so the environment and pygame are only set up in the worker
+    from environment import Environment
+
+    views_memory = SharedMemory(name=views_name)
+    actions_memory = SharedMemory(name=actions_name)
+    try:
+        rows = slice(env_index * num_cars, (env_index + 1) * num_cars)
+        views = np.ndarray(views_shape, dtype=np.uint8, buffer=views_memory.buf)[rows]
+        actions = np.ndarray(actions_shape, dtype=bool, buffer=actions_memory.buf)[rows]
+
+        env = Environment(map_path, headless=True, road_map_cache_dir=road_map_cache_dir)
+        env.add_random_cars(num_cars, np.random.default_rng(seed))
+
+        while True:
+            command, dt = connection.recv()
+            if command == "step":
+                env.update(actions=actions, dt=dt)
+                env.get_views(out=views)
+            elif command == "observe":
+                env.get_views(out=views)
+            elif command == "close":
+                break
+            connection.send(None)
+    finally:
+        # Drop the array views before the shared memory is unmapped
+        views = actions = None
+        views_memory.close()
+        actions_memory.close()
+        connection.close()
+
+class VectorEnvironment:
+    """
+    Runs num_envs independent Environments of num_cars cars each in worker processes.
+    The views of all cars of all environments are stacked into one (num_envs * num_cars, h, w, c)
+    array in shared memory, and the actions are passed in through a second shared array,
+    so stepping the environments only sends a short command to each worker.
+    The rows of environment k are k * num_cars to (k + 1) * num_cars.
+    """
+    def __init__(self,
+        num_envs: int,
+        num_cars: int = config.num_cars,
+        map_paths: Path | list[Path] = config.map_path,
+        seeds: list[int | None] | None = None,
+        road_map_cache_dir: Path = config.road_map_cache_dir,
+    ):
+        if not isinstance(map_paths, list):
+            map_paths = [map_paths] * num_envs
+        if seeds is None:
+            seeds = list(range(num_envs))
+        if len(map_paths) != num_envs or len(seeds) != num_envs:
+            raise ValueError(f"Expected {num_envs} map paths and seeds, got {len(map_paths)} and {len(seeds)}")
+
+        self.num_envs = num_envs
+        self.num_cars = num_cars
+
+        views_shape = (num_envs * num_cars, config.view_height, config.view_width, 3)
+        actions_shape = (num_envs * num_cars, 4)
+        self.views_memory = SharedMemory(create=True, size=int(np.prod(views_shape)))
+        self.actions_memory = SharedMemory(create=True, size=int(np.prod(actions_shape)))
+        self.views = np.ndarray(views_shape, dtype=np.uint8, buffer=self.views_memory.buf)
+        self.actions = np.ndarray(actions_shape, dtype=bool, buffer=self.actions_memory.buf)
+        self.actions[:] = False
+
+        # Spawned workers start clean instead of inheriting a copy of pygame and torch
+        context = multiprocessing.get_context("spawn")
+        self.connections: list[Connection] = []
+        self.workers: list[multiprocessing.process.BaseProcess] = []
+        for env_index, (map_path, seed) in enumerate(zip(map_paths, seeds)):
+            connection, worker_connection = context.Pipe()
+            worker = context.Process(
+                target=run_environment_worker,
+                args=(worker_connection, map_path, num_cars, seed, self.views_memory.name, self.actions_memory.name, views_shape, actions_shape, env_index, road_map_cache_dir),
+                daemon=True,
+            )
+            worker.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.workers.append(worker)
+
+    def __len__(self) -> int:
+        return self.num_envs * self.num_cars
+
+    def send_command(self, command: str, dt: float = 0.0):
+        """Send the command to every worker, then wait until all of them are done"""
+        for connection in self.connections:
+            connection.send((command, dt))
+        for connection in self.connections:
+            connection.recv()
+
+    def step(self, actions: np.ndarray, dt: float = 1 / config.fps) -> np.ndarray:
+        """
+        Step every environment with the (num_envs * num_cars, 4) actions and return the new views.
+        The returned array is the shared view buffer, it is overwritten by the next step or observe.
+        """
+        self.actions[:] = actions
+        self.send_command("step", dt)
+        return self.views
+
+    def observe(self) -> np.ndarray:
+        """Render and return the views of all cars, in the shared view buffer"""
+        self.send_command("observe")
+        return self.views
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", 0.0))
+        for worker in self.workers:
+            worker.join()
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        self.workers = []
+
+        del self.views, self.actions
+        self.views_memory.close()
+        self.views_memory.unlink()
+        self.actions_memory.close()
+        self.actions_memory.unlink()
+
+    def __enter__(self) -> "VectorEnvironment":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
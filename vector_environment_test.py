@@ -0,0 +1,41 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pytest
+import config
+from environment import Environment
+from vector_environment import VectorEnvironment
+
+
+def test_vector_environment_matches_single_environments():
+    num_envs, num_cars, seeds = 2, 3, [3, 4]
+    rng = np.random.default_rng(0)
+    actions = rng.integers(0, 2, size=(5, num_envs * num_cars, 4)).astype(bool)
+
+    envs = []
+    for seed in seeds:
+        env = Environment(config.map_path, headless=True)
+        env.add_random_cars(num_cars, np.random.default_rng(seed))
+        envs.append(env)
+
+    with VectorEnvironment(num_envs, num_cars=num_cars, seeds=seeds) as vector_env:
+        assert len(vector_env) == num_envs * num_cars
+        views = vector_env.observe()
+        assert views.shape == (num_envs * num_cars, config.view_height, config.view_width, 3)
+        assert np.array_equal(views, np.concatenate([env.get_views() for env in envs]))
+
+        for step_actions in actions:
+            views = vector_env.step(step_actions)
+            for env, env_actions in zip(envs, np.split(step_actions, num_envs)):
+                env.update(env_actions, 1 / config.fps)
+            assert np.array_equal(views, np.concatenate([env.get_views() for env in envs]))
+
+
+def test_vector_environment_checks_arguments():
+    with pytest.raises(ValueError):
+        VectorEnvironment(2, seeds=[1])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])